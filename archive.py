@@ -0,0 +1,218 @@
+# Cold storage of the old ticks (--archive).
+# The ticks older than settings.archive_after_days are moved out of the database into columnar files, one
+# directory per coin and one pair of .npy files per month (UTC):
+#
+#   <settings.archive_dir>/<coin>/<YYYY-MM>.timestamps.npy   (int64, ascending)
+#   <settings.archive_dir>/<coin>/<YYYY-MM>.prices.npy       (int64, price * 10^scale; check db.py)
+#
+# The files are plain numpy arrays, so they are memory-mapped instead of being read, and a scan only touches
+# the months it needs. The archived months are listed in the archived_months table; they are considered
+# closed, so ticks arriving later for them are dropped (check db.unique_ticks). query_range() combines the
+# archive with the ticks still in the database.
+
+import io
+import os
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+import settings
+import db
+from files import atomic_write
+
+
+def month_start(timestamp):
+    """
+    Returns: the unix timestamp of the start of the (UTC) month of timestamp
+    """
+
+    date = datetime.fromtimestamp(timestamp, timezone.utc)
+
+    return int(datetime(date.year, date.month, 1, tzinfo=timezone.utc).timestamp())
+
+
+def next_month(start):
+    """
+    Returns: the unix timestamp of the start of the month after the one starting at start
+    """
+
+    date = datetime.fromtimestamp(start, timezone.utc)
+    year, month = (date.year + 1, 1) if date.month == 12 else (date.year, date.month + 1)
+
+    return int(datetime(year, month, 1, tzinfo=timezone.utc).timestamp())
+
+
+def month_paths(base, start, archive_dir=None):
+    """
+    Returns: the paths of the timestamps and the prices files of the month of a coin
+    """
+
+    name = datetime.fromtimestamp(start, timezone.utc).strftime('%Y-%m')
+    prefix = os.path.join(archive_dir or settings.archive_dir, base, name)
+
+    return f"{prefix}.timestamps.npy", f"{prefix}.prices.npy"
+
+
+def load_month(base, start, archive_dir=None):
+    """
+    Returns: (timestamps, prices) of an archived month # read-only memory-mapped int64 arrays; the prices are scaled
+    """
+
+    timestamps_path, prices_path = month_paths(base, start, archive_dir)
+
+    return np.load(timestamps_path, mmap_mode='r'), np.load(prices_path, mmap_mode='r')
+
+
+def save_array(path, array):
+    buffer = io.BytesIO()
+    np.save(buffer, array)
+    atomic_write(path, buffer.getbuffer())
+
+
+def archive_month(cursor, asset_id, base, start, result, archive_dir=None):
+    """
+    Moves the ticks of a month of a coin from the database to its files (a writer job, check db.Writer)
+
+    The files are written before the ticks are deleted; if the transaction is rolled back, the month isn't
+    listed in archived_months, so the files are ignored until the next run rewrites them.
+
+    Parameters:
+        - cursor: cursor to the db
+        - asset_id: id of the coin
+        - base: name of the coin
+        - start: unix timestamp of the start of the month
+        - result: a dictionary; the number of ticks moved is stored at result['moved']
+        - archive_dir: the directory of the archive (default: settings.archive_dir)
+    """
+
+    end = next_month(start)
+
+    rows = cursor.execute("SELECT timestamp, price from ticks where asset_id = ? and timestamp >= ? and timestamp < ? order by timestamp;",
+                          (asset_id, start, end)).fetchall()
+
+    data = np.array(rows, dtype=np.int64).reshape(-1, 2)
+    timestamps, prices = data[:, 0], data[:, 1]
+
+    timestamps_path, prices_path = month_paths(base, start, archive_dir)
+
+    # A gap in the data
+    if not len(timestamps) and not os.path.exists(timestamps_path):
+        result['moved'] = 0
+        return
+
+    os.makedirs(os.path.dirname(timestamps_path), exist_ok=True)
+
+    # The month might have been archived before (e.g. by an older run that was interrupted); the archived ticks win
+    if os.path.exists(timestamps_path):
+        old_timestamps, old_prices = load_month(base, start, archive_dir)
+
+        timestamps, first = np.unique(np.concatenate([old_timestamps, timestamps]), return_index=True)
+        prices = np.concatenate([old_prices, prices])[first]
+
+    save_array(timestamps_path, timestamps)
+    save_array(prices_path, prices)
+
+    cursor.execute("""INSERT INTO archived_months VALUES (?, ?, ?, ?)
+                      ON CONFLICT(asset_id, start) DO UPDATE SET count = excluded.count;""", (asset_id, start, end, len(timestamps)))
+    cursor.execute("DELETE from ticks where asset_id = ? and timestamp >= ? and timestamp < ?;", (asset_id, start, end))
+
+    result['moved'] = len(rows)
+
+
+def run_archive(older_than_days=None, archive_dir=None, vacuum=False):
+    """
+    Archives the whole months of ticks older than older_than_days, of all the coins; a writer job per month
+
+    Parameters:
+        - older_than_days: the age of the ticks to archive (default: settings.archive_after_days)
+        - archive_dir: the directory of the archive (default: settings.archive_dir)
+        - vacuum: shrink the database file afterwards (sqlite keeps the freed pages otherwise); it rewrites
+                  the whole file, so it's slow on a large database
+
+    Returns: the number of months whose ticks were moved
+    """
+
+    older_than_days = older_than_days if older_than_days is not None else settings.archive_after_days
+    # Only the months that ended before the cutoff
+    cutoff = month_start(int(time.time()) - older_than_days * 24 * 60 * 60)
+
+    writer = db.get_writer()
+    results = []
+
+    with db.reader() as conn:
+        cursor = conn.cursor()
+
+        for base, (asset_id, _) in db.read_assets(cursor).items():
+            oldest = cursor.execute("SELECT min(timestamp) from ticks where asset_id = ?;", (asset_id,)).fetchone()[0]
+
+            if oldest is None:
+                continue
+
+            start = month_start(oldest)
+            while start < cutoff:
+                results.append({})
+                writer.submit(archive_month, asset_id, base, start, results[-1], archive_dir)
+                start = next_month(start)
+
+    writer.flush()
+
+    # The months without ticks (gaps in the data) don't count, nor the jobs that failed (and were rolled back)
+    months = sum(result.get('moved', 0) > 0 for result in results)
+
+    if vacuum and months:
+        conn = db.connect()
+        conn.execute("VACUUM;")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE);")
+        conn.close()
+
+    return months
+
+
+def query_range(cursor, base, start, end=None, archive_dir=None):
+    """
+    The prices of a coin between start and end (inclusive), from the archive and the database
+
+    Parameters:
+        - cursor: cursor to the db
+        - base: name of the coin
+        - start: unix timestamp
+        - end: unix timestamp (default: no upper limit)
+        - archive_dir: the directory of the archive (default: settings.archive_dir)
+
+    Returns: (timestamps, prices) in ascending order # numpy arrays: int64, float64
+    """
+
+    if not (asset := db.get_asset(cursor, base)):
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+    asset_id, scale = asset
+    end = end if end is not None else 2 ** 62
+
+    months = cursor.execute("SELECT start from archived_months where asset_id = ? and end > ? and start <= ? order by start;",
+                            (asset_id, start, end)).fetchall()
+
+    parts_timestamps, parts_prices = [], []
+
+    for (month,) in months:
+        timestamps, prices = load_month(base, month, archive_dir)
+
+        # Only the pages of the range are read from the memory-mapped files
+        first = np.searchsorted(timestamps, start, side='left')
+        last = np.searchsorted(timestamps, end, side='right')
+        parts_timestamps.append(timestamps[first:last])
+        parts_prices.append(prices[first:last] / 10 ** scale)
+
+    hot_timestamps, hot_prices = db.price_range(cursor, base, start, end)
+    parts_timestamps.append(hot_timestamps)
+    parts_prices.append(hot_prices)
+
+    timestamps = np.concatenate(parts_timestamps)
+    prices = np.concatenate(parts_prices)
+
+    if len(months):
+        # Just in case a tick made it into both places
+        timestamps, first = np.unique(timestamps, return_index=True)
+        prices = prices[first]
+
+    return timestamps, prices
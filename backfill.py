@@ -0,0 +1,170 @@
+# Backfill (--backfill): seeds the database with the long history that the api already returns.
+# The document of every coin (check schema.py) has the points of 'all', 'year' and 'month' (the collector only
+# keeps up with the recent ones). The documents are fetched concurrently, and every coin is loaded as a single
+# writer job (one transaction), as soon as its document arrives. The coins that were loaded are recorded in
+# a checkpoint file, so an interrupted backfill picks up where it stopped.
+
+import asyncio
+import json
+import os
+from datetime import datetime
+from itertools import repeat
+
+import numpy as np
+
+import settings
+import db
+import parse
+from files import atomic_write
+from candles import update_candles
+from gaps import update_gaps
+from indicators import update_indicators
+from collector import open_session, fetch_document, list_assets
+
+# The intervals of the document that are loaded, from the coarsest to the finest
+HISTORY = ['all', 'year', 'month']
+
+
+def history_points(data, scale, intervals=HISTORY):
+    """
+    Extracts the historical points of an api response
+
+    Parameters:
+        - data: The dictionary holding the api response
+        - scale: number of decimals kept of the prices
+        - intervals: the intervals of the document to take the points from
+
+    Returns: (timestamps, prices) # int64 numpy arrays in ascending order of time, without repeated timestamps;
+             the prices are scaled: price * 10^scale
+    """
+
+    converted = [parse.points((data['prices'].get(interval) or {}).get('prices', []), 0, scale) for interval in intervals]
+
+    timestamps = np.concatenate([np.empty(0, dtype=np.int64)] + [timestamps for timestamps, _ in converted])
+    prices = np.concatenate([np.empty(0, dtype=np.int64)] + [prices for _, prices in converted])
+
+    # The finer intervals come last, so their point is kept when a timestamp repeats
+    timestamps, last = np.unique(timestamps[::-1], return_index=True)
+
+    return timestamps, prices[::-1][last]
+
+
+def load_history(cursor, assets, indicator_states, data, timestamps, prices, scale, result):
+    """
+    Inserts the historical points of a coin (a writer job, check db.Writer); the points that are already stored are skipped
+
+    Parameters:
+        - cursor: cursor to the db
+        - assets: name -> (asset_id, scale) <dict>
+        - indicator_states: asset_id -> the state of the indicators <dict> (check indicators.update_indicators)
+        - data: The dictionary holding the api response
+        - timestamps: unix timestamps in ascending order <numpy array>
+        - prices: the scaled prices corresponding to the timestamps <numpy array>
+        - scale: number of decimals of the prices
+        - result: a dictionary; the number of ticks inserted is stored at result['inserted']
+    """
+
+    asset_id, stored_scale = db.register_asset(cursor, assets, data['base'], data.get('base_id'), data.get('currency', settings.currency), scale)
+
+    if stored_scale != scale:
+        prices = np.rint(prices * 10.0 ** (stored_scale - scale)).astype(np.int64)
+
+    timestamps, prices = db.unique_ticks(cursor, asset_id, timestamps, prices)
+
+    rows = list(zip(repeat(asset_id), timestamps.tolist(), prices.tolist()))
+    cursor.executemany("INSERT INTO ticks VALUES (?, ?, ?);", rows)
+    update_gaps(cursor, asset_id, timestamps)
+    update_candles(cursor, asset_id, timestamps, prices)
+    if len(timestamps):
+        update_indicators(cursor, asset_id, stored_scale, int(timestamps[0]), indicator_states)
+
+    result['inserted'] = len(rows)
+
+
+class Checkpoint:
+    """
+    The coins that are already loaded; kept in a json file: name -> {'points', 'inserted', 'first', 'last', 'loaded_at'}
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.done = {}
+
+        if os.path.exists(path):
+            with open(path) as fp:
+                self.done = json.load(fp)
+
+    def __contains__(self, base):
+        return base in self.done
+
+    def mark(self, base, **info):
+        self.done[base] = {**info, 'loaded_at': datetime.now().isoformat(timespec='seconds')}
+
+        atomic_write(self.path, json.dumps(self.done, indent=2))
+
+
+async def run_backfill(assets, checkpoint_file=None, restart=False):
+    """
+    Fetches the documents of the coins concurrently, and loads their history into the database
+
+    Parameters:
+        - assets: name -> base_id <dict>; a base_id can be None, then it's looked up with collector.list_assets()
+        - checkpoint_file: the checkpoint (default: settings.backfill_checkpoint)
+        - restart: load all the coins again, even if the checkpoint has them
+
+    Returns: the number of ticks inserted per coin <dict>
+    """
+
+    checkpoint = Checkpoint(checkpoint_file or settings.backfill_checkpoint)
+    writer = db.get_writer()
+    inserted = {}
+
+    pending = {base: base_id for base, base_id in assets.items() if restart or base not in checkpoint}
+    if len(pending) < len(assets):
+        print(f"Skipping {len(assets) - len(pending)} coin(s) loaded before (check {checkpoint.path})")
+
+    semaphore = asyncio.Semaphore(settings.max_concurrent_requests)
+
+    async with open_session() as session:
+        if any(base_id is None for base_id in pending.values()):
+            known = await list_assets(session)
+            pending = {base: base_id or known.get(base) for base, base_id in pending.items()}
+
+        for base in [base for base, base_id in pending.items() if base_id is None]:
+            print(f"{base}: Unknown coin")
+            del pending[base]
+
+        async def fetch(base, base_id):
+            return base, await fetch_document(session, semaphore, base, base_id)
+
+        for task in asyncio.as_completed([fetch(base, base_id) for base, base_id in pending.items()]):
+            base, data = await task
+
+            if not data:
+                continue
+
+            # The number of decimals of the prices (check schema.py)
+            scale = parse.scale_of(data)
+            timestamps, prices = history_points(data, scale)
+
+            if not len(timestamps):
+                print(f"{base}: No history")
+                continue
+
+            # A single job, so the coin is written in a single transaction; the rest keep downloading meanwhile
+            result = {}
+            writer.submit(load_history, writer.assets, writer.indicator_states, data, timestamps, prices, scale, result)
+            await asyncio.to_thread(writer.flush)
+
+            if 'inserted' not in result:
+                # The job failed (and was rolled back); it's retried on the next run
+                continue
+
+            checkpoint.mark(base, points=len(timestamps), inserted=result['inserted'],
+                            first=int(timestamps[0]), last=int(timestamps[-1]))
+            inserted[base] = result['inserted']
+
+            first, last = (datetime.fromtimestamp(int(x)).strftime('%Y-%m-%d') for x in (timestamps[0], timestamps[-1]))
+            print(f"{base}: {result['inserted']} new of {len(timestamps)} points ({first} - {last})")
+
+    return inserted
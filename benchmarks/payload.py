@@ -0,0 +1,130 @@
+# Synthetic api responses for the benchmarks (they follow schema.py), or a recorded one.
+#
+# To record a real response (for --payload of run.py):
+#   import json, requests
+#   r = requests.get('https://www.coinbase.com/api/v2/assets/prices/d85dce9b-5b73-5c3c-8978-522ce1d1c1b4?base=CAD')
+#   with open('payload.json', 'w') as fp:
+#       json.dump(r.json(), fp)
+
+import json
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+# interval -> (seconds covered, number of points); roughly what coinbase returns
+INTERVALS = {
+    'hour': (60 * 60, 360),
+    'day': (60 * 60 * 24, 288),
+    'week': (60 * 60 * 24 * 7, 336),
+    'month': (60 * 60 * 24 * 30, 720),
+    'year': (60 * 60 * 24 * 365, 365),
+    'all': (60 * 60 * 24 * 365 * 5, 1826),
+}
+
+
+def price_document(base='ETH', base_id='d85dce9b-5b73-5c3c-8978-522ce1d1c1b4', now=None, start_price=2000.0, scale=2, seed=None):
+    """
+    Generates the 'data' field of a response of https://www.coinbase.com/api/v2/assets/prices/<base_id>?base=CAD
+
+    Parameters:
+        - base: name of the coin
+        - base_id: coinbase's uuid of the coin
+        - now: unix timestamp of the latest price (default: now)
+        - start_price: the latest price is around this price
+        - scale: number of decimals of the prices
+        - seed: seed of the random walk
+
+    Returns: the document <dict> (check schema.py)
+    """
+
+    rng = np.random.default_rng(seed)
+    now = int(now if now is not None else time.time())
+    latest = start_price * float(np.exp(rng.normal(0, 0.001)))
+
+    prices = {}
+    for interval, (span, n) in INTERVALS.items():
+        step = span // n
+        # A random walk backwards in time from the latest price; the newest point comes first (like the api)
+        walk = latest * np.exp(np.cumsum(rng.normal(0, 0.002 * np.sqrt(step / 60), n)))
+        timestamps = now - step * np.arange(n) - int(rng.integers(0, step))
+
+        prices[interval] = {
+            'percent_change': float(latest / walk[-1] - 1),
+            'prices': [[f"{price:.{scale}f}", int(ts)] for price, ts in zip(walk, timestamps)],
+        }
+
+    prices['latest'] = f"{latest:.{scale}f}"
+    prices['latest_price'] = {
+        'amount': {'amount': prices['latest'], 'currency': 'CAD', 'scale': scale},
+        'percent_change': {interval: prices[interval]['percent_change'] for interval in ['all', 'day', 'hour', 'month', 'week', 'year']},
+        'timestamp': datetime.fromtimestamp(now, timezone.utc).isoformat(),
+    }
+
+    return {'base': base, 'base_id': base_id, 'currency': 'CAD', 'prices': prices, 'unit_price_scale': scale}
+
+
+def assets_document(n=100, seed=None):
+    """
+    Generates the 'data' field of a response of https://www.coinbase.com/api/v2/assets/prices?base=CAD (n coins)
+    """
+
+    rng = np.random.default_rng(seed)
+    data = []
+
+    for idx in range(n):
+        latest = f"{float(rng.uniform(0.01, 50000)):.2f}"
+        data.append({
+            'base': f"C{idx}",
+            'base_id': f"00000000-0000-0000-0000-{idx:012d}",
+            'currency': 'CAD',
+            'prices': {
+                'latest': latest,
+                'latest_price': {
+                    'amount': {'amount': latest, 'currency': 'CAD', 'scale': 2},
+                    'percent_change': {interval: float(rng.normal(0, 0.02)) for interval in ['all', 'day', 'hour', 'month', 'week', 'year']},
+                    'timestamp': datetime.now(timezone.utc).isoformat(),
+                },
+            },
+            'unit_price_scale': 2,
+        })
+
+    return data
+
+
+def recorded_document(path):
+    """
+    Returns: the 'data' field of a recorded response (check the top of the file)
+    """
+
+    with open(path) as fp:
+        body = json.load(fp)
+
+    return body.get('data', body)
+
+
+def shifted(data, seconds, latest=None):
+    """
+    Returns: a copy of a document with all of its timestamps moved by seconds (to replay a recorded document as new ticks)
+
+    Parameters:
+        - data: the document
+        - seconds: the shift
+        - latest: a new latest price (a response with an unchanged latest price isn't stored, check db.insert_document)
+    """
+
+    prices = {}
+    for key, value in data['prices'].items():
+        if isinstance(value, dict) and 'prices' in value:
+            value = {**value, 'prices': [[price, ts + seconds] for price, ts in value['prices']]}
+        prices[key] = value
+
+    timestamp = datetime.fromisoformat(data['prices']['latest_price']['timestamp']).timestamp() + seconds
+    prices['latest_price'] = {**prices['latest_price'], 'timestamp': datetime.fromtimestamp(timestamp, timezone.utc).isoformat()}
+
+    if latest is not None:
+        amount = prices['latest_price']['amount']
+        prices['latest'] = f"{latest:.{amount.get('scale', 2)}f}"
+        prices['latest_price']['amount'] = {**amount, 'amount': prices['latest']}
+
+    return {**data, 'prices': prices}
@@ -0,0 +1,452 @@
+# The benchmarks of the hot paths: ingest (db.update_db), query (main.extract_last_hour_data) and render
+# (main.animate, live.BlitChart, charts.plot_interval). Everything runs against a temporary database, on the
+# Agg backend, with the synthetic api responses of payload.py:
+#
+#   python benchmarks/run.py --out results.json                          # measure
+#   python benchmarks/run.py --out new.json --baseline results.json      # measure, then compare
+#   python benchmarks/run.py --compare new.json results.json             # compare two results
+#
+# Every metric is measured a few times (after a warmup) and the median is reported, along with the samples.
+# The comparison fails (exit code 1) if a metric got worse than the baseline by more than --threshold.
+
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import sqlite3
+import platform
+import argparse
+import tempfile
+import subprocess
+from datetime import datetime
+from contextlib import redirect_stdout
+from itertools import repeat
+from statistics import median
+
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+
+# The modules of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import settings
+import db
+import parse
+import series
+from live import RingBuffer, BlitChart
+from charts import plot_interval
+from main import animate, update_axis, extract_last_hour_data, set_datetime_axis
+
+from payload import price_document, recorded_document, shifted
+
+# 10^3 - 10^7 rows
+DEFAULT_SIZES = [3, 4, 5, 6, 7]
+# Seconds between the ticks loaded for the query benchmarks (the live graph fetches every 10 seconds)
+TICK_SPACING = 10
+
+
+def measure(fn, runs=7, warmup=1):
+    """
+    Runs fn repeatedly
+
+    Returns: the durations of the runs in seconds (the warmup runs are dropped)
+    """
+
+    samples = []
+
+    for idx in range(warmup + runs):
+        start = time.perf_counter()
+        fn()
+        if idx >= warmup:
+            samples.append(time.perf_counter() - start)
+
+    return samples
+
+
+def metric(samples, unit, better='lower', scale=1, **info):
+    """
+    Returns: the record of a metric; the value is the median of the samples (multiplied by scale)
+    """
+
+    values = [s * scale for s in samples]
+
+    return {'value': median(values), 'unit': unit, 'better': better, 'samples': values, **info}
+
+
+def load_ticks(cursor, assets, base, timestamps, prices):
+    """
+    Inserts raw ticks of a coin (a writer job, check db.Writer); the query benchmarks don't need the candles or the indicators
+    """
+
+    asset_id, _ = db.register_asset(cursor, assets, base, None, settings.currency, 2)
+    cursor.executemany("INSERT INTO ticks VALUES (?, ?, ?) ON CONFLICT DO NOTHING;",
+                       zip(repeat(asset_id), timestamps.tolist(), prices.tolist()))
+
+
+def fill(base, count, end, spacing=TICK_SPACING, chunk=1_000_000, seed=0):
+    """
+    Stores count ticks of a coin, every spacing seconds up to end; the ticks already stored are kept, so a coin
+    can be grown from one size to the next
+
+    Returns: the number of ticks of the coin
+    """
+
+    writer = db.get_writer()
+    rng = np.random.default_rng(seed + count)
+
+    with db.reader() as conn:
+        asset = db.get_asset(conn.cursor(), base)
+        stored = conn.execute("SELECT count(*) from ticks where asset_id = ?;", (asset[0],)).fetchone()[0] if asset else 0
+
+    # The older ticks are added in front of the stored ones
+    for first in range(stored, count, chunk):
+        idx = np.arange(first, min(first + chunk, count), dtype=np.int64)
+        timestamps = end - idx * spacing
+        prices = 200_000 + np.cumsum(rng.integers(-100, 101, len(idx)))
+        writer.submit(load_ticks, writer.assets, base, timestamps, prices)
+        writer.flush()
+
+    return count
+
+
+def bench_ingest(documents, base_doc, runs):
+    """
+    update_db(): api responses per second (submitted and written)
+    """
+
+    results = {}
+    writer = db.get_writer()
+    latest = float(base_doc['prices']['latest'])
+
+    def next_document(data, offset):
+        # A minute later, and a new latest price
+        return shifted(data, offset, latest * (1 + (offset // 60 % 100 + 1) * 1e-4))
+
+    def count_ticks():
+        with db.reader() as conn:
+            return conn.execute("SELECT count(*) from ticks;").fetchone()[0]
+
+    # The first response of a coin inserts all of its history; the next ones only add the new points
+    db.update_db(shifted(base_doc, 0))
+    writer.flush()
+
+    offset = 0
+    samples, ticks = [], []
+
+    for _ in range(runs):
+        batch = [next_document(base_doc, (offset := offset + 60)) for _ in range(documents)]
+        before = count_ticks()
+
+        start = time.perf_counter()
+        for data in batch:
+            db.update_db(data)
+        writer.flush()
+        samples.append(time.perf_counter() - start)
+
+        ticks.append((count_ticks() - before) / samples[-1])
+
+    results['ingest.update_db'] = metric([documents / s for s in samples], 'documents/s', better='higher', documents=documents)
+    results['ingest.update_db.ticks'] = metric(ticks, 'ticks/s', better='higher')
+
+    # The collector writes the responses of all the coins at once
+    coins = [{**shifted(base_doc, 0), 'base': f"B{idx}", 'base_id': None} for idx in range(documents)]
+    db.update_db_batch(coins)
+    writer.flush()
+
+    def batch():
+        nonlocal offset
+        offset += 60
+        db.update_db_batch([next_document(data, offset) for data in coins])
+        writer.flush()
+
+    results['ingest.update_db_batch'] = metric([documents / s for s in measure(batch, runs)], 'documents/s', better='higher', documents=documents)
+
+    # The body of a response into the arrays (all the points, as for a coin seen the first time)
+    raw = json.dumps({'data': base_doc}).encode()
+
+    def decode():
+        for _ in range(documents):
+            parse.document(parse.loads(raw)['data'], 2)
+
+    results['ingest.decode'] = metric([documents / s for s in measure(decode, runs)], 'documents/s', better='higher',
+                                      documents=documents, backend='orjson' if parse.orjson else 'json')
+
+    return results
+
+
+def bench_query(sizes, end, runs):
+    """
+    extract_last_hour_data(): latency per number of stored ticks
+    """
+
+    results = {}
+
+    for exponent in sizes:
+        count = fill('ETH', 10 ** exponent, end)
+
+        with db.reader() as conn:
+            cursor = conn.cursor()
+            samples = measure(lambda: extract_last_hour_data(cursor), runs * 3)
+            points = len(extract_last_hour_data(cursor)[0])
+            day = measure(lambda: extract_last_hour_data(cursor, 60 * 60 * 24), runs)
+
+        results[f"query.extract_last_hour_data.1e{exponent}"] = metric(samples, 'ms', scale=1000, rows=count, points=points)
+        results[f"query.extract_last_day_data.1e{exponent}"] = metric(day, 'ms', scale=1000, rows=count)
+
+        print(f"  {count:>10} rows: {results[f'query.extract_last_hour_data.1e{exponent}']['value']:.3f} ms")
+
+    return results
+
+
+class FakeFeed:
+    """
+    Stands in for live.LiveFeed: every drain() adds the next minute to the buffer
+    """
+
+    def __init__(self, timestamps, prices):
+        self.timestamps, self.prices = timestamps, prices
+        self.next = 0
+
+    def drain(self, buffer):
+        idx = self.next % len(self.timestamps)
+        self.next += 1
+
+        return buffer.extend(self.timestamps[idx:idx + 1], self.prices[idx:idx + 1])
+
+
+def live_data(end, minutes=60 * 24, seed=0):
+    rng = np.random.default_rng(seed)
+    timestamps = end - 60 * np.arange(minutes, dtype=np.int64)[::-1]
+
+    return timestamps, 2000 + np.cumsum(rng.normal(0, 1, minutes))
+
+
+def bench_render(end, runs, frames=30):
+    """
+    The cost of a frame of the live graph (main.animate with a full redraw, and live.BlitChart), and of plot_interval()
+    """
+
+    results = {}
+    timestamps, prices = live_data(end)
+    window = settings.live_window
+
+    # A full redraw per frame (the fallback of --live)
+    fig = plt.figure(figsize=(16, 8))
+    ax = plt.subplot(111)
+    set_datetime_axis(ax)
+
+    buffer = RingBuffer(capacity=window // 60)
+    buffer.extend(timestamps[:window // 60], prices[:window // 60])
+    feed = FakeFeed(timestamps[window // 60:], prices[window // 60:])
+
+    texts = [ax.text(0, 0, ""), ax.text(0, 0, ""), ax.text(0, 0, "")]
+    line = plt.plot(*buffer.view(), color='b')[0]
+    update_axis(*buffer.view(), ax, texts)
+    fig.canvas.draw()
+
+    def frame():
+        animate(0, feed, buffer, line, ax, texts)
+        fig.canvas.draw()
+
+    results['render.animate_frame'] = metric(measure(frame, frames, warmup=3), 'ms', scale=1000)
+    plt.close(fig)
+
+    # Blitting
+    fig = plt.figure(figsize=(16, 8))
+    ax = plt.subplot(111)
+    set_datetime_axis(ax)
+
+    buffer = RingBuffer(capacity=window // 60)
+    buffer.extend(timestamps[:window // 60], prices[:window // 60])
+    feed = FakeFeed(timestamps[window // 60:], prices[window // 60:])
+
+    chart = BlitChart(ax, window)
+    chart.update(*buffer.view())
+    fig.canvas.draw()
+
+    def blit_frame():
+        feed.drain(buffer)
+        chart.update(*buffer.view())
+
+    results['render.blit_frame'] = metric(measure(blit_frame, frames, warmup=3), 'ms', scale=1000)
+    plt.close(fig)
+
+    # A year of prices, one per minute
+    year = 60 * 24 * 365
+    fill('PLOT', year, end, spacing=60)
+
+    results['render.series_sync'] = metric(measure(lambda: shutil.rmtree(settings.series_dir, ignore_errors=True) or series.sync('PLOT'), runs, warmup=0),
+                                           'ms', scale=1000, rows=year)
+
+    for name, intervals in [('hd', ['hour', 'day']), ('hdwmy', ['hour', 'day', 'week', 'month', 'year'])]:
+        def plot():
+            fig = plt.figure(figsize=(16, 8))
+            # plot_interval() prints the ranges of the intervals
+            with redirect_stdout(io.StringIO()):
+                plot_interval('PLOT', intervals, sync_first=False)
+            fig.canvas.draw()
+            plt.close(fig)
+
+        results[f"render.plot_interval.{name}"] = metric(measure(plot, runs), 'ms', scale=1000, rows=year)
+
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return
+
+
+def run(sizes, runs, documents, payload=None, only=None):
+    """
+    Runs the benchmarks in a temporary directory
+
+    Parameters:
+        - sizes: the exponents of the numbers of rows of the query benchmarks
+        - runs: number of measured runs per metric
+        - documents: number of api responses per run of the ingest benchmarks
+        - payload: a recorded api response (check payload.py), instead of the synthetic one
+        - only: the groups to run: ['ingest', 'query', 'render'] (default: all)
+
+    Returns: {'meta': ..., 'metrics': name -> {'value', 'unit', 'better', 'samples', ...}}
+    """
+
+    workdir = tempfile.mkdtemp(prefix='crypto-bench-')
+    settings.database = os.path.join(workdir, 'bench.db')
+    settings.series_dir = os.path.join(workdir, 'series')
+    settings.archive_dir = os.path.join(workdir, 'archive')
+
+    # A fixed end (a whole minute), so the runs are comparable
+    end = int(time.time()) // 60 * 60
+
+    if payload:
+        base_doc = recorded_document(payload)
+        latest = int(datetime.fromisoformat(base_doc['prices']['latest_price']['timestamp']).timestamp())
+        base_doc = {**shifted(base_doc, end - latest), 'base': 'BTC'}
+    else:
+        base_doc = price_document('BTC', base_id=None, now=end, seed=0)
+
+    metrics = {}
+
+    try:
+        db.init_db()
+        groups = only or ['ingest', 'query', 'render']
+
+        if 'ingest' in groups:
+            print("Ingest")
+            metrics.update(bench_ingest(documents, base_doc, runs))
+
+        if 'query' in groups:
+            print("Query")
+            # The ticks end now, so the last hour is full
+            metrics.update(bench_query(sizes, int(time.time()), runs))
+
+        if 'render' in groups:
+            print("Render")
+            metrics.update(bench_render(end, runs))
+    finally:
+        db.get_writer().close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    meta = {
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'numpy': np.__version__,
+        'matplotlib': matplotlib.__version__,
+        'sqlite': sqlite3.sqlite_version,
+        'sizes': sizes,
+        'repeat': runs,
+        'documents': documents,
+        'payload': os.path.basename(payload) if payload else 'synthetic',
+    }
+
+    return {'meta': meta, 'metrics': metrics}
+
+
+def compare(results, baseline, threshold=0.1):
+    """
+    Prints the metrics next to the baseline
+
+    Parameters:
+        - results: the new results (check run())
+        - baseline: the results to compare against
+        - threshold: the relative change tolerated before a metric counts as a regression
+
+    Returns: the names of the regressed metrics
+    """
+
+    regressions = []
+
+    print(f"\n{'metric':<42} {'baseline':>12} {'new':>12} {'change':>9}")
+
+    for name, new in results['metrics'].items():
+        old = baseline['metrics'].get(name)
+
+        if not old or not old['value']:
+            print(f"{name:<42} {'-':>12} {new['value']:>12.4g} {'':>9}  {new['unit']}")
+            continue
+
+        change = new['value'] / old['value'] - 1
+        # Positive means worse
+        worse = change if new['better'] == 'lower' else -change
+        flag = ''
+
+        if worse > threshold:
+            flag = 'REGRESSION'
+            regressions.append(name)
+        elif worse < -threshold:
+            flag = 'improved'
+
+        print(f"{name:<42} {old['value']:>12.4g} {new['value']:>12.4g} {change:>+9.1%}  {new['unit']} {flag}")
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks of the ingest, query and render paths")
+    parser.add_argument('--out', help="write the results to this json file")
+    parser.add_argument('--baseline', help="compare the results against this json file")
+    parser.add_argument('--compare', nargs=2, metavar=('NEW', 'BASELINE'), help="only compare two json files")
+    parser.add_argument('--threshold', type=float, default=0.1, help="tolerated relative change (default: 0.1)")
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help="exponents of the row counts of the query benchmarks (default: 3,4,5,6,7)")
+    parser.add_argument('--repeat', type=int, default=7, help="measured runs per metric (default: 7)")
+    parser.add_argument('--documents', type=int, default=50, help="api responses per ingest run (default: 50)")
+    parser.add_argument('--payload', help="a recorded api response to ingest (check payload.py)")
+    parser.add_argument('--only', help="comma separated groups: ingest,query,render")
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as new, open(args.compare[1]) as old:
+            return 1 if compare(json.load(new), json.load(old), args.threshold) else 0
+
+    results = run([int(s) for s in args.sizes.split(',')], args.repeat, args.documents, args.payload,
+                  args.only.split(',') if args.only else None)
+
+    if args.out:
+        with open(args.out, 'w') as fp:
+            json.dump(results, fp, indent=2)
+        print(f"Wrote {args.out}")
+
+    if args.baseline:
+        with open(args.baseline) as fp:
+            return 1 if compare(results, json.load(fp), args.threshold) else 0
+
+    compare(results, {'metrics': {}})
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,328 @@
+# A response cache in front of the price endpoint, shared by all the modes and processes of the host
+# (--collect, --live, --export, ...), so they make one upstream request per coin and ttl between them:
+#
+#   status, body = cache.get(url)                    # requests (e.g. main.fetch_and_update)
+#   status, body = await cache.fetch(session, url)   # aiohttp (e.g. collector.fetch_document)
+#
+# Every url has a single file in settings.cache_dir: a json line with the meta data (fetch time, ETag,
+# Last-Modified, ...) followed by the body. The files are replaced atomically, so they can be read without
+# locking; a response younger than ttl is returned straight from the file. Otherwise the file is locked
+# (flock), so only one process goes upstream while the others wait and then read its response; the request is
+# conditional (If-None-Match / If-Modified-Since), so an unchanged document comes back as a bodiless 304.
+# The concurrent fetches of the same url within a process share a single request as well.
+#
+# When coinbase rate limits (429, honoring Retry-After) or fails (5xx, network errors), the last response is
+# served for up to stale seconds instead, and no request is made until the retry time.
+
+import os
+import json
+import time
+import hashlib
+import asyncio
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from threading import Lock
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: the processes don't share the requests (the threads of a process still do)
+    fcntl = None
+
+import settings
+import metrics
+from files import atomic_write
+
+# Seconds to wait before retrying after an error, if the response doesn't say (Retry-After)
+default_backoff = 30
+
+
+class Entry:
+    """
+    A cached response: status, body <bytes>, and meta: {'url', 'fetched_at', 'etag', 'last_modified', 'retry_at'}
+    """
+
+    def __init__(self, status, body, meta):
+        self.status = status
+        self.body = body
+        self.meta = meta
+
+    def age(self):
+        return time.time() - self.meta['fetched_at']
+
+
+class Cache:
+    def __init__(self, cache_dir=None, ttl=None, stale=None):
+        """
+        Parameters:
+            - cache_dir: the directory of the files (default: settings.cache_dir)
+            - ttl: seconds a response is used without asking coinbase (default: settings.cache_ttl)
+            - stale: seconds a response is still used when coinbase fails or rate limits (default: settings.cache_stale)
+        """
+
+        self.cache_dir = cache_dir or settings.cache_dir
+        self.ttl = settings.cache_ttl if ttl is None else ttl
+        self.stale = settings.cache_stale if stale is None else stale
+
+        # url -> the request in flight (asyncio.Task), shared by the concurrent fetches
+        self.inflight = {}
+        # url -> threading.Lock, for the threads of this process
+        self.locks = {}
+        self.locks_lock = Lock()
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def path(self, url):
+        return os.path.join(self.cache_dir, hashlib.sha1(url.encode()).hexdigest()[:20])
+
+    def read(self, url):
+        """
+        Returns: the cached Entry of the url, or None
+        """
+
+        try:
+            with open(self.path(url), 'rb') as fp:
+                meta = json.loads(fp.readline())
+                return Entry(meta.pop('status'), fp.read(), meta)
+        except (OSError, ValueError, KeyError):
+            return
+
+    def write(self, url, entry):
+        path = self.path(url)
+
+        atomic_write(path, json.dumps({**entry.meta, 'status': entry.status}).encode() + b'\n' + entry.body)
+
+    def usable(self, entry, ttl, result='hit'):
+        """
+        Returns: the response to serve from the cache (status, body), or None if coinbase has to be asked
+
+        Parameters:
+            - entry: the cached Entry (or None)
+            - ttl: seconds a cached response is used
+            - result: how a fresh response is counted (check metrics.py)
+        """
+
+        if not entry:
+            return
+
+        if entry.status == 200 and entry.age() < ttl:
+            metrics.inc('cache', result=result)
+            return entry.status, entry.body
+
+        # Backing off after an error; the last good response is served meanwhile (or the error itself)
+        if time.time() < entry.meta.get('retry_at', 0):
+            if entry.status == 200 and entry.age() < self.stale:
+                metrics.inc('cache', result='stale')
+                return entry.status, entry.body
+
+            if entry.status != 200:
+                metrics.inc('cache', result='backoff')
+                return entry.status, entry.body
+
+    @contextmanager
+    def lock(self, url):
+        """
+        Locks the url for the threads of this process and the other processes (blocking)
+        """
+
+        with self.locks_lock:
+            thread_lock = self.locks.setdefault(url, Lock())
+
+        with thread_lock, open(self.path(url) + '.lock', 'w') as fp:
+            if fcntl:
+                fcntl.flock(fp, fcntl.LOCK_EX)
+            yield
+
+    def conditional_headers(self, entry):
+        """
+        Returns: the headers of a conditional request, to revalidate the cached response
+        """
+
+        headers = {}
+
+        if entry and entry.status == 200:
+            if entry.meta.get('etag'):
+                headers['If-None-Match'] = entry.meta['etag']
+            if entry.meta.get('last_modified'):
+                headers['If-Modified-Since'] = entry.meta['last_modified']
+
+        return headers
+
+    def update(self, url, entry, status, headers, body):
+        """
+        Stores the upstream response (check get() and fetch())
+
+        Parameters:
+            - url: the url
+            - entry: the cached Entry of the url (or None)
+            - status: the status of the response (None: the request failed)
+            - headers: the headers of the response
+            - body: the body of the response <bytes>
+
+        Returns: (status, body) to return to the caller
+        """
+
+        now = time.time()
+
+        if status == 304 and entry:
+            # Unchanged; only the fetch time moves
+            metrics.inc('cache', result='revalidated')
+            entry.meta['fetched_at'] = now
+            entry.meta.pop('retry_at', None)
+            self.write(url, entry)
+            return entry.status, entry.body
+
+        if status == 200:
+            metrics.inc('cache', result='miss')
+            self.write(url, Entry(status, body, {
+                'url': url,
+                'fetched_at': now,
+                'etag': headers.get('ETag'),
+                'last_modified': headers.get('Last-Modified'),
+            }))
+            return status, body
+
+        # An error: no request until the retry time; the last good response is kept (and served meanwhile)
+        metrics.inc('cache', result='error')
+        retry_at = now + retry_after(headers, default_backoff)
+
+        if entry and entry.status == 200:
+            entry.meta['retry_at'] = retry_at
+            self.write(url, entry)
+
+            if entry.age() < self.stale:
+                metrics.inc('cache', result='stale')
+                return entry.status, entry.body
+        elif status is not None:
+            self.write(url, Entry(status, body, {'url': url, 'fetched_at': now, 'retry_at': retry_at}))
+
+        return status, body
+
+    def get(self, url, ttl=None, timeout=None):
+        """
+        Fetches a url through the cache with requests
+
+        Parameters:
+            - url: the url
+            - ttl: seconds a cached response is used (default: self.ttl)
+            - timeout: seconds before the request is abandoned (default: settings.request_timeout)
+
+        Returns: (status, body <bytes>); the status is None if the request failed and nothing is cached
+        """
+
+        import requests
+
+        ttl = self.ttl if ttl is None else ttl
+
+        if (response := self.usable(self.read(url), ttl)):
+            return response
+
+        with self.lock(url):
+            # Another process (or thread) might have fetched it meanwhile
+            entry = self.read(url)
+            if (response := self.usable(entry, ttl, 'shared')):
+                return response
+
+            try:
+                r = requests.get(url, headers=self.conditional_headers(entry), timeout=timeout or settings.request_timeout)
+                return self.update(url, entry, r.status_code, r.headers, r.content)
+            except requests.RequestException:
+                return self.update(url, entry, None, {}, b'')
+
+    async def fetch(self, session, url, ttl=None):
+        """
+        Fetches a url through the cache with aiohttp; the concurrent fetches of a url share one request
+
+        Parameters:
+            - session: aiohttp.ClientSession
+            - url: the url
+            - ttl: seconds a cached response is used (default: self.ttl)
+
+        Returns: (status, body <bytes>); the status is None if the request failed and nothing is cached
+        """
+
+        ttl = self.ttl if ttl is None else ttl
+
+        if (response := self.usable(self.read(url), ttl)):
+            return response
+
+        if url in self.inflight:
+            metrics.inc('cache', result='shared')
+            return await asyncio.shield(self.inflight[url])
+
+        self.inflight[url] = task = asyncio.ensure_future(self._fetch(session, url, ttl))
+        task.add_done_callback(lambda _: self.inflight.pop(url, None))
+
+        return await asyncio.shield(task)
+
+    async def _fetch(self, session, url, ttl):
+        import aiohttp
+
+        fp = open(self.path(url) + '.lock', 'w')
+
+        try:
+            if fcntl:
+                try:
+                    fcntl.flock(fp, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    # Another process is fetching it; wait for it without blocking the event loop
+                    await asyncio.to_thread(fcntl.flock, fp, fcntl.LOCK_EX)
+
+            entry = self.read(url)
+            if (response := self.usable(entry, ttl, 'shared')):
+                return response
+
+            try:
+                async with session.get(url, headers=self.conditional_headers(entry)) as r:
+                    body = await r.read()
+                return self.update(url, entry, r.status, r.headers, body)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                return self.update(url, entry, None, {}, b'')
+        finally:
+            # Closing the file releases the lock
+            fp.close()
+
+
+def retry_after(headers, default):
+    """
+    Returns: the seconds to wait according to the Retry-After header (seconds or a date), or default
+    """
+
+    value = headers.get('Retry-After')
+
+    if not value:
+        return default
+
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return default
+
+
+_cache = None
+
+
+def get_cache():
+    """
+    Returns: the cache of the process (created on the first call)
+    """
+
+    global _cache
+
+    if _cache is None:
+        _cache = Cache()
+
+    return _cache
+
+
+def get(url, ttl=None, timeout=None):
+    return get_cache().get(url, ttl, timeout)
+
+
+async def fetch(session, url, ttl=None):
+    return await get_cache().fetch(session, url, ttl)
@@ -0,0 +1,177 @@
+# OHLC (candle stick) bars.
+# The bars are aggregated from the ticks with vectorized group-bys, and are stored in the candles table
+# (check db.py); when new ticks arrive, only the bars they fall into (normally the open one) are updated.
+
+import numpy as np
+
+# Name -> length of a bar in seconds
+BUCKETS = {
+    '1m': 60,
+    '5m': 60 * 5,
+    '1h': 60 * 60,
+    '1d': 60 * 60 * 24,
+}
+
+# The columns of a bar (in the order of the candles table, after asset_id and size)
+COLUMNS = ['start', 'open', 'high', 'low', 'close', 'first', 'last', 'count']
+
+
+def aggregate(timestamps, prices, size):
+    """
+    Groups the ticks into bars
+
+    Parameters:
+        - timestamps: unix timestamps in ascending order <numpy array>
+        - prices: the prices corresponding to the timestamps <numpy array>
+        - size: length of a bar in seconds
+
+    Returns: a dictionary of numpy arrays (one element per bar), keyed by COLUMNS:
+        start, open, high, low, close, first (timestamp of open), last (timestamp of close), count
+    """
+
+    starts = timestamps // size * size
+
+    # Index of the first and the last tick of every bar
+    first = np.flatnonzero(np.r_[True, starts[1:] != starts[:-1]])
+    last = np.r_[first[1:] - 1, len(timestamps) - 1]
+
+    return {
+        'start': starts[first],
+        'open': prices[first],
+        'high': np.maximum.reduceat(prices, first),
+        'low': np.minimum.reduceat(prices, first),
+        'close': prices[last],
+        'first': timestamps[first],
+        'last': timestamps[last],
+        'count': last - first + 1,
+    }
+
+
+def update_candles(cursor, asset_id, timestamps, prices):
+    """
+    Merges newly inserted ticks into the stored bars of all the sizes
+
+    Parameters:
+        - cursor: cursor to the db
+        - asset_id: id of the coin
+        - timestamps: unix timestamps of the new ticks in ascending order <numpy array>
+        - prices: the (scaled) prices of the new ticks <numpy array>
+    """
+
+    if not len(timestamps):
+        return
+
+    for size in BUCKETS.values():
+        bars = aggregate(timestamps, prices, size)
+
+        stored = cursor.execute(f"""SELECT {', '.join(COLUMNS)} from candles
+                                   where asset_id = ? and size = ? and start between ? and ?;""",
+                                (asset_id, size, int(bars['start'][0]), int(bars['start'][-1]))).fetchall()
+
+        if stored:
+            merge(bars, np.array(stored, dtype=np.int64))
+
+        n = len(bars['start'])
+        cursor.executemany("INSERT OR REPLACE INTO candles VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?);",
+                           zip([asset_id] * n, [size] * n, *[bars[key].tolist() for key in COLUMNS]))
+
+
+def merge(bars, stored):
+    """
+    Merges the stored bars into the new ones (in place); the ticks of the two have to be disjoint.
+
+    Parameters:
+        - bars: the new bars (check aggregate())
+        - stored: rows of COLUMNS <numpy array>
+    """
+
+    # Only the stored bars that the new ticks fall into (there might be others in between)
+    idx = np.searchsorted(bars['start'], stored[:, 0]).clip(max=len(bars['start']) - 1)
+    match = bars['start'][idx] == stored[:, 0]
+    idx, stored = idx[match], stored[match]
+
+    old = dict(zip(COLUMNS, stored.T))
+
+    older_open = old['first'] < bars['first'][idx]
+    bars['open'][idx] = np.where(older_open, old['open'], bars['open'][idx])
+    bars['first'][idx] = np.where(older_open, old['first'], bars['first'][idx])
+
+    newer_close = old['last'] > bars['last'][idx]
+    bars['close'][idx] = np.where(newer_close, old['close'], bars['close'][idx])
+    bars['last'][idx] = np.where(newer_close, old['last'], bars['last'][idx])
+
+    bars['high'][idx] = np.maximum(old['high'], bars['high'][idx])
+    bars['low'][idx] = np.minimum(old['low'], bars['low'][idx])
+    bars['count'][idx] += old['count']
+
+
+def rebuild_candles(cursor, asset_id, chunk=1_000_000):
+    """
+    Builds the bars of a coin from all of its stored ticks (e.g. after a migration)
+
+    Parameters:
+        - cursor: cursor to the db
+        - asset_id: id of the coin
+        - chunk: number of ticks aggregated at once
+    """
+
+    cursor.execute("DELETE from candles where asset_id = ?;", (asset_id,))
+
+    after = -1
+    while True:
+        rows = cursor.execute("""SELECT timestamp, price from ticks where asset_id = ? and timestamp > ?
+                                 order by timestamp limit ?;""", (asset_id, after, chunk)).fetchall()
+
+        if not rows:
+            return
+
+        data = np.array(rows, dtype=np.int64)
+        # The bars on the border of two chunks are merged by update_candles
+        update_candles(cursor, asset_id, data[:, 0], data[:, 1])
+
+        after = int(data[-1, 0])
+
+
+def draw_candles(ax, bars, width, collection=None):
+    """
+    Draws the bars as a single PolyCollection (the bodies and the wicks)
+
+    Parameters:
+        - ax: a matplotlib.Axes object
+        - bars: dictionary of numpy arrays with the keys: start, open, high, low, close (check aggregate())
+        - width: width of a bar in data coordinates (seconds)
+        - collection: the PolyCollection drawn before; if given, it's updated instead of creating a new one
+
+    Returns: the matplotlib.collections.PolyCollection
+    """
+
+    start = bars['start']
+    center = start + width / 2
+    top = np.maximum(bars['open'], bars['close'])
+    bottom = np.minimum(bars['open'], bars['close'])
+
+    def rectangles(x0, x1, y0, y1):
+        # (n, 4, 2) array of the corners
+        return np.stack([np.stack([x0, y0], axis=-1), np.stack([x0, y1], axis=-1),
+                         np.stack([x1, y1], axis=-1), np.stack([x1, y0], axis=-1)], axis=1)
+
+    bodies = rectangles(start + width * 0.1, start + width * 0.9, bottom, top)
+    wicks = rectangles(center - width * 0.02, center + width * 0.02, bars['low'], bars['high'])
+
+    # Green if the price rose during the bar, red otherwise
+    colors = np.where((bars['close'] >= bars['open'])[:, None], [0, 0.6, 0, 1], [0.8, 0, 0, 1])
+
+    verts = np.concatenate([wicks, bodies])
+    colors = np.concatenate([colors, colors])
+
+    if collection is None:
+        # Only the charts need matplotlib (the bars are also aggregated by the db writer)
+        from matplotlib.collections import PolyCollection
+
+        collection = PolyCollection(verts, facecolors=colors, linewidths=0)
+        ax.add_collection(collection)
+    else:
+        collection.set_verts(verts)
+        collection.set_facecolor(colors)
+
+    return collection
@@ -0,0 +1,65 @@
+# The static charts, which are shared between the interactive options (--viz) and the headless export (check export.py)
+
+from math import ceil
+from datetime import datetime
+
+import matplotlib.pyplot as plt
+
+import series
+
+
+def subplot_positions(n, ncols=2):
+    """
+    The layout of n subplots: a grid of ncols columns (filled row by row), where the subplots of the last row
+    share its whole width if they don't fill it. 1 or 2 subplots are stacked in a single column.
+
+    E.g. 3 -> [(2, 2, 1), (2, 2, 2), (2, 1, 2)]: two on the first row, and one spanning the second row
+
+    Parameters:
+        - n: number of subplots
+        - ncols: number of columns
+
+    Returns: a list of the (nrows, ncols, index) arguments of plt.subplot(), one per subplot
+    """
+
+    ncols = 1 if n <= 2 else ncols
+    nrows = ceil(n / ncols)
+    # The subplots of the last row
+    last = n - (nrows - 1) * ncols
+
+    positions = [(nrows, ncols, idx) for idx in range(1, (nrows - 1) * ncols + 1)]
+    positions += [(nrows, last, (nrows - 1) * last + idx) for idx in range(1, last + 1)]
+
+    return positions
+
+
+def plot_interval(base: str, which_intervals: [str], sync_first: bool = True) -> None:
+    """
+    Plots the historical price data based on given intervals.
+    
+    Parameters:
+        - base: name of the coin; its stored prices are read with series.load_interval()
+        - which_intervals: the intervals on which you wanna see the data.
+            Note: valid intervals are:
+                ['hour', 'day', 'week', 'month', 'year']
+        - sync_first: sync the memory-mapped series with the database first (check series.sync())
+    """
+
+    if sync_first:
+        series.sync(base)
+
+    positions = subplot_positions(len(which_intervals))
+
+    for idx, interval in enumerate(which_intervals):
+        #interval = which_intervals[0]
+        # int64 timestamps (a view of the memory-mapped file) and float64 prices, in ascending order
+        timestamps, prices = series.load_interval(base, interval, sync_first=False)
+
+        ax = plt.subplot(*positions[idx])
+        # The recent prices are denser (they're collected every minute), so they're plotted against the time;
+        # the trend is what matters here, so the time isn't shown
+        ax.plot(timestamps, prices)
+        ax.set_xticks([])
+        if len(timestamps):
+            print(datetime.fromtimestamp(int(timestamps[0])), datetime.fromtimestamp(int(timestamps[-1])))
+        ax.set_title(interval.capitalize())
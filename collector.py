@@ -0,0 +1,208 @@
+# Asynchronous data collection for multiple coins.
+# Every tick, the price document of every configured coin is fetched concurrently over one shared
+# (keep-alive) session, and all the documents are handed to the database in a single batch.
+
+import time
+import signal
+import asyncio
+from datetime import datetime, timedelta
+
+import aiohttp
+
+import settings
+import metrics
+import cache
+import parse
+from db import update_db_batch, get_writer
+from scheduler import Scheduler, phases
+
+
+def open_session():
+    """
+    Creates the session shared by all the requests; the connections are kept alive between ticks.
+
+    Returns: aiohttp.ClientSession
+    """
+
+    connector = aiohttp.TCPConnector(limit=settings.max_concurrent_requests, keepalive_timeout=120)
+    timeout = aiohttp.ClientTimeout(total=settings.request_timeout)
+
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+
+async def fetch_document(session, semaphore, base, base_id, ttl=None):
+    """
+    Fetches the price document of a single coin (check schema.py)
+
+    Parameters:
+        - session: aiohttp.ClientSession
+        - semaphore: asyncio.Semaphore limiting the number of requests in flight
+        - base: name of the coin <str>
+        - base_id: coinbase's uuid of the coin <str>
+        - ttl: seconds a cached response is used (default: settings.cache_ttl)
+
+    Returns: the 'data' field of the response <dict>, or None if the request failed
+    """
+
+    url = settings.prices_url.format(base_id=base_id, currency=settings.currency)
+
+    try:
+        async with semaphore:
+            # The wait for a free slot isn't part of the fetch
+            start = time.perf_counter()
+            # Through the cache shared with the other modes and processes (check cache.py)
+            status, raw = await cache.fetch(session, url, ttl)
+            metrics.observe('fetch', time.perf_counter() - start)
+
+        if status is None:
+            raise aiohttp.ClientError()
+
+        with metrics.timed('parse'):
+            body = parse.loads(raw)
+
+        if status == 200:
+            data = body['data']
+            metrics.inc('fetch_requests', result='ok')
+            return data
+
+        metrics.inc('fetch_requests', result='http_error')
+        print(f"{base}: {body['errors'][0]['message']}")
+
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        metrics.inc('fetch_requests', result='network_error')
+        print(f"{base}: Couldn't fetch the data, check you internet connection.")
+
+    except (ValueError, KeyError, TypeError):
+        metrics.inc('fetch_requests', result='bad_response')
+        print(f"{base}: Couldn't read the response.")
+
+    return
+
+
+async def collect_tick(session, semaphore, assets, ttls=None):
+    """
+    Fetches the documents of all the coins concurrently
+
+    Parameters:
+        - session: aiohttp.ClientSession
+        - semaphore: asyncio.Semaphore
+        - assets: name -> base_id <dict>
+        - ttls: name -> seconds a cached response is used <dict> (default: settings.cache_ttl for all)
+
+    Returns: a list of the documents that were fetched successfully
+    """
+
+    ttls = ttls or {}
+    documents = await asyncio.gather(*[fetch_document(session, semaphore, base, base_id, ttls.get(base))
+                                       for base, base_id in assets.items()])
+
+    return [data for data in documents if data]
+
+
+async def collect_documents(assets):
+    """
+    Fetches the documents of all the coins once (with a session of its own)
+
+    Parameters:
+        - assets: name -> base_id <dict>
+
+    Returns: a list of the documents that were fetched successfully
+    """
+
+    async with open_session() as session:
+        return await collect_tick(session, asyncio.Semaphore(settings.max_concurrent_requests), assets)
+
+
+async def run_collector(assets, stop=None, period=60, periods=None, jitter=0, missed='skip', handle=None,
+                        handle_signals=True):
+    """
+    Collects the price data of the coins on a fixed schedule (check scheduler.py) and stores it into the database
+    until stop is set, or (with handle_signals) the program gets SIGINT (Ctrl+C) or SIGTERM.
+
+    Parameters:
+        - assets: name -> base_id <dict>
+        - stop: asyncio.Event (default: one of its own)
+        - period: seconds between the ticks of a coin
+        - periods: name -> period <dict>, overrides period for some coins
+        - jitter: maximum random phase (seconds) of the ticks of a coin, to spread the requests
+        - missed: what to do with the missed ticks: 'skip' or 'catch_up'
+        - handle: a function taking the documents of a tick (default: db.update_db_batch; check shard.py)
+        - handle_signals: stop on SIGINT and SIGTERM; off in the workers of shard.py, which are stopped by the main process
+    """
+
+    stop = stop or asyncio.Event()
+    handle = handle or update_db_batch
+    loop = asyncio.get_running_loop()
+
+    signals = (signal.SIGINT, signal.SIGTERM) if handle_signals else ()
+
+    for sig in signals:
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            # Windows (or not the main thread): Ctrl+C raises KeyboardInterrupt instead
+            pass
+
+    periods = {base: (periods or {}).get(base, period) for base in assets}
+    # A cached response mustn't outlive the period of its coin, or every other tick gets the same document (which the
+    # db then drops as unchanged). The response is stored a fetch after the tick started, so it's still younger than
+    # a full period at the next tick; half of it leaves room for that
+    ttls = {base: min(cache.get_cache().ttl, periods[base] / 2) for base in assets}
+    schedule = Scheduler(missed)
+
+    for base, phase in phases(assets, jitter, periods).items():
+        schedule.add(base, periods[base], phase)
+
+    semaphore = asyncio.Semaphore(settings.max_concurrent_requests)
+
+    async with open_session() as session:
+        async def tick(bases):
+            start = time.perf_counter()
+
+            documents = await collect_tick(session, semaphore, {base: assets[base] for base in bases}, ttls)
+
+            if documents:
+                # This only queues the batch; the db writer thread does the writing
+                handle(documents)
+
+            elapsed = time.perf_counter() - start
+            metrics.observe('tick', elapsed)
+
+            print(f"Collected {len(documents)} of {len(bases)} coins")
+
+            if elapsed > min(periods[base] for base in bases):
+                # Where did the time go (check metrics.py for the rest)
+                stages = metrics.snapshot()['stages']
+                print(f"The tick took {elapsed:.1f} seconds: " + ', '.join(
+                    f"{stage} p99 {stages[stage]['p99_ms']:.0f} ms" for stage in ['fetch', 'parse', 'db_write', 'notify'] if stage in stages)
+                    + (f", {get_writer().queue.qsize()} db job(s) queued" if handle is update_db_batch else ''))
+
+            if (due := schedule.next_due()) is not None:
+                next_update_time = (datetime.now() + timedelta(seconds=max(due - time.monotonic(), 0))).astimezone().strftime('%I:%M:%S %p')
+                print(f"Next update: {next_update_time}")
+
+        await schedule.run(tick, stop)
+
+    for sig in signals:
+        try:
+            loop.remove_signal_handler(sig)
+        except (NotImplementedError, RuntimeError):
+            pass
+
+
+async def list_assets(session):
+    """
+    Fetches the base_id of all the coins listed by coinbase (first url of schema.py)
+
+    Parameters:
+        - session: aiohttp.ClientSession
+
+    Returns: name -> base_id <dict>
+    """
+
+    url = settings.assets_url.format(currency=settings.currency)
+
+    async with session.get(url) as r:
+        body = await r.json(content_type=None)
+
+    return {coin['base']: coin['base_id'] for coin in body['data']}
@@ -0,0 +1,284 @@
+# A live dashboard of many coins (dashboard): a grid of small live charts in a single figure.
+# A single background thread (DataPump) fetches the documents of all the coins concurrently (check collector.py),
+# stores them, and queues their new points. The thread that draws pushes the points into a ring buffer per coin
+# (check live.py), and redraws only the panels whose buffer changed: every panel blits its own part of the
+# figure, so a frame costs as much as the panels that changed, not as all of them. The whole figure is redrawn
+# only when the data of a panel leaves its limits (about once per margin, when the time window moves on).
+
+import time
+import asyncio
+from math import ceil, sqrt
+from queue import Queue, Empty
+from threading import Thread, Event
+
+import numpy as np
+
+import settings
+import db
+import metrics
+from charts import subplot_positions
+from live import RingBuffer, points_from_document
+
+
+class DataPump(Thread):
+    """
+    Fetches (and stores) the documents of all the coins periodically, and queues their points: base -> (timestamps, prices)
+    """
+
+    def __init__(self, assets, period=10):
+        """
+        Parameters:
+            - assets: name -> base_id <dict>
+            - period: seconds between fetches
+        """
+        super().__init__(daemon=True, name='data-pump')
+
+        self.assets = assets
+        self.period = period
+        self.updates = Queue()
+        self.stopped = Event()
+
+    def run(self):
+        asyncio.run(self.pump())
+
+    async def pump(self):
+        from collector import open_session, collect_tick
+
+        semaphore = asyncio.Semaphore(settings.max_concurrent_requests)
+
+        # A single session for all the coins, kept alive between the fetches
+        async with open_session() as session:
+            while not self.stopped.is_set():
+                start = time.monotonic()
+
+                if (documents := await collect_tick(session, semaphore, self.assets)):
+                    # Stored like with collect (and checked by the notifier)
+                    db.update_db_batch(documents)
+                    self.updates.put({data['base']: points_from_document(data) for data in documents})
+
+                await asyncio.sleep(max(self.period - (time.monotonic() - start), 0))
+
+    def drain(self, buffers):
+        """
+        Pushes the fetched points into the buffers
+
+        Parameters:
+            - buffers: base -> RingBuffer <dict>
+
+        Returns: the set of the coins whose buffer changed
+        """
+
+        changed = set()
+
+        while True:
+            try:
+                points = self.updates.get_nowait()
+            except Empty:
+                return changed
+
+            for base, (timestamps, prices) in points.items():
+                if base in buffers and buffers[base].extend(timestamps, prices):
+                    changed.add(base)
+
+
+class Panel:
+    """
+    The live chart of a coin in the dashboard: a line and two texts (the latest price, and the change over
+    the window), drawn into the axes of the panel only
+    """
+
+    def __init__(self, ax, base, window, band=0.002, margin=5 * 60):
+        """
+        Parameters:
+            - ax: a matplotlib.Axes object
+            - base: name of the coin
+            - window: seconds shown on the x-axis
+            - band: padding added above and below the prices when the y-limits are reset, relative to the price
+            - margin: seconds of empty space kept at the end of the x-axis, so that the x-limits are reset once per margin
+        """
+
+        self.ax = ax
+        self.base = base
+        self.window = window
+        self.band = band
+        self.margin = margin
+
+        self.line = ax.plot([], [], color='b', linewidth=1, animated=True)[0]
+        # Inside the axes, so a panel never draws outside of its own part of the figure
+        self.price_text = ax.text(0.02, 0.95, base, transform=ax.transAxes, va='top', fontsize='small', animated=True)
+        self.change_text = ax.text(0.98, 0.95, "", transform=ax.transAxes, va='top', ha='right', fontsize='small', animated=True)
+
+        ax.set_xticks([])
+        ax.tick_params(axis='y', labelsize='x-small')
+
+        self.background = None
+
+    @property
+    def artists(self):
+        return [self.line, self.price_text, self.change_text]
+
+    def set_data(self, timestamps, prices):
+        """
+        Updates the artists of the panel (without drawing them)
+
+        Returns: True if the limits of the panel changed (the whole figure has to be redrawn then)
+        """
+
+        if not len(timestamps):
+            return False
+
+        self.line.set_data(timestamps, prices)
+
+        change = (prices[-1] - prices[0]) / prices[0] * 100
+        self.price_text.set_text(f"{self.base}  {prices[-1]:.{decimals(prices[-1])}f}")
+        self.change_text.set(text=f"{'-' if change < 0 else '+'}{abs(change):.2f}%", color='r' if change < 0 else 'g')
+
+        changed = False
+
+        low, high = prices.min(), prices.max()
+        y0, y1 = self.ax.get_ylim()
+        if low < y0 or high > y1:
+            pad = max(high * self.band, (high - low) * 0.1)
+            self.ax.set_ylim(low - pad, high + pad)
+            changed = True
+
+        x0, x1 = self.ax.get_xlim()
+        if timestamps[-1] > x1 or timestamps[0] < x0:
+            self.ax.set_xlim(timestamps[-1] - self.window, timestamps[-1] + self.margin)
+            changed = True
+
+        return changed
+
+    def save_background(self):
+        self.background = self.ax.figure.canvas.copy_from_bbox(self.ax.bbox)
+
+    def draw(self):
+        for artist in self.artists:
+            self.ax.draw_artist(artist)
+
+    def blit(self):
+        """
+        Redraws the panel on top of its cached background
+        """
+
+        canvas = self.ax.figure.canvas
+
+        canvas.restore_region(self.background)
+        self.draw()
+        canvas.blit(self.ax.bbox)
+
+
+def decimals(price):
+    """
+    Returns: the number of decimals shown for a price (the cheap coins need more)
+    """
+
+    return 2 if price >= 1 else min(int(-np.log10(price)) + 4, 8) if price > 0 else 2
+
+
+class Dashboard:
+    """
+    The grid of the panels of the coins in a single figure
+    """
+
+    def __init__(self, fig, bases, window, ncols=None):
+        """
+        Parameters:
+            - fig: matplotlib.Figure
+            - bases: the names of the coins
+            - window: seconds shown by the panels
+            - ncols: number of columns of the grid (default: about as many as the rows)
+        """
+
+        self.fig = fig
+        self.canvas = fig.canvas
+        self.blit = self.canvas.supports_blit
+
+        ncols = ncols or ceil(sqrt(len(bases)))
+        positions = subplot_positions(len(bases), ncols)
+
+        self.panels = {base: Panel(fig.add_subplot(*position), base, window) for base, position in zip(bases, positions)}
+        # Room for the price labels between the columns, little elsewhere
+        fig.subplots_adjust(left=0.03, right=0.99, bottom=0.02, top=0.98, wspace=0.45, hspace=0.15)
+        self.redraw_pending = True
+
+        self.canvas.mpl_connect('draw_event', self._on_draw)
+
+    def update(self, buffers, changed):
+        """
+        Redraws the panels of the coins that changed
+
+        Parameters:
+            - buffers: base -> RingBuffer <dict>
+            - changed: the names of the coins whose buffer changed
+        """
+
+        for base in changed:
+            if self.panels[base].set_data(*buffers[base].view()):
+                self.redraw_pending = True
+
+        if self.redraw_pending or not self.blit:
+            # A full redraw; the backgrounds are cached by _on_draw
+            self.canvas.draw_idle()
+            return
+
+        for base in changed:
+            self.panels[base].blit()
+
+        metrics.inc('panels_drawn', len(changed))
+
+    def _on_draw(self, event):
+        """
+        Caches the background of every panel after a full redraw, and draws the animated artists on top of them
+        """
+
+        self.redraw_pending = False
+
+        for panel in self.panels.values():
+            if self.blit:
+                panel.save_background()
+            panel.draw()
+
+
+def run_dashboard(assets, window=None, period=None, interval=None, ncols=None):
+    """
+    Shows the dashboard of the coins until the window is closed
+
+    Parameters:
+        - assets: name -> base_id <dict>
+        - window: seconds shown by the panels (default: settings.live_window)
+        - period: seconds between the fetches (default: settings.live_fetch_period)
+        - interval: milliseconds between the frames (default: settings.live_frame_interval)
+        - ncols: number of columns of the grid (default: settings.dashboard_columns, or about as many as the rows)
+    """
+
+    import matplotlib.pyplot as plt
+
+    window = window or settings.live_window
+    interval = interval or settings.live_frame_interval
+
+    # The last window of every coin is kept in memory, one price per minute; it's read from the db once, and
+    # then only the fetched points are added (check live.py)
+    buffers = {base: RingBuffer(capacity=window // 60) for base in assets}
+    with db.reader() as conn:
+        for base, buffer in buffers.items():
+            buffer.extend(*db.minute_prices(conn.cursor(), base, window))
+
+    pump = DataPump(assets, period or settings.live_fetch_period)
+    pump.start()
+
+    fig = plt.figure(figsize=(16, 9))
+    dashboard = Dashboard(fig, list(assets), window, ncols or settings.dashboard_columns)
+    dashboard.update(buffers, set(assets))
+
+    def redraw():
+        if (changed := pump.drain(buffers)):
+            with metrics.timed('render'):
+                dashboard.update(buffers, changed)
+
+    timer = fig.canvas.new_timer(interval=interval)
+    timer.add_callback(redraw)
+    timer.start()
+
+    plt.show()
+    pump.stopped.set()
@@ -1,42 +1,340 @@
-import requests, json
-import matplotlib.pyplot as plt
 import numpy as np
-from datetime import datetime
 import sqlite3
+import time
+import atexit
+from queue import Queue, Empty
+from threading import Thread, Lock
+from contextlib import contextmanager
+from itertools import repeat
 
-def update_db(data):
+import settings
+import metrics
+import parse
+from parse import INTERVALS
+from candles import BUCKETS, COLUMNS as CANDLE_COLUMNS, update_candles, rebuild_candles
+from indicators import update_indicators, rebuild_indicators
+from gaps import update_gaps, rebuild_gaps
+
+# All the writes go through a single thread (Writer) owning the only write connection, and
+# the readers (notifier, live graph, ...) borrow read-only connections from a pool (ReadPool).
+# The database is in WAL mode, so the readers never block the writer and vice versa.
+_writer = None
+_readers = None
+_init_lock = Lock()
+
+
+def connect(path=None, read_only=False):
     """
-    Updates the database, and returns price data based on intervals
+    Opens a connection to the database
 
-    Parameters: 
-        - data: The dictionary holding the api response
+    Parameters:
+        - path: the database file (default: settings.database)
+        - read_only: open the database in read-only mode
 
-    Returns:
-        a dictionary of price data based on intervals [hour, day, week, month, year]
+    Returns: sqlite3.Connection
+    """
+    path = path or settings.database
+
+    if read_only:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+    else:
+        # Transactions are handled explicitly by the writer
+        conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.execute("PRAGMA synchronous=NORMAL;")
+
+    # Wait instead of failing straight away with "database is locked"
+    conn.execute("PRAGMA busy_timeout=5000;")
+
+    return conn
+
+
+def init_db(path=None, pool_size=4):
+    """
+    Sets up (or upgrades) the schema, and starts the writer and the pool of readers; this has to run only once (at startup).
+
+    Parameters:
+        - path: the database file (default: settings.database)
+        - pool_size: maximum number of idle read-only connections kept around
+    """
+    global _writer, _readers
+
+    with _init_lock:
+        if _writer:
+            return
+
+        conn = connect(path)
+        cursor = conn.cursor()
+
+        upgrade(cursor)
+
+        _writer = Writer(conn, read_assets(cursor))
+        _writer.start()
+        _readers = ReadPool(path, pool_size)
+
+        # Write whatever is still queued before the program exits
+        atexit.register(close)
+
+
+def close():
+    """
+    Writes whatever is still queued and stops the writer (if it was started); check notify.close
+    """
+
+    if _writer:
+        _writer.close()
+
+
+def get_writer():
+    """
+    Returns: the Writer of the database (initializes the database if needed)
+    """
+
+    if not _writer:
+        init_db()
+
+    return _writer
+
+
+def reader():
+    """
+    Borrows a read-only connection from the pool; use it as a context manager:
+
+        with reader() as conn:
+            conn.execute(...)
+    """
+
+    if not _readers:
+        init_db()
+
+    return _readers.connection()
+
+
+class Writer(Thread):
+    """
+    A thread owning the only write connection to the database.
+
+    The writes are submitted as jobs (functions taking a cursor) to a queue; the writer drains the queue
+    and runs all the pending jobs in a single transaction. Every job runs in its own savepoint, so a failing
+    job doesn't throw away the others.
+    """
+
+    # Maximum number of jobs grouped into a single transaction
+    max_batch = 64
+    # How many times BEGIN and COMMIT are retried (on top of busy_timeout) before the batch is given up
+    retries = 5
+
+    def __init__(self, conn, assets):
+        """
+        Parameters:
+            - conn: a writable connection (check connect())
+            - assets: the coins that are already registered: name -> (asset_id, scale) <dict>
+        """
+        super().__init__(daemon=True, name='db-writer')
+
+        self.conn = conn
+        self.assets = assets
+        # Functions called with the events of every committed transaction (check add_listener())
+        self.listeners = []
+        # (asset_id, interval) -> newest timestamp stored; loaded lazily from the high_water table
+        self.high_water = {}
+        # asset_id -> the saved state of the indicators; loaded lazily from the indicator_state table
+        self.indicator_states = {}
+        self.queue = Queue()
+
+    def submit(self, job, *args):
+        """
+        Queues a job; it is run later as job(cursor, *args) on the writer thread
+
+        Parameters:
+            - job: a function taking a cursor as its first argument
+            - args: the rest of the arguments of the job
+        """
+
+        self.queue.put((job, args))
+
+    def add_listener(self, listener):
+        """
+        Registers a function that is called (on the writer thread) after every transaction as listener(events),
+        where events is the list of the values returned by the jobs (e.g. the new prices, check insert_documents).
+        The listener should be quick; the writing waits for it.
+        """
+
+        self.listeners.append(listener)
+
+    def flush(self):
+        """
+        Blocks until all the queued jobs are written
+        """
+
+        self.queue.join()
+
+    def close(self):
+        """
+        Writes the queued jobs, then stops the writer and closes the connection
+        """
+
+        if self.is_alive():
+            self.queue.put(None)
+            self.join()
+
+    def execute_retrying(self, cursor, statement):
+        """
+        Runs statement (BEGIN or COMMIT), retrying with a growing delay while the database is locked by another process
+
+        Parameters:
+            - cursor: cursor of the write connection
+            - statement: the SQL statement
+
+        Raises: sqlite3.Error if it still fails after the last retry
+        """
+
+        delay = 0.1
+        for attempt in range(self.retries + 1):
+            try:
+                cursor.execute(statement)
+                return
+            except sqlite3.Error as e:
+                if attempt == self.retries:
+                    raise
+                print(f"Couldn't run {statement} ({e}), retrying in {delay:.1f}s")
+                metrics.inc('db_retries')
+                time.sleep(delay)
+                delay = min(delay * 2, 5)
+
+    def reload(self, cursor):
+        """
+        Drops the cached high water marks and indicator states, and reloads the coins (after a rollback)
+        """
+
+        self.high_water.clear()
+        self.indicator_states.clear()
+        self.assets.clear()
+        self.assets.update(read_assets(cursor))
+
+    def run(self):
+        cursor = self.conn.cursor()
+
+        running = True
+        while running:
+            jobs = [self.queue.get()]
+
+            # Group whatever else is pending into the same transaction
+            while len(jobs) < self.max_batch:
+                try:
+                    jobs.append(self.queue.get_nowait())
+                except Empty:
+                    break
+
+            if None in jobs:
+                running = False
+
+                # The jobs queued after the sentinel are written as well, so no flush() waits for them forever
+                while True:
+                    try:
+                        jobs.append(self.queue.get_nowait())
+                    except Empty:
+                        break
+
+            # Every item taken from the queue is marked as done (the sentinels included)
+            taken = len(jobs)
+            jobs = [job for job in jobs if job is not None]
+
+            events = []
+            start = time.perf_counter()
+
+            try:
+                # IMMEDIATE takes the write lock up front: a deferred transaction reading first (the high water marks,
+                # the latest prices) fails with SQLITE_BUSY_SNAPSHOT on its first write if another process committed
+                # in between, which busy_timeout doesn't wait out
+                self.execute_retrying(cursor, "BEGIN IMMEDIATE;")
+                for job, args in jobs:
+                    cursor.execute("SAVEPOINT job;")
+                    try:
+                        events.extend(job(cursor, *args) or [])
+                        cursor.execute("RELEASE job;")
+                    except Exception as e:
+                        print(f"Couldn't write to the database: {e}")
+                        metrics.inc('db_jobs_failed')
+                        cursor.execute("ROLLBACK TO job;")
+                        cursor.execute("RELEASE job;")
+                        # The job might have registered coins or moved the high water marks of the rolled back rows
+                        self.reload(cursor)
+                self.execute_retrying(cursor, "COMMIT;")
+            except sqlite3.Error as e:
+                # The whole batch is lost, but the writer keeps running (and flush() keeps returning)
+                print(f"Couldn't write {len(jobs)} jobs to the database: {e}")
+                metrics.inc('db_batches_failed')
+                events = []
+                try:
+                    if self.conn.in_transaction:
+                        cursor.execute("ROLLBACK;")
+                    self.reload(cursor)
+                except sqlite3.Error as e:
+                    print(f"Couldn't roll back the database: {e}")
+
+            metrics.observe('db_write', time.perf_counter() - start)
+            metrics.gauge('db_queue_depth', self.queue.qsize())
+
+            if events:
+                for listener in self.listeners:
+                    try:
+                        with metrics.timed('notify'):
+                            listener(events)
+                    except Exception as e:
+                        print(f"A listener of the database failed: {e}")
+
+            for _ in range(taken):
+                self.queue.task_done()
+
+        cursor.close()
+        self.conn.close()
+
+
+class ReadPool:
+    """
+    A pool of read-only connections that are shared between the threads.
+    """
+
+    def __init__(self, path=None, size=4):
+        """
+        Parameters:
+            - path: the database file (default: settings.database)
+            - size: maximum number of idle connections kept around
+        """
+
+        self.path = path
+        self.idle = Queue(maxsize=size)
+
+    @contextmanager
+    def connection(self):
+        try:
+            conn = self.idle.get_nowait()
+        except Empty:
+            conn = connect(self.path, read_only=True)
+
+        try:
+            yield conn
+        finally:
+            # Make sure no read transaction is left open, otherwise the reader would keep seeing an old snapshot
+            conn.rollback()
+
+            if self.idle.full():
+                conn.close()
+            else:
+                self.idle.put_nowait(conn)
+
+
+def get_intervals(data):
     """
-    conn = sqlite3.connect('crypto.db')
-    cursor = conn.cursor()
-
-    # Constant DATA: (if we were to generalize, we would have a file for global variables defining these variables)
-    # coin: ETH
-    # coin_id: d85dce9b-5b73-5c3c-8978-522ce1d1c1b4
-    # currency: CAD
-
-    if not 'eth_data' in [x[0] for x in cursor.execute("SELECT name FROM sqlite_master where type='table'").fetchall()]:
-        cursor.execute("""CREATE TABLE eth_data (
-            timestamp INTEGER NOT NULL UNIQUE PRIMARY KEY,
-            price REAL NOT NULL,
-            hour REAL,
-            day REAL,
-            week REAL,
-            month REAL,
-            year REAL
-        );""")
+    Returns: a dictionary of price data based on intervals [hour, day, week, month, year]
 
+    Parameters:
+        - data: The dictionary holding the api response
+    """
     prices = data['prices']
-    latest_info = prices['latest_price']
-    
-    intervals = {
+
+    return {
         #"all": prices['all'],
         "year": prices['year'],
         "month": prices['month'],
@@ -45,35 +343,671 @@ def update_db(data):
         "day": prices['day'],
     }
 
-    # Insert Latest price
-    timestamp = int(datetime.fromisoformat(prices['latest_price']['timestamp']).timestamp())
-    latest_price = round(float(prices['latest']), 2)
-    percent_change = [round(float(latest_info['percent_change'][x]), 4) for x in ['hour', 'day', 'week', 'month', 'year']]
+
+def update_db(data):
+    """
+    Queues the api response to be written to the database, and returns price data based on intervals
+
+    Parameters:
+        - data: The dictionary holding the api response
+
+    Returns:
+        a dictionary of price data based on intervals [hour, day, week, month, year]
+    """
+
+    return update_db_batch([data])[data['base']]
+
+
+def update_db_batch(documents):
+    """
+    Queues the api responses of several coins to be written at once (a single transaction)
+
+    Parameters:
+        - documents: a list of dictionaries holding the api responses (one per coin)
+
+    Returns:
+        a dictionary: coin -> price data based on intervals [hour, day, week, month, year]
+    """
+    writer = get_writer()
+    writer.submit(insert_documents, writer.assets, writer.high_water, writer.indicator_states, documents)
+
+    return {data['base']: get_intervals(data) for data in documents}
+
+
+""" Schema """
+# The version of the schema is kept in "PRAGMA user_version"; migrations[i] upgrades the schema from version i to i + 1.
+#
+# Version 1:
+#   - assets: one row per coin; the prices of a coin are stored as integers: price * 10^scale
+#   - ticks: (asset_id, timestamp) -> price; clustered on the key (WITHOUT ROWID), so the latest
+#            price and the time range lookups of a coin are a single b-tree seek
+#   - percent_changes: (asset_id, interval, timestamp) -> percent change, the intervals are stored
+#            as their index in INTERVALS
+#   - high_water: (asset_id, interval) -> newest timestamp stored of an interval
+#
+# Version 2:
+#   - candles: (asset_id, size, start) -> OHLC bar of size seconds (check candles.py)
+#
+# Version 3:
+#   - archived_months: (asset_id, start) -> the months of ticks moved out to the archive files (check archive.py)
+#
+# Version 4:
+#   - indicators: (asset_id, name, timestamp) -> value of an indicator at a minute (check indicators.py)
+#   - indicator_state: asset_id -> the saved state of the indicators of the coin
+#
+# Version 5:
+#   - gaps: (asset_id, start) -> end; the runs of minutes [start, end) without a tick (check gaps.py)
+
+def upgrade(cursor):
+    """
+    Brings the schema up to date (in a single transaction)
+
+    Parameters:
+        - cursor: cursor to the db (writable, in autocommit mode; check connect())
+    """
+
+    version = cursor.execute("PRAGMA user_version;").fetchone()[0]
+
+    if version >= len(migrations):
+        return
+
+    cursor.execute("BEGIN IMMEDIATE;")
+    for migration in migrations[version:]:
+        migration(cursor)
+    cursor.execute(f"PRAGMA user_version = {len(migrations)};")
+    cursor.execute("COMMIT;")
+
+
+def migrate_legacy(cursor):
+    """
+    Version 0 -> 1: creates the normalized schema, and moves the data of the per-coin tables
+    (eth_data, <coin>_data) into it; the old tables are dropped.
+    """
+
+    cursor.execute("""CREATE TABLE assets (
+        asset_id INTEGER PRIMARY KEY,
+        base TEXT NOT NULL UNIQUE,
+        base_id TEXT,
+        currency TEXT NOT NULL,
+        scale INTEGER NOT NULL
+    );""")
+
+    cursor.execute("""CREATE TABLE ticks (
+        asset_id INTEGER NOT NULL,
+        timestamp INTEGER NOT NULL,
+        price INTEGER NOT NULL,
+        PRIMARY KEY (asset_id, timestamp)
+    ) WITHOUT ROWID;""")
+
+    cursor.execute("""CREATE TABLE percent_changes (
+        asset_id INTEGER NOT NULL,
+        interval INTEGER NOT NULL,
+        timestamp INTEGER NOT NULL,
+        value REAL NOT NULL,
+        PRIMARY KEY (asset_id, interval, timestamp)
+    ) WITHOUT ROWID;""")
+
+    # For the time range scans across all the coins (covers the price as well)
+    cursor.execute("CREATE INDEX ticks_by_time ON ticks (timestamp, asset_id, price);")
+
+    legacy_marks = {}
+    tables = {x[0] for x in cursor.execute("SELECT name FROM sqlite_master where type='table'").fetchall()}
+
+    if 'high_water' in tables:
+        legacy_marks = {(name, interval): timestamp for name, interval, timestamp in cursor.execute("SELECT * from high_water;")}
+        cursor.execute("DROP TABLE high_water;")
+
+    cursor.execute("""CREATE TABLE high_water (
+        asset_id INTEGER NOT NULL,
+        interval INTEGER NOT NULL,
+        timestamp INTEGER NOT NULL,
+        PRIMARY KEY (asset_id, interval)
+    ) WITHOUT ROWID;""")
+
+    for table in sorted(tables):
+        if not table.endswith('_data'):
+            continue
+
+        base = table[:-len('_data')].upper()
+        print(f"Migrating {table} ...")
+
+        # The legacy prices were rounded to 2 decimals
+        asset_id, scale = register_asset(cursor, {}, base, settings.assets.get(base), settings.currency, 2)
+
+        cursor.execute(f"INSERT INTO ticks SELECT ?, timestamp, CAST(round(price * 100) AS INTEGER) from {table};", (asset_id,))
+
+        for idx, interval in enumerate(INTERVALS):
+            cursor.execute(f"INSERT INTO percent_changes SELECT ?, ?, timestamp, {interval} from {table} where {interval} not null;", (asset_id, idx))
+
+            # The rows of an interval are the ones where only its column is set (the latest price rows have all of them)
+            if not (timestamp := legacy_marks.get((table, interval))):
+                others = ' and '.join(f"{x} is null" for x in INTERVALS if x != interval)
+                timestamp = cursor.execute(f"SELECT max(timestamp) from {table} where {interval} not null and {others};").fetchone()[0]
+
+            if timestamp:
+                cursor.execute("INSERT INTO high_water VALUES (?, ?, ?);", (asset_id, idx, timestamp))
+
+        cursor.execute(f"DROP TABLE {table};")
+
+
+def add_candles(cursor):
+    """
+    Version 1 -> 2: adds the OHLC bars (check candles.py), and builds them from the stored ticks
+    """
+
+    # The prices are scaled like the ones of ticks
+    cursor.execute("""CREATE TABLE candles (
+        asset_id INTEGER NOT NULL,
+        size INTEGER NOT NULL,
+        start INTEGER NOT NULL,
+        open INTEGER NOT NULL,
+        high INTEGER NOT NULL,
+        low INTEGER NOT NULL,
+        close INTEGER NOT NULL,
+        first INTEGER NOT NULL,
+        last INTEGER NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (asset_id, size, start)
+    ) WITHOUT ROWID;""")
+
+    for asset_id, base in cursor.execute("SELECT asset_id, base from assets;").fetchall():
+        print(f"Building the candles of {base} ...")
+        rebuild_candles(cursor, asset_id)
+
+
+def add_archive(cursor):
+    """
+    Version 2 -> 3: adds the index of the archived months (check archive.py)
+    """
+
+    # start and end: the month is [start, end) in unix time
+    cursor.execute("""CREATE TABLE archived_months (
+        asset_id INTEGER NOT NULL,
+        start INTEGER NOT NULL,
+        end INTEGER NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (asset_id, start)
+    ) WITHOUT ROWID;""")
+
+
+def add_indicators(cursor):
+    """
+    Version 3 -> 4: adds the technical indicators (check indicators.py), and computes them from the stored candles
+    """
+
+    cursor.execute("""CREATE TABLE indicators (
+        asset_id INTEGER NOT NULL,
+        name TEXT NOT NULL,
+        timestamp INTEGER NOT NULL,
+        value REAL NOT NULL,
+        PRIMARY KEY (asset_id, name, timestamp)
+    ) WITHOUT ROWID;""")
+
+    # timestamp: the start of the last closed bar pushed into the state
+    cursor.execute("""CREATE TABLE indicator_state (
+        asset_id INTEGER PRIMARY KEY,
+        timestamp INTEGER NOT NULL,
+        state TEXT NOT NULL
+    );""")
+
+    for asset_id, base, scale in cursor.execute("SELECT asset_id, base, scale from assets;").fetchall():
+        print(f"Computing the indicators of {base} ...")
+        rebuild_indicators(cursor, asset_id, scale, {})
+
+
+def add_gaps(cursor):
+    """
+    Version 4 -> 5: adds the gap index (check gaps.py), and builds it from the 1 minute candles
+    """
+
+    cursor.execute("""CREATE TABLE gaps (
+        asset_id INTEGER NOT NULL,
+        start INTEGER NOT NULL,
+        end INTEGER NOT NULL,
+        PRIMARY KEY (asset_id, start)
+    ) WITHOUT ROWID;""")
+
+    for asset_id, base in cursor.execute("SELECT asset_id, base from assets;").fetchall():
+        print(f"Indexing the gaps of {base} ...")
+        rebuild_gaps(cursor, asset_id)
+
+
+migrations = [migrate_legacy, add_candles, add_archive, add_indicators, add_gaps]
+
+
+def read_assets(cursor):
+    """
+    Returns: the registered coins: name -> (asset_id, scale) <dict>
+    """
+
+    return {base: (asset_id, scale) for asset_id, base, scale in cursor.execute("SELECT asset_id, base, scale from assets;")}
+
+
+def register_asset(cursor, assets, base, base_id, currency, scale):
+    """
+    Returns: (asset_id, scale) of the coin; the coin is added to the assets table if it's not there yet
+
+    Parameters:
+        - cursor: cursor to the db
+        - assets: name -> (asset_id, scale) <dict> (cache)
+        - base: name of the coin
+        - base_id: coinbase's uuid of the coin
+        - currency: paper currency of the prices
+        - scale: number of decimals kept of the prices
+    """
+
+    if base not in assets:
+        cursor.execute("INSERT INTO assets (base, base_id, currency, scale) VALUES (?, ?, ?, ?) ON CONFLICT(base) DO NOTHING;",
+                       (base, base_id, currency, scale))
+        assets[base] = tuple(cursor.execute("SELECT asset_id, scale from assets where base = ?;", (base,)).fetchone())
+
+    return assets[base]
+
+
+""" Writing """
+
+def insert_documents(cursor, assets, high_water, indicator_states, documents):
+    """
+    Inserts the api responses of several coins (runs on the writer thread)
+
+    Parameters:
+        - cursor: cursor to the db
+        - assets: name -> (asset_id, scale) <dict>
+        - high_water: (asset_id, interval) -> newest timestamp stored <dict>
+        - indicator_states: asset_id -> the state of the indicators <dict> (check indicators.update_indicators)
+        - documents: a list of dictionaries holding the api responses (one per coin)
+
+    Returns: the events of the new latest prices (check insert_document)
+    """
+    events = []
+
+    for data in documents:
+        # The number of decimals of the prices (check schema.py)
+        scale = parse.scale_of(data)
+        asset_id, scale = register_asset(cursor, assets, data['base'], data.get('base_id'), data.get('currency', settings.currency), scale)
+
+        if (event := insert_document(cursor, asset_id, scale, high_water, indicator_states, data)):
+            events.append(event)
+
+    return events
+
+
+def insert_parsed_documents(cursor, assets, high_water, indicator_states, documents):
+    """
+    Inserts the api responses of several coins converted by parse.document() (runs on the writer thread)
+
+    Parameters:
+        - cursor: cursor to the db
+        - assets: name -> (asset_id, scale) <dict>
+        - high_water: (asset_id, interval) -> newest timestamp stored <dict>
+        - indicator_states: asset_id -> the state of the indicators <dict>
+        - documents: a list of the converted api responses (one per coin)
+
+    Returns: the events of the new latest prices (check insert_parsed)
+    """
+    events = []
+
+    for parsed in documents:
+        asset_id, scale = register_asset(cursor, assets, parsed['base'], parsed['base_id'], parsed['currency'], parsed['scale'])
+
+        if (event := insert_parsed(cursor, asset_id, scale, high_water, indicator_states, parsed)):
+            events.append(event)
+
+    return events
+
+
+def get_high_water(cursor, high_water, asset_id, interval):
+    """
+    Returns: the newest timestamp stored for (asset_id, interval), or 0 if there is none
+
+    Parameters:
+        - cursor: cursor to the db
+        - high_water: (asset_id, interval) -> newest timestamp stored <dict> (cache)
+        - asset_id: id of the coin
+        - interval: index of the interval in INTERVALS
+    """
+
+    if (key := (asset_id, interval)) not in high_water:
+        row = cursor.execute("SELECT timestamp from high_water where asset_id = ? and interval = ?;", key).fetchone()
+        high_water[key] = row[0] if row else 0
+
+    return high_water[key]
+
+
+def set_high_water(cursor, high_water, asset_id, interval, timestamp):
+    """
+    Moves the high water mark of (asset_id, interval) forward to timestamp; a writer of another process with an
+    older mark in memory never moves it back
+    """
+
+    high_water[(asset_id, interval)] = max(high_water.get((asset_id, interval), 0), timestamp)
+    cursor.execute("""INSERT INTO high_water VALUES (?, ?, ?)
+                      ON CONFLICT(asset_id, interval) DO UPDATE SET timestamp = max(timestamp, excluded.timestamp);""",
+                   (asset_id, interval, timestamp))
+
+
+def insert_document(cursor, asset_id, scale, high_water, indicator_states, data):
+    """
+    Inserts the latest price and the historical prices of a single api response; only the points newer
+    than the high water mark of their interval are inserted.
+
+    Parameters:
+        - cursor: cursor to the db
+        - asset_id: id of the coin
+        - scale: number of decimals kept of the prices
+        - high_water: (asset_id, interval) -> newest timestamp stored <dict>
+        - indicator_states: asset_id -> the state of the indicators <dict>
+        - data: The dictionary holding the api response
+
+    Returns: the new latest price (check insert_parsed), or None if the price didn't change
+    """
+
+    marks = {interval: get_high_water(cursor, high_water, asset_id, interval) for interval in range(len(INTERVALS))}
+
+    return insert_parsed(cursor, asset_id, scale, high_water, indicator_states, parse.document(data, scale, marks))
+
+
+def insert_parsed(cursor, asset_id, scale, high_water, indicator_states, parsed):
+    """
+    Inserts an api response converted by parse.document()
+
+    Parameters:
+        - cursor: cursor to the db
+        - asset_id: id of the coin
+        - scale: number of decimals of the stored prices of the coin
+        - high_water: (asset_id, interval) -> newest timestamp stored <dict>
+        - indicator_states: asset_id -> the state of the indicators <dict>
+        - parsed: check parse.document()
+
+    Returns: the new latest price as a dictionary with the keys: base, timestamp, price, percent_change
+             (interval -> change), indicators (name -> value of the open minute), or None if the price didn't change
+    """
+
+    timestamp = parsed['timestamp']
+    percent_change = parsed['percent_change']
+
+    def rescale(prices):
+        # Parsed with another number of decimals than the stored prices
+        return prices if parsed['scale'] == scale else np.rint(np.asarray(prices) * 10.0 ** (scale - parsed['scale'])).astype(np.int64)
+
+    latest_price = int(rescale(np.array([parsed['price']]))[0])
 
     # If the new price is equal to the old price, then don't update
     # TODO: This could be a pitfall, what if the price indeed didn't change
     # However, this is highly unlikely because we are taking decimal points as well, so we
     # don't have to worry much, but still you might wanna find a more robust method.
-    if latest_price == cursor.execute("SELECT price from eth_data order by timestamp desc limit 1;").fetchone()[0]:
-        return intervals
+    old = cursor.execute("SELECT price from ticks where asset_id = ? order by timestamp desc limit 1;", (asset_id,)).fetchone()
+    if old and latest_price == old[0]:
+        metrics.inc('documents_skipped', reason='unchanged')
+        return
 
     # To interpet date: use ... date(timestamp, 'unixepoch') ...
     # For local time: use ... date(timestamp, 'unixepoch', 'localtime') ...
-    latest = (timestamp, latest_price, *percent_change)
-    cursor.execute("INSERT INTO eth_data VALUES (?,?,?,?,?,?,?) ON CONFLICT(timestamp) DO NOTHING", latest)
-    
-    # Insert batch data
-    for key, container in intervals.items():
-        percent_change = container['percent_change']
-        prices = container['prices']
-
-        values = [(tp[1], round(float(tp[0]), 2), round(float(percent_change), 4)) for tp in prices]
-        cursor.executemany(f"INSERT INTO eth_data (timestamp, price, {key})\
-                                    VALUES (?, ?, ?)\
-                               ON CONFLICT(timestamp) DO NOTHING", values)
-
-    conn.commit()
-    cursor.close()
-    conn.close()
-
-    return intervals
+    cursor.executemany("INSERT INTO percent_changes VALUES (?, ?, ?, ?) ON CONFLICT DO NOTHING;",
+                       [(asset_id, idx, timestamp, change) for idx, change in enumerate(percent_change)])
+
+    # The new ticks: the latest price first, then the batch data
+    new_timestamps, new_prices = [np.array([timestamp])], [np.array([latest_price])]
+
+    for interval, (timestamps, prices, change) in parsed['intervals'].items():
+        # The mark might have moved since the document was parsed
+        fresh = timestamps > get_high_water(cursor, high_water, asset_id, interval)
+        timestamps, prices = timestamps[fresh], rescale(prices[fresh])
+
+        if not len(timestamps):
+            continue
+
+        new_timestamps.append(timestamps)
+        new_prices.append(prices)
+
+        # The percent change of the interval is as of its newest point
+        newest = int(timestamps.max())
+        cursor.execute("INSERT INTO percent_changes VALUES (?, ?, ?, ?) ON CONFLICT DO NOTHING;",
+                       (asset_id, interval, newest, change))
+
+        set_high_water(cursor, high_water, asset_id, interval, newest)
+
+    timestamps, prices = np.concatenate(new_timestamps), np.concatenate(new_prices)
+    received = len(timestamps)
+
+    timestamps, prices = unique_ticks(cursor, asset_id, timestamps, prices)
+    # Repeated between the intervals, already stored, or archived
+    metrics.inc('points_skipped', received - len(timestamps), reason='duplicate')
+    metrics.inc('ticks_inserted', len(timestamps))
+
+    cursor.executemany("INSERT INTO ticks VALUES (?, ?, ?);", zip(repeat(asset_id), timestamps.tolist(), prices.tolist()))
+    # The gaps are found against the candles, so before they're updated
+    update_gaps(cursor, asset_id, timestamps)
+    update_candles(cursor, asset_id, timestamps, prices)
+    indicators = update_indicators(cursor, asset_id, scale, int(timestamps[0]), indicator_states) if len(timestamps) else {}
+
+    return {
+        'base': parsed['base'],
+        'timestamp': timestamp,
+        'price': latest_price / 10 ** scale,
+        'percent_change': dict(zip(INTERVALS, percent_change)),
+        'indicators': indicators,
+    }
+
+
+def unique_ticks(cursor, asset_id, timestamps, prices):
+    """
+    Drops the ticks whose timestamp is repeated (the first one is kept), is already stored, or falls into
+    an archived month (check archive.py)
+
+    Parameters:
+        - cursor: cursor to the db
+        - asset_id: id of the coin
+        - timestamps: unix timestamps <numpy array>
+        - prices: the prices corresponding to the timestamps <numpy array>
+
+    Returns: (timestamps, prices) # numpy arrays in ascending order of time
+    """
+
+    timestamps, first = np.unique(timestamps, return_index=True)
+    prices = prices[first]
+
+    stored = cursor.execute("SELECT timestamp from ticks where asset_id = ? and timestamp between ? and ?;",
+                            (asset_id, int(timestamps[0]), int(timestamps[-1]))).fetchall()
+
+    if stored:
+        fresh = ~np.isin(timestamps, np.array(stored, dtype=np.int64).ravel())
+        timestamps, prices = timestamps[fresh], prices[fresh]
+
+    # The archived months are closed
+    archived = cursor.execute("SELECT start, end from archived_months where asset_id = ? and end > ? and start <= ?;",
+                              (asset_id, int(timestamps[0]), int(timestamps[-1]))).fetchall() if len(timestamps) else []
+
+    for start, end in archived:
+        fresh = (timestamps < start) | (timestamps >= end)
+        timestamps, prices = timestamps[fresh], prices[fresh]
+
+    return timestamps, prices
+
+
+""" Reading """
+
+def get_asset(cursor, base):
+    """
+    Returns: (asset_id, scale) of the coin, or None if it isn't stored
+
+    Parameters:
+        - cursor: cursor to the db
+        - base: name of the coin
+    """
+
+    if base not in _asset_cache:
+        if not (row := cursor.execute("SELECT asset_id, scale from assets where base = ?;", (base,)).fetchone()):
+            return
+        # The ids never change, so they can be cached
+        _asset_cache[base] = tuple(row)
+
+    return _asset_cache[base]
+
+
+_asset_cache = {}
+
+
+def latest_price(cursor, base):
+    """
+    Returns: the latest price of the coin <float>, or None if there isn't any
+
+    Parameters:
+        - cursor: cursor to the db
+        - base: name of the coin
+    """
+
+    if not (asset := get_asset(cursor, base)):
+        return
+
+    asset_id, scale = asset
+    row = cursor.execute("SELECT price from ticks where asset_id = ? order by timestamp desc limit 1;", (asset_id,)).fetchone()
+
+    return row[0] / 10 ** scale if row else None
+
+
+def latest_change(cursor, base, interval):
+    """
+    Returns: (price, percent change) of the latest point that has the percent change of the interval, or None
+
+    Parameters:
+        - cursor: cursor to the db
+        - base: name of the coin
+        - interval: one of INTERVALS
+    """
+
+    if not (asset := get_asset(cursor, base)):
+        return
+
+    asset_id, scale = asset
+    row = cursor.execute("""SELECT t.price, p.value from percent_changes p
+                            join ticks t on t.asset_id = p.asset_id and t.timestamp = p.timestamp
+                            where p.asset_id = ? and p.interval = ?
+                            order by p.timestamp desc limit 1;""", (asset_id, INTERVALS.index(interval))).fetchone()
+
+    return (row[0] / 10 ** scale, row[1]) if row else None
+
+
+def price_range(cursor, base, start, end=None):
+    """
+    Returns: (timestamps, prices) of the coin between start and end (inclusive) in ascending order # numpy arrays
+
+    Parameters:
+        - cursor: cursor to the db
+        - base: name of the coin
+        - start: unix timestamp
+        - end: unix timestamp (default: no upper limit)
+    """
+
+    if not (asset := get_asset(cursor, base)):
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+    asset_id, scale = asset
+    rows = cursor.execute("""SELECT timestamp, price from ticks
+                             where asset_id = ? and timestamp between ? and ?
+                             order by timestamp;""", (asset_id, start, end if end is not None else 2 ** 62)).fetchall()
+
+    data = np.array(rows, dtype=np.int64).reshape(-1, 2)
+
+    return data[:, 0], data[:, 1] / 10 ** scale
+
+
+def minute_prices(cursor, base, window, end=None):
+    """
+    Buckets the prices of a window into minutes; the last price of every minute is kept.
+
+    Parameters:
+        - cursor: cursor to the db
+        - base: name of the coin
+        - window: length of the window in seconds
+        - end: unix timestamp of the end of the window (default: now)
+
+    Returns: (timestamps, prices) # numpy arrays in ascending order; the timestamps are the starts of the minutes
+    """
+
+    if not (asset := get_asset(cursor, base)):
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+    asset_id, scale = asset
+    end = int(end if end is not None else time.time())
+
+    # The bare price column comes from the row with max(timestamp) of each minute
+    rows = cursor.execute("""SELECT timestamp / 60 * 60 as minute, price, max(timestamp) from ticks
+                             where asset_id = ? and timestamp between ? and ?
+                             group by minute order by minute;""", (asset_id, end - window, end)).fetchall()
+
+    data = np.array(rows, dtype=np.int64).reshape(-1, 3)
+
+    return data[:, 0], data[:, 1] / 10 ** scale
+
+
+def candle_range(cursor, base, size, start, end=None):
+    """
+    Returns: the OHLC bars of the coin starting between start and end (inclusive) in ascending order; a dictionary
+             of numpy arrays keyed by candles.COLUMNS, the prices are floats
+
+    Parameters:
+        - cursor: cursor to the db
+        - base: name of the coin
+        - size: one of candles.BUCKETS (e.g. '1m', '1h')
+        - start: unix timestamp
+        - end: unix timestamp (default: no upper limit)
+    """
+
+    rows = []
+
+    if (asset := get_asset(cursor, base)):
+        asset_id, scale = asset
+        rows = cursor.execute(f"""SELECT {', '.join(CANDLE_COLUMNS)} from candles
+                                  where asset_id = ? and size = ? and start between ? and ?
+                                  order by start;""", (asset_id, BUCKETS[size], start, end if end is not None else 2 ** 62)).fetchall()
+
+    bars = dict(zip(CANDLE_COLUMNS, np.array(rows, dtype=np.int64).reshape(-1, len(CANDLE_COLUMNS)).T))
+
+    for key in ['open', 'high', 'low', 'close']:
+        bars[key] = bars[key] / 10 ** scale if rows else bars[key].astype(np.float64)
+
+    return bars
+
+
+def indicator_range(cursor, base, name, start, end=None):
+    """
+    Returns: (timestamps, values) of an indicator output (e.g. 'rsi_14', 'bollinger_20_upper'; check settings.indicators)
+             between start and end (inclusive) in ascending order # numpy arrays; one value per minute
+
+    Parameters:
+        - cursor: cursor to the db
+        - base: name of the coin
+        - name: name of the output
+        - start: unix timestamp
+        - end: unix timestamp (default: no upper limit)
+    """
+
+    rows = []
+
+    if (asset := get_asset(cursor, base)):
+        rows = cursor.execute("""SELECT timestamp, value from indicators
+                                 where asset_id = ? and name = ? and timestamp between ? and ?
+                                 order by timestamp;""", (asset[0], name, start, end if end is not None else 2 ** 62)).fetchall()
+
+    timestamps = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+    values = np.fromiter((row[1] for row in rows), dtype=np.float64, count=len(rows))
+
+    return timestamps, values
+
+
+def latest_indicators(cursor, base):
+    """
+    Returns: the latest value of every indicator output of the coin: name -> value <dict>
+
+    Parameters:
+        - cursor: cursor to the db
+        - base: name of the coin
+    """
+
+    if not (asset := get_asset(cursor, base)):
+        return {}
+
+    return dict(cursor.execute("""SELECT name, value from indicators i
+                                  where asset_id = ? and timestamp = (SELECT max(timestamp) from indicators where asset_id = i.asset_id and name = i.name)
+                                  group by name;""", (asset[0],)).fetchall())
@@ -0,0 +1,163 @@
+# Headless export of the charts (--export).
+# The charts of the coins are rendered in parallel by a pool of processes on the Agg backend (no display or
+# GUI event loop is needed), and are written to files: a PNG of the intervals (check charts.plot_interval),
+# and a time-lapse video of the price.
+
+import os
+import time
+import asyncio
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.animation import FuncAnimation, FFMpegWriter, PillowWriter
+from matplotlib.ticker import FuncFormatter
+from datetime import datetime
+
+import db
+import gaps
+import series
+from charts import plot_interval
+
+
+def use_agg():
+    """
+    Switches matplotlib to the non-interactive Agg backend (the initializer of the worker processes)
+    """
+
+    plt.switch_backend('Agg')
+
+
+def export_intervals(base, which_intervals, path):
+    """
+    Renders the intervals of a coin into a PNG file (from its memory-mapped series, check series.py)
+
+    Parameters:
+        - base: name of the coin
+        - which_intervals: the intervals to plot: ['hour', 'day', 'week', 'month', 'year']
+        - path: the output file
+
+    Returns: path
+    """
+
+    fig = plt.figure(figsize=(16, 8))
+    # Synced by export_all()
+    plot_interval(base, which_intervals, sync_first=False)
+    fig.suptitle(f"{base}: Trend over {', '.join(which_intervals)}")
+    fig.savefig(path, dpi=100)
+    plt.close(fig)
+
+    return path
+
+
+def export_timelapse(base, path, period=60 * 60 * 24, window=60 * 60, step=60 * 5, fps=30):
+    """
+    Renders a time-lapse of the stored prices of a coin: a window sliding over the period, one frame per step
+
+    Parameters:
+        - base: name of the coin
+        - path: the output file (.mp4 if ffmpeg is available, otherwise it's written as a .gif)
+        - period: seconds covered by the time-lapse (ending now)
+        - window: seconds shown in a frame
+        - step: seconds between the frames
+        - fps: frames per second of the video
+
+    Returns: the path of the written file, or None if there's no data
+    """
+
+    # Read-only; the worker processes don't need the db writer
+    conn = db.connect(read_only=True)
+    now = int(time.time())
+    # One price per minute, the minutes without a tick hold the last price (check gaps.py)
+    timestamps, prices, observed = gaps.dense(conn.cursor(), base, now - period - window, now)
+    conn.close()
+
+    if observed.sum() < 2:
+        return
+
+    # From the first to the last minute with a tick
+    first, last = np.flatnonzero(observed)[[0, -1]]
+    timestamps, prices = timestamps[first:last + 1], prices[first:last + 1]
+
+    ends = np.arange(timestamps[0] + window, timestamps[-1] + step, step)
+
+    fig = plt.figure(figsize=(16, 8))
+    ax = plt.subplot(111)
+    ax.xaxis.set_major_formatter(FuncFormatter(lambda x, pos: datetime.fromtimestamp(x).strftime("%H:%M")))
+    line = ax.plot([], [], color='b')[0]
+    title = ax.set_title("")
+
+    def draw_frame(end):
+        # The grid is regular, so the minutes of the window are found by their index
+        first, last = max((end - window - timestamps[0]) // gaps.STEP, 0), min((end - timestamps[0]) // gaps.STEP + 1, len(timestamps))
+
+        line.set_data(timestamps[first:last], prices[first:last])
+        ax.set_xlim(end - window, end)
+        ax.set_ylim(prices[first:last].min() - 10, prices[first:last].max() + 10)
+        title.set_text(f"{base}: {prices[last - 1]:.2f}  {datetime.fromtimestamp(end).strftime('%Y-%m-%d %H:%M')}")
+
+        return line,
+
+    anim = FuncAnimation(fig, draw_frame, frames=ends, blit=False, repeat=False)
+
+    if FFMpegWriter.isAvailable():
+        anim.save(path, writer=FFMpegWriter(fps=fps), dpi=100)
+    else:
+        path = os.path.splitext(path)[0] + '.gif'
+        anim.save(path, writer=PillowWriter(fps=fps), dpi=100)
+
+    plt.close(fig)
+
+    return path
+
+
+def export_all(assets, which_intervals, out_dir, workers=None, timelapse=True):
+    """
+    Fetches the latest data of the coins, and renders their charts in parallel
+
+    Parameters:
+        - assets: name -> base_id <dict>
+        - which_intervals: the intervals to plot: ['hour', 'day', 'week', 'month', 'year']
+        - out_dir: the directory of the output files
+        - workers: number of processes (default: number of cpus)
+        - timelapse: render the time-lapse videos as well
+
+    Returns: a list of the written files
+    """
+
+    from collector import collect_documents
+
+    os.makedirs(out_dir, exist_ok=True)
+
+    documents = asyncio.run(collect_documents(assets))
+    intervals = db.update_db_batch(documents)
+    # The workers read the data from the db
+    db.get_writer().flush()
+
+    # Synced once here, so the workers only map the files
+    for base in intervals:
+        series.sync(base)
+
+    written = []
+
+    # Spawned (not forked), since this process already runs threads (the db writer, the outbox, ...) whose locks a
+    # forked child could inherit held
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context('spawn'), initializer=use_agg) as executor:
+        futures = []
+
+        for base in intervals:
+            futures.append(executor.submit(export_intervals, base, which_intervals, os.path.join(out_dir, f"{base}.png")))
+
+            if timelapse:
+                futures.append(executor.submit(export_timelapse, base, os.path.join(out_dir, f"{base}.mp4")))
+
+        for future in as_completed(futures):
+            try:
+                if (path := future.result()):
+                    print(f"Wrote {path}")
+                    written.append(path)
+            except Exception as e:
+                print(f"Couldn't export a chart: {e}")
+
+    return written
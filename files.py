@@ -0,0 +1,29 @@
+# Writing the files that are read by other threads or processes while they change (the response cache, the
+# metrics, the backfill checkpoint, the archive and the memory-mapped series).
+
+import os
+import threading
+
+
+def atomic_write(path, data):
+    """
+    Replaces the file at path with data. The data is written to a temporary file next to it first, which is
+    then renamed over path (os.replace is atomic), so the readers see either the old or the new file, never half
+    of one, and an interrupted write leaves the old file as it was. The temporary file is unique per process
+    and thread, so concurrent writers don't mix their data (the last rename wins).
+
+    Parameters:
+        - path: the file
+        - data: <str>, <bytes>, or anything else exposing a buffer (e.g. a contiguous numpy array, written without a copy)
+    """
+
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+    try:
+        with open(tmp, 'w' if isinstance(data, str) else 'wb') as fp:
+            fp.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
@@ -0,0 +1,263 @@
+# Gaps in the stored prices, and their resampling onto a regular grid of minutes.
+# The prices of a coin aren't regular: a fetch fails, a tick is dropped because the price didn't change, and the
+# points of the coarser intervals (week, month, year) are minutes or hours apart. The minutes that have ticks are
+# the 1 minute candles (check candles.py), so:
+#   - the gap index (the gaps table, check db.py) holds the runs of minutes without a tick between the first and
+#     the last tick of every coin, as [start, end) ranges. The writer keeps it up to date with every batch of new
+#     ticks (update_gaps(): the holes that got filled are split, the new ones appended), so it's never rescanned.
+#   - dense() returns the closes of a range of minutes as a regular grid (one element per minute), with the
+#     empty minutes filled in, straight from the candles.
+#
+#   grid, prices, observed = gaps.dense(cursor, 'ETH', start, end)
+#   missing = gaps.missing(cursor, 'ETH', start, end)
+
+import time
+
+import numpy as np
+
+from candles import BUCKETS
+
+# The grid of the index (seconds)
+STEP = BUCKETS['1m']
+
+FILLS = ['ffill', 'linear', 'none']
+
+
+def find_gaps(timestamps, step=STEP):
+    """
+    Finds the empty buckets between the ticks in a single pass
+
+    Parameters:
+        - timestamps: unix timestamps in ascending order <numpy array>
+        - step: length of a bucket in seconds
+
+    Returns: (starts, ends) # int64 numpy arrays; the gaps are [start, end), the buckets without a tick
+    """
+
+    buckets = np.unique(np.asarray(timestamps, dtype=np.int64) // step) * step
+    idx = np.flatnonzero(np.diff(buckets) > step)
+
+    return buckets[idx] + step, buckets[idx + 1]
+
+
+def duplicates(timestamps, step=STEP):
+    """
+    Returns: the number of ticks sharing a bucket with an earlier tick
+    """
+
+    return len(timestamps) - len(np.unique(np.asarray(timestamps, dtype=np.int64) // step))
+
+
+def resample(timestamps, prices, start=None, end=None, step=STEP, fill='ffill', before=None):
+    """
+    Puts the prices onto a regular grid; the last price of every bucket is kept
+
+    Parameters:
+        - timestamps: unix timestamps in ascending order <numpy array>
+        - prices: the prices corresponding to the timestamps <numpy array>
+        - start: unix timestamp of the first bucket (default: the first tick)
+        - end: unix timestamp of the last bucket (default: the last tick)
+        - step: length of a bucket in seconds
+        - fill: how the empty buckets are filled:
+            - 'ffill': with the last price before them
+            - 'linear': interpolated between the prices around them ('ffill' after the last price)
+            - 'none': left as nan
+        - before: the last price before start, for the empty buckets at the beginning (default: nan)
+
+    Returns: (grid, values, observed) # numpy arrays: the starts of the buckets, the float64 prices, and
+             whether the bucket had a tick
+    """
+
+    if fill not in FILLS:
+        raise ValueError(f"The fill has to be one of: {', '.join(FILLS)}")
+
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+
+    if start is None or end is None:
+        if not len(timestamps):
+            return np.empty(0, dtype=np.int64), np.empty(0), np.empty(0, dtype=bool)
+        start = timestamps[0] if start is None else start
+        end = timestamps[-1] if end is None else end
+
+    grid = np.arange(int(start) // step * step, int(end) // step * step + step, step, dtype=np.int64)
+    values = np.full(len(grid), np.nan)
+
+    first, last = np.searchsorted(timestamps, [grid[0], grid[-1] + step]) if len(grid) else (0, 0)
+    idx = (timestamps[first:last] - grid[0]) // step
+
+    # The last tick of every bucket
+    closes = np.r_[idx[1:] != idx[:-1], True] if len(idx) else np.empty(0, dtype=bool)
+    values[idx[closes]] = np.asarray(prices)[first:last][closes]
+
+    observed = ~np.isnan(values)
+
+    if fill == 'none' or not len(grid):
+        return grid, values, observed
+
+    # The buckets before the first tick of the range
+    if before is not None and not observed[0]:
+        values[0] = before
+
+    known = np.flatnonzero(~np.isnan(values))
+
+    if fill == 'linear' and len(known) > 1:
+        inside = np.arange(known[0], known[-1] + 1)
+        values[inside] = np.interp(inside, known, values[known])
+
+    # The index of the last known bucket at every bucket (forward fill)
+    pos = np.maximum.accumulate(np.where(~np.isnan(values), np.arange(len(values)), -1))
+    values = np.where(pos >= 0, values[pos.clip(min=0)], np.nan)
+
+    return grid, values, observed
+
+
+""" The index """
+
+def split(start, end, filled, step=STEP):
+    """
+    Returns: the parts of the gap [start, end) that are still empty after the buckets filled: [(start, end)]
+    """
+
+    inside = filled[(filled >= start) & (filled < end)]
+    # The buckets on the two sides of a gap have ticks
+    starts, ends = find_gaps(np.r_[start - step, inside, end], step)
+
+    return list(zip(starts.tolist(), ends.tolist()))
+
+
+def update_gaps(cursor, asset_id, timestamps):
+    """
+    Updates the gap index with newly inserted ticks (runs on the writer, before update_candles)
+
+    Parameters:
+        - cursor: cursor to the db
+        - asset_id: id of the coin
+        - timestamps: unix timestamps of the new ticks <numpy array>
+    """
+
+    if not len(timestamps):
+        return
+
+    filled = np.unique(np.asarray(timestamps, dtype=np.int64) // STEP) * STEP
+
+    # The first and the last minute with a tick before these ones
+    first, last = cursor.execute("SELECT min(start), max(start) from candles where asset_id = ? and size = ?;",
+                                 (asset_id, STEP)).fetchone()
+
+    if first is None:
+        gaps = list(zip(*[part.tolist() for part in find_gaps(filled)]))
+    else:
+        gaps = []
+
+        # The holes that some of the ticks fell into (normally none: the new ticks are newer than the last one);
+        # the gaps don't overlap, so they start between the gap holding the first tick and the last tick
+        holes = cursor.execute("""SELECT start, end from gaps where asset_id = ? and start <= ? and start >=
+                                   coalesce((SELECT max(start) from gaps where asset_id = ? and start <= ?), 0);""",
+                               (asset_id, int(filled[-1]), asset_id, int(filled[0]))).fetchall() if filled[0] < last else []
+
+        if holes:
+            starts, ends = np.array(holes, dtype=np.int64).T
+            # The first new minute at or after the start of every gap, and whether it's inside the gap
+            pos = np.searchsorted(filled, starts)
+            hit = filled[pos.clip(max=len(filled) - 1)] < ends
+            hit &= pos < len(filled)
+
+            for start, end in zip(starts[hit].tolist(), ends[hit].tolist()):
+                cursor.execute("DELETE from gaps where asset_id = ? and start = ?;", (asset_id, start))
+                gaps += split(start, end, filled)
+
+        # Before the first and after the last minute
+        for outside in (np.r_[filled[filled < first], first], np.r_[last, filled[filled > last]]):
+            if len(outside) > 1:
+                gaps += list(zip(*[part.tolist() for part in find_gaps(outside)]))
+
+    cursor.executemany("INSERT INTO gaps VALUES (?, ?, ?);", [(asset_id, start, end) for start, end in gaps])
+
+
+def rebuild_gaps(cursor, asset_id, chunk=1_000_000):
+    """
+    Builds the gap index of a coin from its 1 minute candles (e.g. after a migration)
+    """
+
+    cursor.execute("DELETE from gaps where asset_id = ?;", (asset_id,))
+
+    after = -1
+    while True:
+        # The last minute of the previous chunk comes again, for the gap between the chunks
+        rows = cursor.execute("""SELECT start from candles where asset_id = ? and size = ? and start >= ?
+                                 order by start limit ?;""", (asset_id, STEP, after, chunk)).fetchall()
+
+        if len(rows) < 2:
+            return
+
+        starts, ends = find_gaps(np.array(rows, dtype=np.int64).ravel())
+        cursor.executemany("INSERT INTO gaps VALUES (?, ?, ?);", zip([asset_id] * len(starts), starts.tolist(), ends.tolist()))
+
+        if len(rows) < chunk:
+            return
+
+        after = rows[-1][0]
+
+
+""" Reading """
+
+def missing(cursor, base, start, end=None, min_length=STEP):
+    """
+    The gaps of a coin in a range, from the index
+
+    Parameters:
+        - cursor: cursor to the db
+        - base: name of the coin
+        - start: unix timestamp
+        - end: unix timestamp (default: no upper limit)
+        - min_length: only the gaps of at least this many seconds
+
+    Returns: a list of the gaps overlapping the range, clipped to it: [(start, end)] # [start, end), unix timestamps
+    """
+
+    from db import get_asset
+
+    if not (asset := get_asset(cursor, base)):
+        return []
+
+    end = end if end is not None else 2 ** 62
+    rows = cursor.execute("""SELECT max(start, ?), min(end, ?) from gaps where asset_id = ? and start < ? and end > ?
+                             and end - start >= ? order by start;""", (start, end, asset[0], end, start, min_length))
+
+    return [tuple(row) for row in rows.fetchall()]
+
+
+def dense(cursor, base, start, end=None, fill='ffill'):
+    """
+    The closes of the minutes of a range of a coin, one per minute (check resample())
+
+    Parameters:
+        - cursor: cursor to the db
+        - base: name of the coin
+        - start: unix timestamp
+        - end: unix timestamp (default: now)
+        - fill: how the minutes without a tick are filled: 'ffill', 'linear' or 'none'
+
+    Returns: (grid, prices, observed) # numpy arrays: the starts of the minutes, the float64 prices (nan before
+             the first tick of the coin), and whether the minute had a tick
+    """
+
+    from db import get_asset
+
+    end = int(end if end is not None else time.time())
+
+    if not (asset := get_asset(cursor, base)):
+        return resample([], [], start, end, fill='none')
+
+    asset_id, scale = asset
+    start = int(start) // STEP * STEP
+
+    rows = cursor.execute("SELECT start, close from candles where asset_id = ? and size = ? and start between ? and ? order by start;",
+                          (asset_id, STEP, start, end)).fetchall()
+    prior = cursor.execute("SELECT close from candles where asset_id = ? and size = ? and start < ? order by start desc limit 1;",
+                           (asset_id, STEP, start)).fetchone()
+
+    bars = np.array(rows, dtype=np.int64).reshape(-1, 2)
+    grid, values, observed = resample(bars[:, 0], bars[:, 1], start, end, fill=fill, before=prior[0] if prior else None)
+
+    return grid, values / 10 ** scale, observed
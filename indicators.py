@@ -0,0 +1,518 @@
+# Technical indicators (settings.indicators), computed over the closes of the 1 minute candles (check candles.py).
+#
+# The indicators are updated by the db writer whenever new ticks are stored (check db.insert_document):
+#   - normally only the minute bars after the last closed one are affected, so the saved state of every indicator
+#     is advanced by the bars that closed (a constant amount of work per bar), and the value of the open bar is
+#     computed from the state without changing it,
+#   - if older bars changed (e.g. by --backfill), or the indicators are new, they are recomputed with vectorized
+#     numpy code from a warmup period before the first changed bar.
+#
+# The values are stored in the indicators table (one row per indicator output and minute), and the states in
+# the indicator_state table (one json per coin).
+#
+# The api doesn't give the traded volume, so the vwap-style aggregate is time weighted (twap).
+
+import json
+import math
+from itertools import repeat
+
+import numpy as np
+
+import settings
+
+# The length of a bar in seconds
+BAR = 60
+
+# Size of the blocks of the vectorized recurrences (check recurrence())
+BLOCK = 128
+
+
+""" Rolling windows """
+# A window of the last n values with their running sum and sum of squares (json serializable)
+
+def new_window(n):
+    return {'n': n, 'ring': [], 'pos': 0, 'sum': 0.0, 'sumsq': 0.0}
+
+
+def window_peek(window, x):
+    """
+    Returns: (sum, sum of squares, count) of the window if x was pushed
+    """
+
+    ring, n = window['ring'], window['n']
+    old = ring[window['pos']] if len(ring) == n else 0.0
+
+    return window['sum'] + x - old, window['sumsq'] + x * x - old * old, min(len(ring) + 1, n)
+
+
+def window_push(window, x):
+    window['sum'], window['sumsq'], _ = window_peek(window, x)
+
+    if len(window['ring']) < window['n']:
+        window['ring'].append(x)
+    else:
+        window['ring'][window['pos']] = x
+        window['pos'] = (window['pos'] + 1) % window['n']
+
+
+def window_from(values, n):
+    """
+    Returns: a window holding the last n values <numpy array>
+    """
+
+    ring = [float(x) for x in values[-n:]]
+
+    return {'n': n, 'ring': ring, 'pos': 0, 'sum': math.fsum(ring), 'sumsq': math.fsum(x * x for x in ring)}
+
+
+def rolling_sum(values, n):
+    """
+    Returns: the sums of the windows of n values ending at every element; nan where the window isn't full
+    """
+
+    sums = np.full(len(values), np.nan)
+
+    if len(values) >= n:
+        cs = np.concatenate([[0.0], np.cumsum(values)])
+        sums[n - 1:] = cs[n:] - cs[:-n]
+
+    return sums
+
+
+def recurrence(x, a, y0=None):
+    """
+    Vectorized y[t] = a * y[t - 1] + (1 - a) * x[t], with y[-1] = y0 (default: y[0] = x[0])
+
+    The recurrence is solved in blocks: within a block, y[k] = a^(k+1) * y0 + (1 - a) * a^k * cumsum(x[j] * a^-j),
+    and the blocks are short enough for a^-j not to overflow.
+    """
+
+    y = np.empty(len(x))
+
+    if not len(x):
+        return y
+
+    if y0 is None:
+        y[0] = x[0]
+        y[1:] = recurrence(x[1:], a, x[0])
+        return y
+
+    powers = a ** np.arange(BLOCK + 1)
+    inverse = a ** -np.arange(BLOCK, dtype=np.float64)
+
+    for first in range(0, len(x), BLOCK):
+        block = x[first:first + BLOCK]
+        k = len(block)
+
+        y[first:first + k] = powers[1:k + 1] * y0 + (1 - a) * powers[:k] * np.cumsum(block * inverse[:k])
+        y0 = y[first + k - 1]
+
+    return y
+
+
+""" Indicators """
+# Every indicator has:
+#   - outputs: the suffixes of its outputs (the stored name is <name><suffix>)
+#   - new_state(): the state before the first bar
+#   - peek(state, t, p): the outputs if the bar (t, p) was pushed (None while warming up); the state is kept
+#   - push(state, t, p): pushes the bar, and returns its outputs
+#   - compute(timestamps, prices): (outputs as numpy arrays with nan while warming up, the state after the last bar)
+
+class SMA:
+    outputs = ['']
+
+    def __init__(self, n):
+        self.n = n
+
+    def new_state(self):
+        return {'w': new_window(self.n)}
+
+    def peek(self, state, t, p):
+        s, _, count = window_peek(state['w'], p)
+        return (s / self.n if count == self.n else None,)
+
+    def push(self, state, t, p):
+        values = self.peek(state, t, p)
+        window_push(state['w'], p)
+        return values
+
+    def compute(self, timestamps, prices):
+        return (rolling_sum(prices, self.n) / self.n,), {'w': window_from(prices, self.n)}
+
+
+class EMA:
+    outputs = ['']
+
+    def __init__(self, n):
+        self.n = n
+        self.a = 1 - 2 / (n + 1)
+
+    def new_state(self):
+        return {'value': None, 'count': 0}
+
+    def peek(self, state, t, p):
+        value = p if state['value'] is None else self.a * state['value'] + (1 - self.a) * p
+        return (value if state['count'] + 1 >= self.n else None,)
+
+    def push(self, state, t, p):
+        value = p if state['value'] is None else self.a * state['value'] + (1 - self.a) * p
+        state['value'], state['count'] = value, state['count'] + 1
+        return (value if state['count'] >= self.n else None,)
+
+    def compute(self, timestamps, prices):
+        values = recurrence(prices, self.a)
+        state = {'value': float(values[-1]) if len(values) else None, 'count': len(values)}
+
+        values = values.copy()
+        values[:self.n - 1] = np.nan
+
+        return (values,), state
+
+
+class Volatility:
+    """
+    The standard deviation of the log returns of the last n bars
+    """
+
+    outputs = ['']
+
+    def __init__(self, n):
+        self.n = n
+
+    def new_state(self):
+        return {'w': new_window(self.n), 'prev': None}
+
+    def peek(self, state, t, p):
+        if state['prev'] is None:
+            return (None,)
+
+        s, sq, count = window_peek(state['w'], math.log(p / state['prev']))
+        return (math.sqrt(max(sq / count - (s / count) ** 2, 0)) if count == self.n else None,)
+
+    def push(self, state, t, p):
+        values = self.peek(state, t, p)
+        if state['prev'] is not None:
+            window_push(state['w'], math.log(p / state['prev']))
+        state['prev'] = p
+        return values
+
+    def compute(self, timestamps, prices):
+        returns = np.diff(np.log(prices))
+        s, sq = rolling_sum(returns, self.n), rolling_sum(returns ** 2, self.n)
+
+        values = np.full(len(prices), np.nan)
+        values[1:] = np.sqrt(np.maximum(sq / self.n - (s / self.n) ** 2, 0))
+
+        return (values,), {'w': window_from(returns, self.n), 'prev': float(prices[-1]) if len(prices) else None}
+
+
+class RSI:
+    """
+    Relative strength index with wilder's smoothing
+    """
+
+    outputs = ['']
+
+    def __init__(self, n):
+        self.n = n
+
+    def new_state(self):
+        # gain and loss: the sums of the first n changes, then their smoothed averages
+        return {'prev': None, 'count': 0, 'gain': 0.0, 'loss': 0.0}
+
+    def _next(self, state, p):
+        if state['prev'] is None:
+            return 0, 0.0, 0.0
+
+        change = p - state['prev']
+        gain, loss = max(change, 0.0), max(-change, 0.0)
+        count = state['count'] + 1
+
+        if count < self.n:
+            return count, state['gain'] + gain, state['loss'] + loss
+        if count == self.n:
+            return count, (state['gain'] + gain) / self.n, (state['loss'] + loss) / self.n
+
+        return count, (state['gain'] * (self.n - 1) + gain) / self.n, (state['loss'] * (self.n - 1) + loss) / self.n
+
+    def _value(self, count, gain, loss):
+        if count < self.n:
+            return None
+
+        return 100.0 if loss == 0 else 100 - 100 / (1 + gain / loss)
+
+    def peek(self, state, t, p):
+        return (self._value(*self._next(state, p)),)
+
+    def push(self, state, t, p):
+        state['count'], state['gain'], state['loss'] = self._next(state, p)
+        state['prev'] = p
+        return (self._value(state['count'], state['gain'], state['loss']),)
+
+    def compute(self, timestamps, prices):
+        n = self.n
+        values = np.full(len(prices), np.nan)
+        changes = np.diff(prices)
+        gains, losses = np.maximum(changes, 0), np.maximum(-changes, 0)
+
+        state = {'prev': float(prices[-1]) if len(prices) else None, 'count': len(changes),
+                 'gain': float(gains.sum()), 'loss': float(losses.sum())}
+
+        if len(changes) < n:
+            return (values,), state
+
+        # The first average is the mean of the first n changes, then: avg = avg * (n - 1) / n + change / n
+        avg_gain = recurrence(gains[n:], 1 - 1 / n, gains[:n].mean())
+        avg_loss = recurrence(losses[n:], 1 - 1 / n, losses[:n].mean())
+        avg_gain = np.concatenate([[gains[:n].mean()], avg_gain])
+        avg_loss = np.concatenate([[losses[:n].mean()], avg_loss])
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            values[n:] = np.where(avg_loss == 0, 100.0, 100 - 100 / (1 + avg_gain / avg_loss))
+
+        state['gain'], state['loss'] = float(avg_gain[-1]), float(avg_loss[-1])
+
+        return (values,), state
+
+
+class Bollinger:
+    """
+    The moving average of the last n bars, and the bands k standard deviations above and below it
+    """
+
+    outputs = ['_mid', '_upper', '_lower']
+
+    def __init__(self, n, k=2):
+        self.n = n
+        self.k = k
+
+    def new_state(self):
+        return {'w': new_window(self.n)}
+
+    def _values(self, s, sq, count):
+        if count < self.n:
+            return None, None, None
+
+        mean = s / self.n
+        std = math.sqrt(max(sq / self.n - mean * mean, 0))
+
+        return mean, mean + self.k * std, mean - self.k * std
+
+    def peek(self, state, t, p):
+        return self._values(*window_peek(state['w'], p))
+
+    def push(self, state, t, p):
+        values = self.peek(state, t, p)
+        window_push(state['w'], p)
+        return values
+
+    def compute(self, timestamps, prices):
+        mean = rolling_sum(prices, self.n) / self.n
+        std = np.sqrt(np.maximum(rolling_sum(prices ** 2, self.n) / self.n - mean ** 2, 0))
+
+        return (mean, mean + self.k * std, mean - self.k * std), {'w': window_from(prices, self.n)}
+
+
+class TWAP:
+    """
+    Time weighted average price of the last n bars: every close is weighted by how long it held (until the next bar)
+    """
+
+    outputs = ['']
+
+    def __init__(self, n):
+        self.n = n
+
+    def new_state(self):
+        return {'pdt': new_window(self.n), 'dt': new_window(self.n), 'prev': None}
+
+    def peek(self, state, t, p):
+        if state['prev'] is None:
+            return (None,)
+
+        prev_t, prev_p = state['prev']
+        weighted, _, count = window_peek(state['pdt'], prev_p * (t - prev_t))
+        duration, _, _ = window_peek(state['dt'], t - prev_t)
+
+        return (weighted / duration if count == self.n and duration else None,)
+
+    def push(self, state, t, p):
+        values = self.peek(state, t, p)
+
+        if state['prev'] is not None:
+            prev_t, prev_p = state['prev']
+            window_push(state['pdt'], prev_p * (t - prev_t))
+            window_push(state['dt'], float(t - prev_t))
+
+        state['prev'] = [int(t), p]
+
+        return values
+
+    def compute(self, timestamps, prices):
+        dt = np.diff(timestamps).astype(np.float64)
+        pdt = prices[:-1] * dt
+
+        values = np.full(len(prices), np.nan)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            values[1:] = rolling_sum(pdt, self.n) / rolling_sum(dt, self.n)
+
+        state = {'pdt': window_from(pdt, self.n), 'dt': window_from(dt, self.n),
+                 'prev': [int(timestamps[-1]), float(prices[-1])] if len(prices) else None}
+
+        return (values,), state
+
+
+KINDS = {
+    'sma': SMA,
+    'ema': EMA,
+    'volatility': Volatility,
+    'rsi': RSI,
+    'bollinger': Bollinger,
+    'twap': TWAP,
+}
+
+
+def configured(spec=None):
+    """
+    Returns: name -> indicator of the indicators of settings.indicators (or spec)
+    """
+
+    return {name: KINDS[kind](*params) for name, (kind, *params) in (spec or settings.indicators).items()}
+
+
+def output_names(indicators):
+    """
+    Returns: the stored names of the outputs (e.g. bollinger_20_upper) of the indicators: name -> list of names
+    """
+
+    return {name: [name + suffix for suffix in indicator.outputs] for name, indicator in indicators.items()}
+
+
+""" Storage """
+
+def update_indicators(cursor, asset_id, scale, since, states):
+    """
+    Updates the indicators of a coin after new ticks were stored (and its candles were updated)
+
+    Parameters:
+        - cursor: cursor to the db
+        - asset_id: id of the coin
+        - scale: number of decimals of the stored prices
+        - since: the timestamp of the oldest new tick
+        - states: asset_id -> (timestamp of the last closed bar, {name: state}) <dict> (cache)
+
+    Returns: the values of the newest bar: output name -> value (None while warming up)
+    """
+
+    indicators = configured()
+
+    if asset_id not in states:
+        row = cursor.execute("SELECT timestamp, state from indicator_state where asset_id = ?;", (asset_id,)).fetchone()
+        states[asset_id] = (row[0], json.loads(row[1])) if row else None
+
+    saved = states[asset_id]
+    since = since // BAR * BAR
+
+    # The indicators are new (or were changed), or an older bar changed
+    if saved is None or set(saved[1]) != set(indicators) or since <= saved[0]:
+        return rebuild_indicators(cursor, asset_id, scale, states, since if saved and set(saved[1]) == set(indicators) else None)
+
+    last, state = saved
+    bars = cursor.execute("SELECT start, close from candles where asset_id = ? and size = ? and start > ? order by start;",
+                          (asset_id, BAR, last)).fetchall()
+
+    if not bars:
+        return {}
+
+    names = output_names(indicators)
+    rows = []
+
+    # All the bars but the newest one are closed
+    for start, close in bars[:-1]:
+        for name, indicator in indicators.items():
+            rows.extend(zip(repeat(asset_id), names[name], repeat(start), indicator.push(state[name], start, close / 10 ** scale)))
+
+    start, close = bars[-1]
+    latest = {}
+    for name, indicator in indicators.items():
+        values = indicator.peek(state[name], start, close / 10 ** scale)
+        latest.update(zip(names[name], values))
+        rows.extend(zip(repeat(asset_id), names[name], repeat(start), values))
+
+    write_values(cursor, rows)
+
+    if len(bars) > 1:
+        states[asset_id] = (bars[-2][0], state)
+        save_state(cursor, asset_id, bars[-2][0], state)
+
+    return latest
+
+
+def rebuild_indicators(cursor, asset_id, scale, states, since=None):
+    """
+    Recomputes the indicators of a coin (vectorized) from since on; the computation starts from a warmup period
+    before since (settings.indicator_warmup times the longest window), so the windows are exact, and the exponential
+    averages have converged.
+
+    Parameters:
+        - cursor: cursor to the db
+        - asset_id: id of the coin
+        - scale: number of decimals of the stored prices
+        - states: asset_id -> (timestamp of the last closed bar, {name: state}) <dict> (cache)
+        - since: the start of the first changed bar (default: recompute everything)
+
+    Returns: the values of the newest bar: output name -> value
+    """
+
+    indicators = configured()
+    names = output_names(indicators)
+
+    if since is None:
+        cursor.execute("DELETE from indicators where asset_id = ?;", (asset_id,))
+        since = 0
+        warmup = []
+    else:
+        longest = max([indicator.n for indicator in indicators.values()], default=1)
+        warmup = cursor.execute("SELECT start, close from candles where asset_id = ? and size = ? and start < ? order by start desc limit ?;",
+                                (asset_id, BAR, since, longest * settings.indicator_warmup)).fetchall()[::-1]
+
+    bars = warmup + cursor.execute("SELECT start, close from candles where asset_id = ? and size = ? and start >= ? order by start;",
+                                   (asset_id, BAR, since)).fetchall()
+
+    if not bars:
+        return {}
+
+    data = np.array(bars, dtype=np.int64)
+    timestamps, prices = data[:, 0], data[:, 1] / 10 ** scale
+
+    # The newest bar is still open, so it isn't part of the state (check update_indicators)
+    changed = slice(len(warmup), len(bars) - 1)
+    state = {}
+    latest = {}
+
+    for name, indicator in indicators.items():
+        outputs, state[name] = indicator.compute(timestamps[:-1], prices[:-1])
+        values = indicator.peek(state[name], int(timestamps[-1]), float(prices[-1]))
+        latest.update(zip(names[name], values))
+
+        for output, column, value in zip(names[name], outputs, values):
+            column = column[changed]
+            keep = ~np.isnan(column)
+            write_values(cursor, zip(repeat(asset_id), repeat(output), timestamps[changed][keep].tolist(), column[keep].tolist()))
+            write_values(cursor, [(asset_id, output, int(timestamps[-1]), value)])
+
+    last = int(timestamps[-2]) if len(bars) > 1 else -1
+    states[asset_id] = (last, state)
+    save_state(cursor, asset_id, last, state)
+
+    return latest
+
+
+def write_values(cursor, rows):
+    cursor.executemany("INSERT OR REPLACE INTO indicators VALUES (?, ?, ?, ?);", (row for row in rows if row[3] is not None))
+
+
+def save_state(cursor, asset_id, timestamp, state):
+    cursor.execute("""INSERT INTO indicator_state VALUES (?, ?, ?)
+                      ON CONFLICT(asset_id) DO UPDATE SET timestamp = excluded.timestamp, state = excluded.state;""",
+                   (asset_id, timestamp, json.dumps(state)))
@@ -0,0 +1,324 @@
+# In-memory data of the live graph (--live).
+# The recent window is kept in a ring buffer which is filled once from the database, and then only the
+# newly fetched points are pushed into it; so drawing a frame doesn't need to touch the database.
+
+import time
+from queue import Queue, Empty
+from threading import Thread
+from datetime import datetime
+
+import numpy as np
+
+
+class RingBuffer:
+    """
+    A fixed-size buffer of the latest prices, one price per bucket (e.g. per minute), in ascending order of time.
+
+    Every value is written twice (at i and i + capacity), so the whole buffer can always be
+    returned as a contiguous view without copying (check view()).
+    """
+
+    def __init__(self, capacity, bucket=60):
+        """
+        Parameters:
+            - capacity: maximum number of buckets kept
+            - bucket: length of a bucket in seconds
+        """
+
+        self.capacity = capacity
+        self.bucket = bucket
+        self.timestamps = np.zeros(2 * capacity, dtype=np.int64)
+        self.prices = np.zeros(2 * capacity, dtype=np.float64)
+        # Index of the oldest bucket, and number of buckets stored
+        self.start = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def view(self):
+        """
+        Returns: (timestamps, prices) # numpy views (not copies) in ascending order; the timestamps are the starts of the buckets
+        """
+
+        end = self.start + self.size
+
+        return self.timestamps[self.start:end], self.prices[self.start:end]
+
+    def window(self, seconds):
+        """
+        Returns: (timestamps, prices) of the last seconds (relative to the newest bucket) # numpy views
+        """
+
+        timestamps, prices = self.view()
+
+        if not self.size:
+            return timestamps, prices
+
+        first = np.searchsorted(timestamps, timestamps[-1] - seconds)
+
+        return timestamps[first:], prices[first:]
+
+    def extend(self, timestamps, prices):
+        """
+        Adds the points which are not older than the newest bucket; the last price of a bucket is kept.
+
+        Parameters:
+            - timestamps: unix timestamps <numpy array>
+            - prices: the prices corresponding to the timestamps <numpy array>
+
+        Returns: True if the buffer changed
+        """
+
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        prices = np.asarray(prices, dtype=np.float64)
+
+        if not len(timestamps):
+            return False
+
+        # The api sends the points in descending order
+        order = np.argsort(timestamps, kind='stable')
+        buckets = timestamps[order] // self.bucket * self.bucket
+        prices = prices[order]
+
+        # Keep the last point of every bucket
+        last = np.append(buckets[1:] != buckets[:-1], True)
+        buckets, prices = buckets[last], prices[last]
+
+        if self.size:
+            newest = self.timestamps[self.start + self.size - 1]
+            keep = buckets >= newest
+            buckets, prices = buckets[keep], prices[keep]
+
+            if not len(buckets):
+                return False
+
+            # The newest bucket is still open, so update its price
+            if buckets[0] == newest:
+                self._write(self.size - 1, prices[:1])
+                buckets, prices = buckets[1:], prices[1:]
+
+        # Only the last capacity buckets can fit
+        buckets, prices = buckets[-self.capacity:], prices[-self.capacity:]
+        n = len(buckets)
+
+        if n:
+            overflow = max(0, self.size + n - self.capacity)
+            self.start = (self.start + overflow) % self.capacity
+            self.size -= overflow
+
+            self._write(self.size, prices, buckets)
+            self.size += n
+
+        return True
+
+    def _write(self, offset, prices, timestamps=None):
+        """
+        Writes the values at the positions offset, offset + 1, ... (relative to the oldest bucket) and their mirrors
+        """
+
+        positions = (self.start + offset + np.arange(len(prices))) % self.capacity
+
+        for idx in [positions, positions + self.capacity]:
+            self.prices[idx] = prices
+            if timestamps is not None:
+                self.timestamps[idx] = timestamps
+
+
+def points_from_document(data):
+    """
+    Extracts the points of the last hour and the latest price from an api response
+
+    Parameters:
+        - data: The dictionary holding the api response (check schema.py)
+
+    Returns: (timestamps, prices) # numpy arrays
+    """
+
+    prices = data['prices']
+    hour = prices['hour']['prices']
+
+    timestamps = np.fromiter((tp[1] for tp in hour), dtype=np.int64, count=len(hour))
+    values = np.array([tp[0] for tp in hour], dtype=np.float64)
+
+    latest = int(datetime.fromisoformat(prices['latest_price']['timestamp']).timestamp())
+
+    return np.append(timestamps, latest), np.append(values, float(prices['latest']))
+
+
+class LiveFeed(Thread):
+    """
+    Fetches the latest data periodically in the background, and queues the new points for the graph.
+    The points are pushed into the buffer by the thread that draws (check drain()), so the buffer is never shared.
+    """
+
+    def __init__(self, fetch, period=10):
+        """
+        Parameters:
+            - fetch: a function returning (data, intervals) or None (check main.fetch_and_update)
+            - period: seconds between fetches
+        """
+        super().__init__(daemon=True, name='live-feed')
+
+        self.fetch = fetch
+        self.period = period
+        self.updates = Queue()
+
+    def run(self):
+        while True:
+            if (ret := self.fetch()):
+                self.updates.put(points_from_document(ret[0]))
+
+            time.sleep(self.period)
+
+    def drain(self, buffer):
+        """
+        Pushes the fetched points into the buffer
+
+        Parameters:
+            - buffer: RingBuffer
+
+        Returns: True if the buffer changed
+        """
+        changed = False
+
+        while True:
+            try:
+                timestamps, prices = self.updates.get_nowait()
+            except Empty:
+                return changed
+
+            changed |= buffer.extend(timestamps, prices)
+
+
+class BlitChart:
+    """
+    A live line chart that is redrawn with blitting: the static parts of the figure (axes, ticks, labels) are
+    rendered once and cached, and every frame only restores the cached background and draws the line and the texts.
+
+    The whole figure is redrawn only when the data leaves the current limits: the price band (y-axis) or the
+    end of the time window (x-axis). The texts are laid out once per resize.
+    """
+
+    def __init__(self, ax, window, band=10, margin=5 * 60, time_format="%H:%M"):
+        """
+        Parameters:
+            - ax: a matplotlib.Axes object
+            - window: seconds shown on the x-axis
+            - band: padding (in price) added above and below the prices when the y-limits are reset
+            - margin: seconds of empty space kept at the end of the x-axis, so that the x-limits are reset once per margin
+            - time_format: format of the current time text
+        """
+
+        self.ax = ax
+        self.canvas = ax.figure.canvas
+        self.window = window
+        self.band = band
+        self.margin = margin
+        self.time_format = time_format
+
+        self.line = ax.plot([], [], color='b', animated=True)[0]
+        # The text fields correlate to: latest_price, current_time, percent_change over the period respectively
+        # They are placed in axes coordinates, so they don't move when the limits change
+        self.texts = [
+            ax.text(0, 1.01, "", transform=ax.transAxes, fontsize='xx-large', animated=True),
+            ax.text(1, 1.01, "", transform=ax.transAxes, fontsize='xx-large', ha='right', animated=True),
+            ax.text(0, 1.04, "", transform=ax.transAxes, animated=True),
+        ]
+
+        self.background = None
+        self.layout_pending = True
+
+        self.canvas.mpl_connect('draw_event', self._on_draw)
+        self.canvas.mpl_connect('resize_event', self._on_resize)
+
+    @property
+    def artists(self):
+        return [self.line, *self.texts]
+
+    def update(self, timestamps, prices):
+        """
+        Draws a new frame
+
+        Parameters:
+            - timestamps: x-data (unix timestamps)
+            - prices: y-data
+        """
+
+        if not len(timestamps):
+            return
+
+        latest_price_text, current_time_text, percent_change_text = self.texts
+
+        self.line.set_data(timestamps, prices)
+
+        # Percent Change:
+        percent_change = (((prices[-1] - prices[0]) / prices[0]) * 100)
+
+        latest_price_text.set_text(f"Latest Price: {prices[-1]:.2f}")
+        current_time_text.set_text(f"Current Time: {datetime.fromtimestamp(timestamps[-1]).strftime(self.time_format)}")
+        percent_change_text.set(
+            text = f"{'-' if percent_change < 0 else '+'}{abs(percent_change):.2f}%",
+            color = 'r' if percent_change < 0 else 'g',
+        )
+
+        if self._update_limits(timestamps, prices) or self.background is None:
+            # A full redraw; the new background is cached by _on_draw
+            self.canvas.draw_idle()
+            return
+
+        self.canvas.restore_region(self.background)
+        self._draw_artists()
+        self.canvas.blit(self.ax.figure.bbox)
+
+    def _update_limits(self, timestamps, prices):
+        """
+        Resets the limits if the data left them
+
+        Returns: True if the limits changed
+        """
+
+        low, high = prices.min(), prices.max()
+        changed = False
+
+        y0, y1 = self.ax.get_ylim()
+        if low < y0 or high > y1:
+            self.ax.set_ylim(low - self.band, high + self.band)
+            changed = True
+
+        x0, x1 = self.ax.get_xlim()
+        if timestamps[-1] > x1 or timestamps[0] < x0:
+            self.ax.set_xlim(timestamps[-1] - self.window, timestamps[-1] + self.margin)
+            changed = True
+
+        return changed
+
+    def _on_resize(self, event):
+        self.layout_pending = True
+
+    def _on_draw(self, event):
+        """
+        Caches the background after a full redraw, and draws the animated artists on top of it
+        """
+
+        if self.layout_pending:
+            self._layout(event.renderer)
+
+        self.background = self.canvas.copy_from_bbox(self.ax.figure.bbox)
+        self._draw_artists()
+
+    def _layout(self, renderer):
+        """
+        Places the percent change text right after the latest price text
+        """
+
+        latest_price_text, _, percent_change_text = self.texts
+
+        bb = latest_price_text.get_window_extent(renderer).transformed(self.ax.transAxes.inverted())
+        percent_change_text.set(x=bb.x1 + 0.005, y=bb.y1 - 0.01)
+
+        self.layout_pending = False
+
+    def _draw_artists(self):
+        for artist in self.artists:
+            self.ax.draw_artist(artist)
@@ -1,26 +1,20 @@
 # Notes: 
 # 1. Time will be saved as UTC time (converting while viz)
-# 2. The concurrent loop for data collection can be implemented with a better method using asynchronous methods.
+# 2. The data collection loop (--collect) fetches all the coins of settings.py asynchronously (check collector.py)
 # 3. The base_id of all the coins can be fetched from the first url of schema.py
 # 4. The definition of interval might be misleading here; An example would clear it up:
 #    If we are getting the price of a coin in interval=hour, then we mean the historical prices in the past hour
 
-import requests, json, sys, time
-import matplotlib.pyplot as plt
-from math import ceil
-import numpy as np
-from datetime import datetime, timedelta
-from concurrent.futures import ThreadPoolExecutor
-from matplotlib.animation import FuncAnimation
-import matplotlib.animation as animation
-import matplotlib.dates as mdates
-import matplotlib.text as mtext
-from matplotlib.patches import Rectangle
-import sqlite3
-from threading import Thread
+import sys, time
+from datetime import datetime
 
+# The rest (numpy, matplotlib, aiohttp, google's client, ...) is imported by the subcommands that use it (check parse_args)
+import settings
+import db
+import metrics
+import cache
+import parse
 from db import update_db
-from notify import send_mail
 
 """ Things to do before running the program """
 # Create the file individuals.json storing the following dictionary
@@ -33,7 +27,10 @@ from notify import send_mail
 # with open("individuals.json", "w") as fp:
 #   json.dump(<your_dictionary>, fp)
 
-# When to notify
+# When to notify (for every coin of settings.assets)
+# The rules of a coin can be overridden with: 'assets': {'<coin>': {...}},
+# bands of prices can be added with: 'bands': [(low, high), ...], and rules on the technical indicators
+# (settings.indicators) with: 'indicators': [('rsi_14', 70, 'above'), ...] (check rules.py)
 notifier_settings = {
     'upper_value_threshold': 2500,
     'lower_value_threshold': 1500,
@@ -43,190 +40,463 @@ notifier_settings = {
 wait_time = 60 * 30
 
 
-def main():
+def parse_args(argv=None):
+    """
+    Parses the command line; the old options (--collect, --viz -hd, ...) still work
+
+    Parameters:
+        - argv: the arguments (default: sys.argv[1:])
+
+    Returns: argparse.Namespace; args.command is the function of the subcommand
+    """
+
+    import argparse
+
+    argv = legacy_args(list(sys.argv[1:] if argv is None else argv))
+
+    parser = argparse.ArgumentParser(prog='main.py', description="Collects and visualizes the prices of crypto currencies from coinbase")
+    commands = parser.add_subparsers(metavar='<command>')
+
+    sub = commands.add_parser('fetch', help="fetch and store the latest prices of ETH once (the default)")
+    sub.set_defaults(command=cmd_fetch)
+
+    sub = commands.add_parser('collect', help="collect the prices of the coins of settings.py until Ctrl+C")
+    sub.add_argument('--shards', type=int, default=None, help="number of collector processes (default: settings.collect_shards)")
+    sub.set_defaults(command=cmd_collect)
+
+    sub = commands.add_parser('live', help="a live graph of the last hour")
+    sub.set_defaults(command=cmd_live)
+
+    sub = commands.add_parser('dashboard', help="live graphs of many coins in a single window")
+    sub.add_argument('coins', nargs='?', help="comma separated coins (default: the coins of settings.py)")
+    sub.add_argument('--columns', type=int, help="number of columns of the grid (default: settings.dashboard_columns)")
+    sub.set_defaults(command=cmd_dashboard)
+
+    sub = commands.add_parser('viz', help="the trend over the intervals")
+    sub.add_argument('intervals', nargs='?', default='hd', help="any of (h)our, (d)ay, (w)eek, (m)onth, (y)ear (default: hd)")
+    sub.set_defaults(command=cmd_viz)
+
+    sub = commands.add_parser('export', help="render the charts of all the coins into files (no display)")
+    sub.add_argument('intervals', nargs='?', default='hd', help="any of (h)our, (d)ay, (w)eek, (m)onth, (y)ear (default: hd)")
+    sub.set_defaults(command=cmd_export)
+
+    sub = commands.add_parser('candles', help="the candle sticks of the last 100 periods")
+    sub.add_argument('size', nargs='?', default='1h', help="1m, 5m, 1h or 1d (default: 1h)")
+    sub.add_argument('--fetch', action='store_true', help="fetch the latest prices of ETH first")
+    sub.set_defaults(command=cmd_candles)
+
+    sub = commands.add_parser('backfill', help="load the whole history of the coins")
+    sub.add_argument('coins', nargs='?', help="comma separated coins (default: the coins of settings.py)")
+    sub.add_argument('--restart', action='store_true', help="load the coins that were loaded before as well")
+    sub.set_defaults(command=cmd_backfill)
+
+    sub = commands.add_parser('archive', help="move the old ticks into the archive")
+    sub.add_argument('days', nargs='?', type=int, help="archive the months older than this (default: settings.archive_after_days)")
+    sub.add_argument('--vacuum', action='store_true', help="shrink the database file afterwards")
+    sub.set_defaults(command=cmd_archive)
+
+    sub = commands.add_parser('gaps', help="the minutes without prices of the coins")
+    sub.add_argument('coins', nargs='?', help="comma separated coins (default: the coins of settings.py)")
+    sub.add_argument('--days', type=float, default=1, help="the window checked, in days (default: 1)")
+    sub.add_argument('--min', type=int, default=1, help="only the gaps of at least this many minutes (default: 1)")
+    sub.set_defaults(command=cmd_gaps)
+
+    parser.set_defaults(command=cmd_fetch)
+
+    return parser.parse_args(argv)
+
+
+def legacy_args(argv):
+    """
+    Returns: the arguments with the old options turned into subcommands: --viz -wdm -> viz wdm
+    """
+
+    if argv and argv[0].lower() in ['--collect', '--live', '--dashboard', '--viz', '--export', '--candles', '--backfill', '--archive', '--gaps']:
+        command = argv[0].lower()[2:]
+        rest = argv[1:]
+
+        # The intervals used to be given as -hd
+        if command in ['viz', 'export'] and rest and rest[0].startswith('-') and not rest[0].startswith('--'):
+            rest[0] = rest[0][1:]
+
+        return [command, *[arg.lower() if command in ['candles', 'viz', 'export'] else arg for arg in rest]]
+
+    return argv
+
+
+def main(argv=None):
+    """
+    The entry point; every subcommand imports only what it uses, e.g. collect doesn't load matplotlib
+    """
+
+    args = parse_args(argv)
+
+    # Set up the schema, the db writer and the pool of readers once
+    db.init_db()
+
+    return args.command(args)
+
+
+def start(notifier=False):
+    """
+    Fetches and stores the latest prices of ETH, and starts the notifier and the metrics if asked
+
+    Returns: True if the prices were fetched
+    """
 
     if not (ret := fetch_and_update()):
         print("\n\nError occured while fetching the data.")
-        return
-
-    data, intervals = ret
+        return False
 
-    args = sys.argv
-    option = args[1] if len(args) > 1 else ""
-    option = option.lower()
+    # Wait for the first update to be written
+    db.get_writer().flush()
 
     # For the continuous data collection options, call the notifier
-    if option in ['--collect', '--live']:
-        # We want the notifier to close with the program
-        thread = Thread(target=notify, daemon=True)
-        thread.start()
-
-    # This option collects price data every minute and stores it into the database in perpetuity until interrupted by the user.
-    if option == '--collect':
-        with ThreadPoolExecutor(max_workers=1) as executor:
-            future = executor.submit(do_quit)
-
-            while not future.done():
-                _ = fetch_and_update()
-                next_update_time = (datetime.now() + timedelta(minutes=1)).astimezone().strftime('%I:%M:%S %p')
-                print(f"Next update in (1 minute): {next_update_time}")
-                time.sleep(60)
-
-    elif option == '--live':
-        # Note: There is delay between when the graph updates between minutes
-        # that is because coinbase takes a few seconds to update their latest value
-        # so it will take 10 - 15 seconds more to update to the latest price
-        # Update an existing graph every minute:
-        fig = plt.figure(figsize=(16,8))
-        ax = plt.subplot(111)
-        # The text fields correlate to: latest_price, current_time, percent_change over the period respectively
-        texts = [ax.text(0, 0, ""), ax.text(0, 0, ""), ax.text(0, 0, "")]
-
-        conn = sqlite3.connect('crypto.db')
+    if notifier:
+        from rules import RuleEngine, rules_from_settings
+
+        # The rules are checked against every batch of new prices as soon as it's written
+        engine = RuleEngine(rules_from_settings(notifier_settings, settings.assets, settings.currency), cooldown=wait_time)
+        db.get_writer().add_listener(lambda events: notify(engine, events))
+
+        # The timings of the stages and the counters (check metrics.py)
+        metrics.start(settings.metrics_port, settings.metrics_file, settings.metrics_dump_period)
+
+    return True
+
+
+def cmd_fetch(args):
+    start()
+
+
+def cmd_backfill(args):
+    """
+    Loads the whole history of the coins (default: the coins of settings.assets; the coins loaded before are
+    skipped unless --restart is given)
+    """
+
+    import asyncio
+    from backfill import run_backfill
+
+    names = args.coins.upper().split(',') if args.coins else list(settings.assets)
+
+    asyncio.run(run_backfill({name: settings.assets.get(name) for name in names}, restart=args.restart))
+
+
+def cmd_gaps(args):
+    """
+    Prints the minutes of the window without prices, per coin (from the gap index, check gaps.py)
+    """
+
+    import gaps
+
+    names = args.coins.upper().split(',') if args.coins else list(settings.assets)
+    end = int(time.time())
+    start = end - int(args.days * 60 * 60 * 24)
+
+    with db.reader() as conn:
         cursor = conn.cursor()
 
-        latest = cursor.execute('SELECT price from eth_data order by timestamp desc limit 1;').fetchone()[0]
-        timestamps, prices = extract_last_hour_data(cursor)
-        times = set_datetime_axis(ax, timestamps)
+        for name in names:
+            grid, _, observed = gaps.dense(cursor, name, start, end, fill='none')
+            missing = gaps.missing(cursor, name, start, end, min_length=args.min * gaps.STEP)
+
+            if not observed.any():
+                print(f"{name}: No prices in the window")
+                continue
 
-        line = plt.plot(times, prices, color='b')[0]
+            print(f"{name}: {observed.sum()} of {len(grid)} minutes have a price, {len(missing)} gap(s); "
+                  f"the last price is {(end - grid[observed][-1]) // 60} minute(s) old")
 
-        update_axis(times, prices, ax, texts)
+            for gap_start, gap_end in sorted(missing, key=lambda gap: gap[0] - gap[1])[:5]:
+                print(f"\t{datetime.fromtimestamp(gap_start).strftime('%Y-%m-%d %H:%M')}: {(gap_end - gap_start) // 60} minute(s)")
 
-        anim = FuncAnimation(fig, animate, frames=2500, repeat=False, init_func=None, blit=False, interval = 10 * 1000, fargs=(cursor, line, ax, texts))
 
-        def progress_callback(cf, tf):
-            print(f'Saving frame {cf} of {tf}')
-            # Wait 1 seconds between frames
-            time.sleep(1)
+def cmd_archive(args):
+    """
+    Moves the old ticks out of the database into the archive (check archive.py)
+    """
 
-        # Total duration: interval / fps
-        #anim.save('data.mp4', fps=30, dpi=100, progress_callback=progress_callback)
+    from archive import run_archive
 
-        plt.show()
+    months = run_archive(args.days, vacuum=args.vacuum)
+    print(f"Archived {months} month(s) into {settings.archive_dir}")
+
+
+def cmd_collect(args):
+    """
+    Collects price data every minute and stores it into the database in perpetuity until interrupted by the user.
+    """
+
+    import asyncio
+    from collector import run_collector
+
+    if not start(notifier=True):
+        return
+
+    print("Press Ctrl+C to quit.")
+
+    if (shards := args.shards or settings.collect_shards) > 1:
+        # Several collector processes, and the writer in this one (check shard.py)
+        from shard import run_sharded
+        return run_sharded(settings.assets, shards)
+
+    # Fetch the coins of settings.assets on a fixed schedule (check scheduler.py); Ctrl+C (or SIGTERM) stops it right away
+    asyncio.run(run_collector(settings.assets, period=settings.collect_period, periods=settings.collect_periods,
+                              jitter=settings.collect_jitter, missed=settings.collect_missed))
+
+
+def cmd_live(args):
+    """
+    Shows a graph of the last hour that is updated with the latest prices
+    """
+
+    import matplotlib.pyplot as plt
+    from matplotlib.animation import FuncAnimation
+    from matplotlib.ticker import MultipleLocator
+    from live import RingBuffer, LiveFeed, BlitChart
+
+    if not start(notifier=True):
+        return
+
+    # Note: There is delay between when the graph updates between minutes
+    # that is because coinbase takes a few seconds to update their latest value
+    # so it will take 10 - 15 seconds more to update to the latest price
+    # Update an existing graph every minute:
+    fig = plt.figure(figsize=(16,8))
+    ax = plt.subplot(111)
+
+    # The last hour is kept in memory, one price per minute; it's read from the db once, and then only
+    # the newly fetched points are added to it (check live.py)
+    buffer = RingBuffer(capacity=settings.live_window // 60)
+    with db.reader() as conn:
+        buffer.extend(*extract_last_hour_data(conn.cursor(), settings.live_window))
+
+    # Fetches (and stores) the latest data in the background
+    feed = LiveFeed(fetch_and_update, period=settings.live_fetch_period)
+    feed.start()
+
+    set_datetime_axis(ax)
+
+    if fig.canvas.supports_blit:
+        # Only the line and the texts are redrawn per frame (check live.BlitChart)
+        ax.xaxis.set_major_locator(MultipleLocator(5 * 60))
+        chart = BlitChart(ax, settings.live_window, time_format=time_format)
+        chart.update(*buffer.view())
+
+        def redraw():
+            if feed.drain(buffer):
+                with metrics.timed('render'):
+                    chart.update(*buffer.view())
+
+        timer = fig.canvas.new_timer(interval=settings.live_frame_interval)
+        timer.add_callback(redraw)
+        timer.start()
 
-    # This function visualizes the historical prices based on interval.
-    elif option == '--viz':
-        # Graph of the intervals
-        fig = plt.figure(figsize=(16, 8))
-
-        mapping = {
-            'h': 'hour',
-            'd': 'day',
-            'w': 'week',
-            'm': 'month',
-            'y': 'year'
-        }
-
-        user_choosen_intervals = args[2].lower() if len(args) > 2 else 'hd' 
-
-        show_intervals = [l for s, l in mapping.items() if s in user_choosen_intervals]
-        # Use the second param to select between intervals: ['hour', 'day', 'week', 'month', 'year']
-        plot_interval(intervals, show_intervals)
-        fig.suptitle('Trend over an hour, and a day')
         plt.show()
+        return
 
+    # The backend can't blit, so the whole figure is redrawn per frame
+    # The text fields correlate to: latest_price, current_time, percent_change over the period respectively
+    texts = [ax.text(0, 0, ""), ax.text(0, 0, ""), ax.text(0, 0, "")]
 
-def notify():
-    conn = sqlite3.connect('crypto.db')
-    cursor = conn.cursor()
-    
-    last_mail_time = None 
+    timestamps, prices = buffer.view()
+    line = plt.plot(timestamps, prices, color='b')[0]
 
-    while True:
-        # Get the latest price:
-        latest_price, percent_change = map(float, cursor.execute("SELECT price, hour from eth_data where hour not null order by timestamp desc limit 1;").fetchone())
-        
+    update_axis(timestamps, prices, ax, texts)
+
+    # Kept referenced until the window is closed, otherwise the animation stops
+    anim = FuncAnimation(fig, animate, frames=None, init_func=None, blit=False, interval=settings.live_frame_interval, fargs=(feed, buffer, line, ax, texts))
 
-        if can_send_a_mail(last_mail_time):
-            if abs(percent_change * 100) >= notifier_settings['hourly_percent_threshold']:
-                subject = f"ETH is {'rising' if percent_change > 0 else 'dropping'} fast"
-                body = f"Current Stats - \n\t Price: {latest_price:.2f} CAD \n\t Percent Change: {'+' if percent_change > 0 else ''}{percent_change * 100:.2f} (last hour)"
-                send_mail(subject, body)
+    plt.show()
 
-                print(subject)
-                print(body)
+def cmd_dashboard(args):
+    """
+    Shows the live graphs of the coins in a grid, updated by a single background fetcher (check dashboard.py)
+    """
+
+    from dashboard import run_dashboard
+
+    names = args.coins.upper().split(',') if args.coins else list(settings.assets)
+
+    for name in [name for name in names if name not in settings.assets]:
+        print(f"{name}: Unknown coin (add it to settings.assets)")
+        names.remove(name)
+
+    if not names:
+        return
+
+    # The dashboard fetches (and stores) its own coins in the background; the notifier stays with collect and live
+    run_dashboard({name: settings.assets[name] for name in names}, ncols=args.columns)
+
+
+def cmd_candles(args):
+    """
+    Draws the stored OHLC bars (candle sticks) of the last 100 periods
+    """
 
-                last_mail_time = time.time()
+    import matplotlib.pyplot as plt
+    from candles import BUCKETS, draw_candles
 
-        # Wait a minute
-        time.sleep(60)
+    size = args.size
 
+    if size not in BUCKETS:
+        print(f"The size of the candles has to be one of: {', '.join(BUCKETS)}")
+        return
+
+    # The stored candles are drawn as they are, so it works offline
+    if args.fetch and not start():
+        return
+
+    with db.reader() as conn:
+        bars = db.candle_range(conn.cursor(), 'ETH', size, int(time.time()) - 100 * BUCKETS[size])
+
+    fig = plt.figure(figsize=(16, 8))
+    ax = plt.subplot(111)
+
+    # All the bars are drawn as a single collection (check candles.py)
+    draw_candles(ax, bars, BUCKETS[size])
+    ax.autoscale_view()
 
-def can_send_a_mail(last_mail_time):
+    set_datetime_axis(ax, '%m-%d' if size == '1d' else time_format)
+    ax.set_title(f"ETH ({size})")
+    plt.show()
+
+
+def chosen_intervals(letters):
+    """
+    Returns: the intervals of the letters, e.g. 'hd' -> ['hour', 'day']
     """
-    Check if the program can send a mail based on the minimum waiting time
+
+    mapping = {
+        'h': 'hour',
+        'd': 'day',
+        'w': 'week',
+        'm': 'month',
+        'y': 'year'
+    }
+
+    return [l for s, l in mapping.items() if s in letters.lower()]
+
+
+def cmd_viz(args):
+    """
+    Visualizes the historical prices based on interval.
+    """
+
+    import matplotlib.pyplot as plt
+    from charts import plot_interval
+
+    if not start():
+        return
+
+    show_intervals = chosen_intervals(args.intervals)
+
+    # Graph of the intervals
+    fig = plt.figure(figsize=(16, 8))
+
+    # Use the second param to select between intervals: ['hour', 'day', 'week', 'month', 'year']
+    plot_interval('ETH', show_intervals)
+    fig.suptitle('Trend over an hour, and a day')
+    plt.show()
+
+
+def cmd_export(args):
+    """
+    Renders the charts of all the coins into files without a display (check export.py)
+    """
+
+    from export import export_all
+
+    if not start():
+        return
+
+    export_all(settings.assets, chosen_intervals(args.intervals), settings.export_dir, settings.export_workers)
+
+
+def notify(engine, events):
+    """
+    Sends the mails of the rules triggered by the new prices (called by the db writer after every batch)
 
     Parameters:
-        - last_mail_time: seconds (float)
+        - engine: rules.RuleEngine
+        - events: the new prices (check db.insert_document)
     """
 
-    now = time.time()
+    from notify import send_mail
 
-    # If no mail has been sent so far or time difference is higher than the minimum
-    return not last_mail_time or (now - last_mail_time >= wait_time)
+    for alert in engine.evaluate(events):
+        print(alert.subject)
+        print(alert.body)
 
+        # Queued; the outbox sends it in the background (check notify.Outbox)
+        send_mail(alert.subject, alert.body)
 
-def animate(frame, cursor, line, ax, texts):
+
+def animate(frame, feed, buffer, line, ax, texts):
     """
     The function for updating the figure per frame during animation
 
     # Parameters:
         - frame: nth frame (int)
-        - cursor: cursor to db
+        - feed: the live.LiveFeed fetching the data in the background
+        - buffer: the live.RingBuffer holding the data of the graph
         - line: the matplotlib.Line2d to update
         - ax: the matplotlib.Axes to update
         - texts: the matplotlib.Text fields to update
     """
 
-    # Update the db
-    _ = fetch_and_update()
-
-    # Get the price data of the last hour
-    latest = cursor.execute('SELECT price from eth_data order by timestamp desc limit 1;').fetchone()[0]
-    timestamps, prices = extract_last_hour_data(cursor)
+    # Add the newly fetched points (if any)
+    if not feed.drain(buffer):
+        return line
 
-    times = set_datetime_axis(ax, timestamps)
-    line.set_data(times, prices)
-    update_axis(times, prices, ax, texts)
+    # The figure itself is drawn by the animation afterwards
+    with metrics.timed('render'):
+        timestamps, prices = buffer.view()
+        line.set_data(timestamps, prices)
+        update_axis(timestamps, prices, ax, texts)
 
     return line
 
 
-def update_axis(times, prices, ax, texts):
+def update_axis(timestamps, prices, ax, texts):
     """
     Set the axes limit and ticks, and update the text fields
 
     Parameter:
-        - times: x-ticks [check set_datetime_axis for more details]
+        - timestamps: x-data (unix timestamps) [check set_datetime_axis for more details]
         - prices: y-data 
         - ax: a matplotlib.Axes object 
         - texts: a list of matplotlib.Text
     """
+    import numpy as np
+
     latest_price_text, current_time_text, percent_change_text = texts
 
-    ax.set_ylim(min(prices) - 10, max(prices) + 10)
-    ax.set_xticks(times[::5] + [times[-1]])
-    ax.set_xlim(times[0], times[-1])
+    low, high = prices.min(), prices.max()
+
+    ax.set_ylim(low - 10, high + 10)
+    ax.set_xticks(np.append(timestamps[::5], timestamps[-1]))
+    ax.set_xlim(timestamps[0], timestamps[-1])
 
     # Update  latest price text
     latest_price_text.set(
-        x = times[0],
-        y = max(prices) + 10.5,
+        x = timestamps[0],
+        y = high + 10.5,
         text = f"Latest Price: {prices[-1]:.2f}",
         fontsize = 'xx-large'
     )
 
     # Update current time text
     current_time_text.set(
-        x = times[-1],
-        y = max(prices) + 10.5,
-        text = f"Current Time: {times[-1]}",
+        x = timestamps[-1],
+        y = high + 10.5,
+        text = f"Current Time: {datetime.fromtimestamp(timestamps[-1]).strftime(time_format)}",
         fontsize = 'xx-large'
     )
 
     # This gets the width and height of current_time_text in terms of data coordinates
-    # FYI: In data coords, the x-axis is a real number line stretching from 0 to 59
+    # FYI: In data coords, the x-axis is the unix time
     bb = ((m := current_time_text).get_window_extent(m.get_figure().canvas.get_renderer()).transformed(ax.transData.inverted()))
 
     # Adjust the text box's x coord by shifting it to the left by its width 
@@ -240,7 +510,7 @@ def update_axis(times, prices, ax, texts):
 
     lp_bb = ((m := latest_price_text).get_window_extent(m.get_figure().canvas.get_renderer()).transformed(ax.transData.inverted()))
     percent_change_text.set(
-        x = lp_bb.x1+0.1,
+        x = lp_bb.x1 + 6,
         y = lp_bb.y1,
         text = f"{'-' if percent_change < 0 else '+'}{abs(percent_change):.2f}%",
         color = 'r' if percent_change < 0 else 'g',
@@ -248,85 +518,40 @@ def update_axis(times, prices, ax, texts):
     )
 
 
-    # TODO: Draw candle sticks (OHLC charts)
-    #select_color = lambda diff: 'r' if diff < 0 else 'g'
-    """
-    ax.add_patch(Rectangle(
-        xy=(0, prices[0]),
-        width=1,
-        height=abs(m := (prices[1]-prices[0])),
-        fc=select_color(m),
-        transform=ax.transData
-    ))
-    """
+
+# The format of the time on the x-axis
+time_format = "%H:%M"
 
 
-def set_datetime_axis(ax, timestamps):
+def set_datetime_axis(ax, fmt=time_format):
     """
-    Formats the xaxis, and returns the ticks
+    Formats the xaxis; the x-data is the unix time, and the ticks are shown as local time
 
     Parameters: 
         - ax: a single matplotlib.Axes object
-        - timestamps: ...
-
-    Returns:
-        a list of strings of time data in the following format that can be uses as x-ticks
+        - fmt: format of the ticks
     """
 
-    time_format = "%H:%M"
-    times = []
-    for timestamp in timestamps:
-        time = datetime.fromtimestamp(timestamp)
-        times.append(time.strftime(time_format))
+    from matplotlib.ticker import FuncFormatter
 
-    ax.xaxis.set_minor_formatter(mdates.DateFormatter(time_format))
+    ax.xaxis.set_major_formatter(FuncFormatter(lambda x, pos: datetime.fromtimestamp(x).strftime(fmt)))
     #_=plt.xticks(rotation=45) 
 
-    return times
 
-def strip_seconds(time):
+def extract_last_hour_data(cursor, window=60 * 60):
     """
-    Format a datetime object by stripping the seconds and return another datetime object
-
-    Parameters: 
-        - time: datetime object
-    
-    Returns:
-        - a datetime object
-    """
-
-    return datetime.strptime(time.strftime(r'%y-%m-%d %H:%M'), r'%y-%m-%d %H:%M')
-
-
-def extract_last_hour_data(cursor):
-    """
-    Get the price data of the last our
+    Get the price data of the last hour (or any other window), one price per minute
 
     Parameters:
         - cursor: cursor to the db
+        - window: length of the window in seconds
     
-    Returns: (timestamps, prices) # the prices correspond to the timestamps parallely
+    Returns: (timestamps, prices) # numpy arrays; the prices correspond to the timestamps parallely
     # the timestamps are in ascending order
     """
 
-    # Gets all the data from the last hour
-    last_hour_data = cursor.execute(r"""select timestamp, datetime(timestamp, 'unixepoch', 'localtime'), price 
-                                        from eth_data where timestamp >= (cast(strftime('%s', 'now') as int) - 60*60) 
-                                        order by timestamp desc;""").fetchall()
-
-    # Indexed by time
-    data = {}
-
-    for timestamp, localtime, price in last_hour_data:
-        time = strip_seconds(datetime.fromtimestamp(timestamp)).timestamp()
-
-        if data.get(time, False):
-            continue
-
-        data[time] = price 
-
-    # Divides the dictionary into parallel lists with timestamps sorted by ascending order
-    return zip(*[(time, data[time]) for time in sorted(data.keys(), reverse=False)])
+    # The minutes are bucketed by the database (check db.minute_prices)
+    return db.minute_prices(cursor, 'ETH', window)
 
 
 def fetch_and_update():
@@ -346,11 +571,12 @@ def fetch_and_update():
                      
     """
     # The uuid in the url is the base_id of ETH
-    r = requests.get('https://www.coinbase.com/api/v2/assets/prices/d85dce9b-5b73-5c3c-8978-522ce1d1c1b4?base=CAD')
+    # The response is shared with the other modes and processes for a few seconds (check cache.py)
+    status, body = cache.get(settings.prices_url.format(base_id=settings.assets['ETH'], currency=settings.currency))
 
     try:
-        if r.status_code == 200:
-            data = r.json() 
+        if status == 200:
+            data = parse.loads(body)
             data = data['data']
 
             # Update db
@@ -360,7 +586,7 @@ def fetch_and_update():
             return data, intervals
         
         else:
-            print(r.json()['errors'][0]['message'])
+            print(parse.loads(body)['errors'][0]['message'])
     
     except:
         print("Couldn't fetch the data, check you internet connection.")
@@ -368,74 +594,5 @@ def fetch_and_update():
     return
 
 
-def do_quit():
-    """
-    A function to run a concurrent loop to listen for "quitting" signal.
-    """
-
-    print("Enter Q<enter> to quit. You might have to wait a maximum of 1 minute before the program stops.")
-    
-    while (m := input().strip()) != 'Q':
-        if m:
-            print("\nIf you want to quit the program press Q<enter>!\n")
-        continue
-
-    print("Wait till the sleeping period ends. \nIt will end at the next update time (CHECK ABOVE).")
-
-
-def plot_interval(intervals: dict, which_intervals: [str]) -> None:
-    """
-    Plots the historical price data based on given intervals.
-    
-    Parameters:
-        - intervals: the historical price data delimited by all the intervals. 
-        - which_intervals: the intervals on which you wanna see the data.
-            Note: valid intervals are:
-                ['hour', 'day', 'week', 'month', 'year']
-    """
-
-    # 1 -> 1 (row, col)
-    # 2 -> 2 (rows) col 1
-    # 3 -> 2 rows, 1: col 1, col 2
-
-    # Types of intervals -> (rows, cols)
-    # Index (starting from 1) is a row wise allocation
-    # of indices: 1 <= index <= nrows * ncols
-    def generate_subplot_pos(n):
-        nrows = ceil(n / 2)
-        ncols = 2 
-
-        positions = [(nrows, ncols, idx) for idx in range(1, n + 1 if n % 2 == 0 else n)]
-
-        if n % 2 == 1:
-            # This will generate the subplot that spans
-            # the entire width for odd number of subplots
-            positions.append((nrows, 1, nrows))
-        
-        return positions
-    
-    mp = {
-        1: [(1,1,1)],
-        2: [(2,1,1), (2,1,2)],
-        3: [(2,2,1), (2,2,2), (2,1,2)],
-        4: [(2,2,1), (2,2,2), (2,2,3), (2,2,4)],
-        5: [(3,2,1), (3,2,2), (3,2,3), (3,2,4), (3,1,3)]
-    }
-    
-    #positions = generate_subplot_pos(len(which_intervals))
-    positions = mp[len(which_intervals)]
-
-    for idx, interval in enumerate(which_intervals):
-        #interval = which_intervals[0]
-        time_price_tuples = np.array(intervals[interval]['prices'], dtype=np.float32)
-
-        prices = np.flip(time_price_tuples[:, 0])
-        timestamps = np.flip(time_price_tuples[:, 1])
-
-        ax = plt.subplot(*positions[idx])
-        ax.plot(prices)
-        print(datetime.fromtimestamp(float(timestamps[0])), datetime.fromtimestamp(float(timestamps[1])))
-        ax.set_title(interval.capitalize())
-
-
-main()
\ No newline at end of file
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,316 @@
+# Timings and counters of the hot paths (fetch, parse, db write, notify, render), for --collect and --live.
+#
+#   with metrics.timed('fetch'):
+#       ...
+#   metrics.inc('fetch_requests', result='ok')
+#
+# The stages are kept as histograms (fixed buckets, like prometheus), along with their latest samples for the
+# percentiles. Everything can be read from a local http endpoint (check serve()):
+#
+#   curl localhost:9108/metrics          # prometheus text format
+#   curl localhost:9108/metrics.json     # the same as json (check snapshot())
+#
+# or from a json file that is rewritten periodically (check JsonDump).
+
+import json
+import time
+import atexit
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from threading import Thread, Lock, Event
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from files import atomic_write
+
+# The upper bounds of the buckets of the histograms (seconds)
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, float('inf'))
+
+# The prefix of the names in the prometheus format
+PREFIX = 'crypto'
+
+_lock = Lock()
+_histograms = {}
+_counters = {}
+_gauges = {}
+_started = time.time()
+
+
+class Histogram:
+    """
+    The durations of a stage: the counts per bucket, their sum, and the latest samples (for the percentiles)
+    """
+
+    # Number of the latest samples kept
+    history = 1000
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.latest = deque(maxlen=self.history)
+
+    def observe(self, seconds):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+        self.latest.append(seconds)
+
+    def summary(self):
+        """
+        Returns: count, sum (seconds), and mean, p50, p90, p99 (of the latest samples) and max in milliseconds
+        """
+
+        latest = sorted(self.latest)
+
+        def percentile(p):
+            return latest[min(len(latest) - 1, int(p / 100 * len(latest)))] * 1000 if latest else None
+
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'mean_ms': self.sum / self.count * 1000 if self.count else None,
+            'p50_ms': percentile(50),
+            'p90_ms': percentile(90),
+            'p99_ms': percentile(99),
+            'max_ms': self.max * 1000,
+        }
+
+
+def observe(stage, seconds):
+    """
+    Records a duration of a stage
+
+    Parameters:
+        - stage: name of the stage (e.g. 'fetch')
+        - seconds: the duration
+    """
+
+    with _lock:
+        if stage not in _histograms:
+            _histograms[stage] = Histogram()
+        _histograms[stage].observe(seconds)
+
+
+@contextmanager
+def timed(stage):
+    """
+    Records the duration of the block as a duration of the stage (also when it raises)
+    """
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start)
+
+
+def inc(name, amount=1, **labels):
+    """
+    Increments a counter
+
+    Parameters:
+        - name: name of the counter (e.g. 'fetch_requests')
+        - amount: the increment
+        - labels: the labels of the counter (e.g. result='ok')
+    """
+
+    key = (name, tuple(sorted(labels.items())))
+
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def gauge(name, value):
+    """
+    Sets a value that goes up and down (e.g. the length of a queue)
+    """
+
+    with _lock:
+        _gauges[name] = value
+
+
+def counter(name, **labels):
+    """
+    Returns: the value of a counter; the sum over the rest of the labels if only some of them are given
+    """
+
+    with _lock:
+        return sum(value for (key, key_labels), value in _counters.items()
+                   if key == name and labels.items() <= dict(key_labels).items())
+
+
+def reset():
+    """
+    Forgets all the values
+    """
+
+    global _started
+
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+        _gauges.clear()
+        _started = time.time()
+
+
+def snapshot():
+    """
+    Returns: all the values as a dictionary:
+             {'uptime', 'stages': stage -> summary (check Histogram.summary), 'counters': name -> value or
+              label=value,... -> value, 'gauges': name -> value, 'fetch_error_rate'}
+    """
+
+    with _lock:
+        stages = {stage: histogram.summary() for stage, histogram in sorted(_histograms.items())}
+        counters = {}
+
+        for (name, labels), value in sorted(_counters.items()):
+            if labels:
+                counters.setdefault(name, {})[','.join(f"{k}={v}" for k, v in labels)] = value
+            else:
+                counters[name] = value
+
+        gauges = dict(sorted(_gauges.items()))
+        uptime = time.time() - _started
+
+    requests = counter('fetch_requests')
+
+    return {
+        'uptime': uptime,
+        'stages': stages,
+        'counters': counters,
+        'gauges': gauges,
+        'fetch_error_rate': (requests - counter('fetch_requests', result='ok')) / requests if requests else None,
+    }
+
+
+def render():
+    """
+    Returns: all the values in the prometheus text format
+    """
+
+    def label_text(labels):
+        return ','.join(f'{k}="{v}"' for k, v in labels)
+
+    lines = []
+
+    with _lock:
+        lines.append(f"# HELP {PREFIX}_stage_seconds Duration of the stages of the collector")
+        lines.append(f"# TYPE {PREFIX}_stage_seconds histogram")
+
+        for stage, histogram in sorted(_histograms.items()):
+            cumulative = 0
+            for bound, count in zip(BUCKETS, histogram.counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{PREFIX}_stage_seconds_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+            lines.append(f'{PREFIX}_stage_seconds_sum{{stage="{stage}"}} {histogram.sum}')
+            lines.append(f'{PREFIX}_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+
+        for name in sorted({name for name, _ in _counters}):
+            lines.append(f"# TYPE {PREFIX}_{name}_total counter")
+            for (key, labels), value in sorted(_counters.items()):
+                if key == name:
+                    lines.append(f"{PREFIX}_{name}_total{{{label_text(labels)}}} {value}" if labels else f"{PREFIX}_{name}_total {value}")
+
+        for name, value in sorted(_gauges.items()):
+            lines.append(f"# TYPE {PREFIX}_{name} gauge")
+            lines.append(f"{PREFIX}_{name} {value}")
+
+        lines.append(f"# TYPE {PREFIX}_uptime_seconds gauge")
+        lines.append(f"{PREFIX}_uptime_seconds {time.time() - _started}")
+
+    return '\n'.join(lines) + '\n'
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == '/metrics':
+            body, content_type = render().encode(), 'text/plain; version=0.0.4'
+        elif self.path == '/metrics.json':
+            body, content_type = json.dumps(snapshot(), indent=2).encode(), 'application/json'
+        else:
+            self.send_error(404)
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Every scrape would be printed otherwise
+        pass
+
+
+def serve(port, host='127.0.0.1'):
+    """
+    Serves the values over http (in a background thread): /metrics (prometheus) and /metrics.json
+
+    Parameters:
+        - port: the port (0: any free port)
+        - host: the address to listen on (only local by default)
+
+    Returns: the server (server.server_address has the port)
+    """
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    Thread(target=server.serve_forever, daemon=True, name='metrics-server').start()
+
+    return server
+
+
+class JsonDump(Thread):
+    """
+    Writes snapshot() to a json file every period seconds (and once more at exit)
+    """
+
+    def __init__(self, path, period=60):
+        super().__init__(daemon=True, name='metrics-dump')
+
+        self.path = path
+        self.period = period
+        self.stopped = Event()
+
+    def dump(self):
+        atomic_write(self.path, json.dumps({**snapshot(), 'time': time.time()}, indent=2))
+
+    def run(self):
+        while not self.stopped.wait(self.period):
+            try:
+                self.dump()
+            except OSError as e:
+                print(f"Couldn't write the metrics: {e}")
+
+    def close(self):
+        self.stopped.set()
+        self.dump()
+
+
+def start(port=None, dump_file=None, period=60, host='127.0.0.1'):
+    """
+    Starts the endpoint and/or the periodic dump (check settings.metrics_port and settings.metrics_file)
+
+    Parameters:
+        - port: the port of the http endpoint (None: no endpoint)
+        - dump_file: the json file (None: no dump)
+        - period: seconds between the dumps
+        - host: the address of the http endpoint
+    """
+
+    if port is not None:
+        try:
+            server = serve(port, host)
+            print(f"Metrics: http://{host}:{server.server_address[1]}/metrics")
+        except OSError as e:
+            print(f"Couldn't serve the metrics on port {port}: {e}")
+
+    if dump_file:
+        dump = JsonDump(dump_file, period)
+        dump.start()
+        atexit.register(dump.close)
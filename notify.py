@@ -1,61 +1,487 @@
 # Adapted from: https://developers.google.com/gmail/api/quickstart/python, [Authentication]
 #               https://developers.google.com/gmail/api/guides/sending [Sending a mail]
+#
+# The mails are sent by a backend (settings.mail_backend):
+#   - 'gmail': google's api (oauth 2.0, check the links above)
+#   - 'smtp': any smtp server; e.g. a local stand-in for testing: python -m aiosmtpd -n -l localhost:8025
+#   - 'file': appends the mails to a jsonl file, without any network
 
 import json
 import pickle
 import os.path
-from googleapiclient.discovery import build
-from google_auth_oauthlib.flow import InstalledAppFlow
+import atexit
+import smtplib
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from queue import Queue, Empty
+from threading import Thread, Event, Lock
 from email.mime.text import MIMEText
 import base64
-from google.auth.transport.requests import Request
+
+import settings
+import metrics
+import db
 
 # IMPORTANT: if you modify the scopes delete the file token.pickle and re-authenticate
-# The accesses that you want; checkout: https://developers.google.com/identity/protocols/oauth2/scopes 
+# The accesses that you want; checkout: https://developers.google.com/identity/protocols/oauth2/scopes
 # for more information
 
 SCOPES = ['https://mail.google.com/']
 
+# Refresh the access token if it expires within this many seconds
+refresh_margin = 5 * 60
+
+# The mails waiting to be sent (check get_outbox())
+_outbox = None
+_outbox_lock = Lock()
+
+
 def send_mail(subject, body):
     """
-    Authenticates and sends the mail
+    Queues the mail; it's sent in the background by the outbox (check Outbox)
 
-    Parameters: 
+    Parameters:
         - subject: ... <str>
         - body: ... <str>
 
     Returns: None
     """
-    creds = None
-    # The file token.pickle stores the user's access and refresh tokens, and is
-    # created automatically when the authorization flow completes for the first
-    # time.
-    
-    if os.path.exists('token.pickle'):
-        with open('token.pickle', 'rb') as token:
-            creds = pickle.load(token)
-            
-    # If there are no (valid) credentials available, let the user log in.
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
+
+    get_outbox().put(subject, body)
+
+
+def get_outbox():
+    """
+    Returns: the Outbox shared by the program (it's started on the first call)
+    """
+    global _outbox
+
+    with _outbox_lock:
+        if not _outbox:
+            _outbox = Outbox(make_backend())
+            _outbox.start()
+
+            # Send whatever is still queued before the program exits
+            atexit.register(close)
+
+    return _outbox
+
+
+def close():
+    """
+    Stops the db writer, then the outbox: the last writes can still trigger alerts (check rules.py), which would be
+    lost if the outbox stopped first (the atexit handlers run in reverse order, so this is a single one)
+    """
+
+    db.close()
+
+    if _outbox:
+        _outbox.close()
+
+
+def make_backend(name=None):
+    """
+    Creates the backend sending the mails
+
+    Parameters:
+        - name: 'gmail', 'smtp' or 'file' (default: settings.mail_backend)
+
+    Returns: a Backend
+    """
+
+    name = name or settings.mail_backend
+
+    if name == 'gmail':
+        return GmailBackend()
+    elif name == 'smtp':
+        return SmtpBackend(settings.smtp_host, settings.smtp_port, settings.smtp_user, settings.smtp_password, settings.smtp_starttls)
+    elif name == 'file':
+        return FileBackend(settings.mail_file)
+
+    raise ValueError(f"Unknown mail backend: {name}")
+
+
+class Backend:
+    """
+    Sends the mails; the subclasses implement _send(mails).
+
+    Every call of send() is timed, check metrics().
+    """
+
+    name = 'backend'
+
+    # Number of the latest batches kept for the latency percentiles
+    history = 1000
+
+    def __init__(self, individuals_file='individuals.json'):
+        self.individuals_file = individuals_file
+        self.individuals = None
+
+        self.sent = 0
+        self.failed = 0
+        self.batches = 0
+        # Seconds per mail of the latest batches
+        self.latencies = deque(maxlen=self.history)
+
+    def get_individuals(self):
+        """
+        Returns: the addresses of individuals.json (read once): {'from': ..., 'to': ...}
+        """
+
+        if self.individuals is None:
+            with open(self.individuals_file) as fp:
+                self.individuals = json.load(fp)
+
+        return self.individuals
+
+    def send(self, mails):
+        """
+        Sends the mails
+
+        Parameters:
+            - mails: a list of (subject, body)
+
+        Returns: the mails that couldn't be sent, and the last error (None if all of them were sent)
+        """
+
+        start = time.perf_counter()
+        try:
+            failed, error = self._send(mails)
+        except Exception as e:
+            # e.g. the authentication failed
+            failed, error = mails, e
+        elapsed = time.perf_counter() - start
+
+        self.batches += 1
+        self.sent += len(mails) - len(failed)
+        self.failed += len(failed)
+        self.latencies.append(elapsed / len(mails))
+
+        metrics.observe('mail_send', elapsed)
+        metrics.inc('mails', len(mails) - len(failed), result='sent')
+        metrics.inc('mails', len(failed), result='failed')
+
+        return failed, error
+
+    def _send(self, mails):
+        raise NotImplementedError
+
+    def metrics(self):
+        """
+        Returns: a dictionary with the keys: backend, sent, failed, batches, and latency_ms; the send latency
+        per mail of the latest batches: mean, p50, p99, max
+        """
+
+        latencies = sorted(self.latencies)
+
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))] * 1000 if latencies else None
+
+        return {
+            'backend': self.name,
+            'sent': self.sent,
+            'failed': self.failed,
+            'batches': self.batches,
+            'latency_ms': {
+                'mean': sum(latencies) / len(latencies) * 1000 if latencies else None,
+                'p50': percentile(50),
+                'p99': percentile(99),
+                'max': latencies[-1] * 1000 if latencies else None,
+            },
+        }
+
+    def close(self):
+        pass
+
+
+class GmailBackend(Backend):
+    """
+    Sends the mails with google's api. Authenticates once and keeps the credentials and the gmail service
+    around, so sending a mail doesn't re-read token.pickle or rebuild the service (building it fetches the
+    discovery document).
+    """
+
+    name = 'gmail'
+
+    def __init__(self, token_file='token.pickle', credentials_file='credentials.json', individuals_file='individuals.json'):
+        super().__init__(individuals_file)
+
+        self.token_file = token_file
+        self.credentials_file = credentials_file
+
+        self.creds = None
+        self.service = None
+
+    def credentials(self):
+        """
+        Returns: valid credentials; they are only refreshed when they are about to expire
+        """
+        # The google packages are only needed by this backend
+        from google_auth_oauthlib.flow import InstalledAppFlow
+        from google.auth.transport.requests import Request
+
+        if self.creds is None:
+            # The file token.pickle stores the user's access and refresh tokens, and is
+            # created automatically when the authorization flow completes for the first
+            # time.
+            if os.path.exists(self.token_file):
+                with open(self.token_file, 'rb') as token:
+                    self.creds = pickle.load(token)
+
+        creds = self.creds
+
+        if creds and creds.valid and not self._expiring(creds):
+            return creds
+
+        # If there are no (valid) credentials available, let the user log in.
+        if creds and creds.refresh_token:
             creds.refresh(Request())
         else:
             flow = InstalledAppFlow.from_client_secrets_file(
-                'credentials.json', SCOPES)
+                self.credentials_file, SCOPES)
             creds = flow.run_local_server(port=0)
+            # The service holds the old credentials
+            self.service = None
 
         # Save the credentials for the next run
-        with open('token.pickle', 'wb') as token:
+        with open(self.token_file, 'wb') as token:
             pickle.dump(creds, token)
 
-    service = build('gmail', 'v1', credentials=creds)
+        self.creds = creds
+
+        return creds
+
+    @staticmethod
+    def _expiring(creds):
+        # expiry is a naive utc datetime (None if unknown)
+        if creds.expiry is None:
+            return False
+
+        expiry = creds.expiry if creds.expiry.tzinfo else creds.expiry.replace(tzinfo=timezone.utc)
+
+        return expiry - datetime.now(timezone.utc) < timedelta(seconds=refresh_margin)
+
+    def get_service(self):
+        """
+        Returns: the gmail service (built once)
+        """
+        from googleapiclient.discovery import build
+
+        creds = self.credentials()
+
+        if self.service is None:
+            self.service = build('gmail', 'v1', credentials=creds)
 
-    # Send an email 
-    with open('individuals.json') as fp:
-        individuals = json.load(fp)
+        return self.service
 
-    message = create_message(individuals['from'], individuals['to'], subject, body)
-    send_message(service, 'me', message)
+    def _send(self, mails):
+        """
+        Sends the mails in a single batch request
+        """
+
+        service = self.get_service()
+        individuals = self.get_individuals()
+
+        if len(mails) == 1:
+            try:
+                send_message(service, 'me', create_message(individuals['from'], individuals['to'], *mails[0]))
+                return [], None
+            except Exception as e:
+                return mails, e
+
+        failed = []
+        errors = []
+
+        def callback(request_id, response, exception):
+            if exception is not None:
+                failed.append(mails[int(request_id)])
+                errors.append(exception)
+
+        batch = service.new_batch_http_request(callback=callback)
+        for idx, (subject, body) in enumerate(mails):
+            message = create_message(individuals['from'], individuals['to'], subject, body)
+            batch.add(service.users().messages().send(userId='me', body=message), request_id=str(idx))
+
+        batch.execute()
+
+        return failed, errors[-1] if errors else None
+
+
+class SmtpBackend(Backend):
+    """
+    Sends the mails to an smtp server over a single connection, which is kept open between the batches
+    (and reopened if the server closed it).
+    """
+
+    name = 'smtp'
+
+    def __init__(self, host='localhost', port=25, user=None, password=None, starttls=False, timeout=30, individuals_file='individuals.json'):
+        super().__init__(individuals_file)
+
+        self.host = host
+        self.port = port
+        self.user = user
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+
+        self.smtp = None
+
+    def connect(self):
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+
+        if self.starttls:
+            smtp.starttls()
+        if self.user:
+            smtp.login(self.user, self.password)
+
+        return smtp
+
+    def _send(self, mails):
+        individuals = self.get_individuals()
+
+        if self.smtp is None:
+            self.smtp = self.connect()
+
+        failed = []
+        error = None
+
+        for idx, (subject, body) in enumerate(mails):
+            message = mime_message(individuals['from'], individuals['to'], subject, body)
+
+            try:
+                self.smtp.send_message(message)
+            except smtplib.SMTPServerDisconnected as e:
+                # Reconnect on the next try
+                self.smtp = None
+                return failed + mails[idx:], e
+            except smtplib.SMTPException as e:
+                # Refused by the server; the connection is still fine
+                failed.append((subject, body))
+                error = e
+            except OSError as e:
+                # The connection itself broke (a timeout, reset by the server, ...); reconnect on the next try
+                self.close()
+                return failed + mails[idx:], e
+
+        return failed, error
+
+    def close(self):
+        if self.smtp is not None:
+            try:
+                self.smtp.quit()
+            except OSError:
+                # Includes smtplib.SMTPException
+                pass
+            self.smtp = None
+
+
+class FileBackend(Backend):
+    """
+    Appends the mails to a jsonl file (one mail per line: time, subject, body); useful to test the alerts
+    without sending anything.
+    """
+
+    name = 'file'
+
+    def __init__(self, path='mails.jsonl'):
+        super().__init__()
+
+        self.path = path
+
+    def _send(self, mails):
+        now = time.time()
+
+        with open(self.path, 'a') as fp:
+            fp.writelines(json.dumps({'time': now, 'subject': subject, 'body': body}) + '\n' for subject, body in mails)
+
+        return [], None
+
+
+class Outbox(Thread):
+    """
+    A thread sending the queued mails, so whoever triggers a mail (e.g. the db writer) never waits for the network.
+
+    Whatever is queued at the same time is sent as a single batch; the mails that fail are retried with
+    an exponential backoff, and dropped after max_retries.
+    """
+
+    # Maximum number of mails sent in a single batch
+    max_batch = 20
+    max_retries = 5
+    # Seconds waited before the first retry (doubled on every retry)
+    backoff = 2
+    max_backoff = 5 * 60
+
+    def __init__(self, backend):
+        """
+        Parameters:
+            - backend: a Backend
+        """
+        super().__init__(daemon=True, name='mail-outbox')
+
+        self.backend = backend
+        self.queue = Queue()
+        self.stopping = Event()
+
+    def put(self, subject, body):
+        self.queue.put((subject, body))
+
+    def flush(self):
+        """
+        Blocks until all the queued mails are sent (or dropped)
+        """
+
+        self.queue.join()
+
+    def close(self, timeout=30):
+        """
+        Sends the queued mails (without waiting for the backoffs), then stops the outbox
+        """
+
+        if self.is_alive():
+            self.stopping.set()
+            self.queue.put(None)
+            self.join(timeout)
+
+    def run(self):
+        running = True
+        while running:
+            mails = [self.queue.get()]
+
+            # Group whatever else is pending into the same batch
+            while len(mails) < self.max_batch:
+                try:
+                    mails.append(self.queue.get_nowait())
+                except Empty:
+                    break
+
+            if None in mails:
+                running = False
+                mails = [mail for mail in mails if mail is not None]
+
+            pending = mails
+            for attempt in range(self.max_retries + 1):
+                if not pending:
+                    break
+
+                if attempt:
+                    # Returns right away while closing, so the exit isn't held up
+                    self.stopping.wait(min(self.backoff * 2 ** (attempt - 1), self.max_backoff))
+
+                pending, error = self.backend.send(pending)
+
+                if pending:
+                    print(f"Couldn't send {len(pending)} mail(s) (attempt {attempt + 1}): {error}")
+
+            if pending:
+                print(f"Dropped {len(pending)} mail(s)")
+
+            for _ in range(len(mails) + (not running)):
+                self.queue.task_done()
+
+        self.backend.close()
 
 
 def send_message(service, user_id, message):
@@ -77,6 +503,20 @@ def send_message(service, user_id, message):
     return message
 
 
+def mime_message(sender, to, subject, message_text):
+    """Create the MIME message of an email (check create_message()).
+
+    Returns: email.mime.text.MIMEText
+    """
+
+    message = MIMEText(message_text)
+    message['to'] = to
+    message['from'] = sender
+    message['subject'] = subject
+
+    return message
+
+
 def create_message(sender, to, subject, message_text):
     """Create a message for an email.
 
@@ -90,10 +530,6 @@ def create_message(sender, to, subject, message_text):
         An object containing a base64url encoded email object. <string>
     """
 
-    message = MIMEText(message_text)
-    message['to'] = to
-    message['from'] = sender
-    message['subject'] = subject
+    message = mime_message(sender, to, subject, message_text)
 
     return {'raw': base64.urlsafe_b64encode(message.as_string().encode()).decode()}
-
@@ -0,0 +1,112 @@
+# Decoding of the price document of a coin (the second url of schema.py) into typed arrays.
+# The body is decoded with orjson when it's installed (pip install orjson), otherwise with the json module;
+# both give the same dictionary. The [price, timestamp] pairs of the intervals are then turned into int64 numpy
+# arrays (timestamps, and the prices as price * 10^scale) in bulk, instead of converting every price in python.
+
+import json
+from datetime import datetime
+
+import numpy as np
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+import settings
+import metrics
+
+# The intervals of the document, in the order of their ids in the database
+INTERVALS = ['hour', 'day', 'week', 'month', 'year']
+# The order the intervals are read in; when the intervals repeat a timestamp, the first one is stored (check db.unique_ticks)
+READ_ORDER = ['year', 'month', 'week', 'hour', 'day']
+
+
+def loads(raw):
+    """
+    Returns: the decoded json body <dict>; raises ValueError if it isn't valid json
+
+    Parameters:
+        - raw: the body of a response <bytes or str>
+    """
+
+    if orjson:
+        return orjson.loads(raw)
+
+    return json.loads(raw)
+
+
+def points(pairs, high_water=0, scale=2):
+    """
+    Converts the [price, timestamp] pairs of an interval, keeping the ones newer than the high water mark
+
+    Parameters:
+        - pairs: [[price, timestamp]] as sent by the api (check schema.py)
+        - high_water: the newest timestamp stored <int>
+        - scale: number of decimals kept of the prices
+
+    Returns: (timestamps, prices) # int64 numpy arrays; the prices are scaled: price * 10^scale
+    """
+
+    if not pairs:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    prices, timestamps = zip(*pairs)
+    timestamps = np.array(timestamps, dtype=np.int64)
+    fresh = np.flatnonzero(timestamps > high_water)
+
+    # Only the new prices are converted from strings
+    if len(fresh) < len(prices):
+        prices = [prices[idx] for idx in fresh]
+
+    return timestamps[fresh], np.rint(np.array(prices, dtype=np.float64) * 10 ** scale).astype(np.int64)
+
+
+def document(data, scale, high_water=None):
+    """
+    Converts an api response into integer arrays; this is the cpu bound part of the writing, so it can run in
+    another process (check shard.py)
+
+    Parameters:
+        - data: The dictionary holding the api response
+        - scale: number of decimals kept of the prices
+        - high_water: interval (index in INTERVALS) -> newest timestamp stored <dict>; only the newer points are converted
+
+    Returns: a dictionary with the keys: base, base_id, currency, scale, timestamp, price (the latest price, scaled),
+             percent_change (a list, in the order of INTERVALS), and intervals: interval -> (timestamps, prices, percent change)
+    """
+
+    high_water = high_water or {}
+    prices = data['prices']
+    latest_info = prices['latest_price']
+
+    parsed = {
+        'base': data['base'],
+        'base_id': data.get('base_id'),
+        'currency': data.get('currency', settings.currency),
+        'scale': scale,
+        'timestamp': int(datetime.fromisoformat(latest_info['timestamp']).timestamp()),
+        'price': round(float(prices['latest']) * 10 ** scale),
+        'percent_change': [round(float(latest_info['percent_change'][x]), 4) for x in INTERVALS],
+        'intervals': {},
+    }
+
+    for key in READ_ORDER:
+        container = prices[key]
+        interval = INTERVALS.index(key)
+        timestamps, values = points(container['prices'], high_water.get(interval, 0), scale)
+        # The points of the interval that were stored before
+        metrics.inc('points_skipped', len(container['prices']) - len(timestamps), reason='high_water')
+
+        if len(timestamps):
+            parsed['intervals'][interval] = (timestamps, values, round(float(container['percent_change']), 4))
+
+    return parsed
+
+
+def scale_of(data):
+    """
+    Returns: the number of decimals of the prices of an api response (check schema.py)
+    """
+
+    return int(data.get('unit_price_scale', data['prices']['latest_price']['amount'].get('scale', 2)))
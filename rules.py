@@ -0,0 +1,257 @@
+# Notification rules.
+# The rules are compiled once into sorted tables per coin, and are evaluated on every batch written by the
+# db writer (check db.Writer.add_listener); a tick only looks at the rules it triggers:
+#   - the price thresholds (and the edges of the bands) crossed between the previous and the latest price are
+#     found with a binary search,
+#   - the percent change rules are sorted by their threshold, so the triggered ones are a prefix.
+
+import time
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+
+# A notification: the subject and the body of the mail
+Alert = namedtuple('Alert', ['base', 'rule', 'subject', 'body'])
+
+
+class ThresholdRule:
+    """
+    Fires when the price crosses value; direction is 'above' (crossing upwards) or 'below' (crossing downwards)
+    """
+
+    def __init__(self, base, value, direction='above', currency='CAD'):
+        self.base = base
+        self.value = value
+        self.direction = direction
+        self.currency = currency
+
+    def message(self, price, change=None):
+        subject = f"{self.base} is {self.direction} {self.value:.2f} {self.currency}"
+        body = f"Current Stats - \n\t Price: {price:.2f} {self.currency}"
+
+        return subject, body
+
+
+class BandRule:
+    """
+    Fires when the price leaves the band [low, high], and when it comes back into it
+    """
+
+    def __init__(self, base, low, high, currency='CAD'):
+        self.base = base
+        self.low = low
+        self.high = high
+        self.currency = currency
+
+    def message(self, price, change=None):
+        inside = self.low <= price <= self.high
+        subject = f"{self.base} {'is back in' if inside else 'left'} the band {self.low:.2f} - {self.high:.2f} {self.currency}"
+        body = f"Current Stats - \n\t Price: {price:.2f} {self.currency}"
+
+        return subject, body
+
+
+class PercentChangeRule:
+    """
+    Fires when the absolute percent change of the price over interval (e.g. 'hour') is at least percent
+    """
+
+    def __init__(self, base, percent, interval='hour', currency='CAD'):
+        self.base = base
+        self.percent = percent
+        self.interval = interval
+        self.currency = currency
+
+    def message(self, price, change=None):
+        subject = f"{self.base} is {'rising' if change > 0 else 'dropping'} fast"
+        body = f"Current Stats - \n\t Price: {price:.2f} {self.currency} \n\t Percent Change: {'+' if change > 0 else ''}{change * 100:.2f} (last {self.interval})"
+
+        return subject, body
+
+
+class IndicatorRule:
+    """
+    Fires when an indicator (e.g. 'rsi_14', check settings.indicators) crosses value; direction is 'above' or 'below'
+    """
+
+    def __init__(self, base, indicator, value, direction='above', currency='CAD'):
+        self.base = base
+        self.indicator = indicator
+        self.value = value
+        self.direction = direction
+        self.currency = currency
+
+    def message(self, price, change=None):
+        subject = f"{self.base}: {self.indicator} is {self.direction} {self.value}"
+        body = f"Current Stats - \n\t Price: {price:.2f} {self.currency} \n\t {self.indicator}: {change:.4f}"
+
+        return subject, body
+
+
+class RuleEngine:
+    """
+    Evaluates compiled rules against the new prices.
+    """
+
+    def __init__(self, rules, cooldown=60 * 30):
+        """
+        Parameters:
+            - rules: a list of ThresholdRule, BandRule and PercentChangeRule
+            - cooldown: minimum seconds between two alerts of the same rule
+        """
+
+        self.cooldown = cooldown
+        self.last_price = {}
+        self.last_alert = {}
+
+        # base -> (sorted levels, the rule of every level)
+        self.levels = {}
+        # (base, interval) -> (sorted percents, the rule of every percent)
+        self.percents = {}
+        # (base, indicator) -> the rules of the indicator, and its last value
+        self.indicator_rules = {}
+        self.last_indicator = {}
+
+        levels, percents = {}, {}
+        for rule in rules:
+            if isinstance(rule, ThresholdRule):
+                levels.setdefault(rule.base, []).append((rule.value, rule))
+            elif isinstance(rule, BandRule):
+                levels.setdefault(rule.base, []).extend([(rule.low, rule), (rule.high, rule)])
+            elif isinstance(rule, PercentChangeRule):
+                percents.setdefault((rule.base, rule.interval), []).append((rule.percent, rule))
+            elif isinstance(rule, IndicatorRule):
+                self.indicator_rules.setdefault((rule.base, rule.indicator), []).append(rule)
+
+        for base, entries in levels.items():
+            entries.sort(key=lambda entry: entry[0])
+            self.levels[base] = ([value for value, _ in entries], [rule for _, rule in entries])
+
+        for key, entries in percents.items():
+            entries.sort(key=lambda entry: entry[0])
+            self.percents[key] = ([percent for percent, _ in entries], [rule for _, rule in entries])
+
+    def evaluate(self, events):
+        """
+        Parameters:
+            - events: the new prices; a list of dictionaries with the keys:
+                base, timestamp, price, percent_change (interval -> change as a fraction),
+                and optionally indicators (name -> value)
+
+        Returns: a list of Alert
+        """
+
+        alerts = []
+        now = time.time()
+
+        for event in events:
+            base, price = event['base'], event['price']
+
+            # A band is triggered twice if the price jumped over it
+            fired = set()
+
+            for rule, change in self._triggered(base, price, event.get('percent_change', {}), event.get('indicators', {})):
+                if id(rule) in fired:
+                    continue
+                fired.add(id(rule))
+
+                # If no mail has been sent so far or time difference is higher than the minimum
+                if now - self.last_alert.get(id(rule), -self.cooldown) < self.cooldown:
+                    continue
+
+                self.last_alert[id(rule)] = now
+                alerts.append(Alert(base, rule, *rule.message(price, change)))
+
+            self.last_price[base] = price
+
+        return alerts
+
+    def _triggered(self, base, price, percent_change, indicators):
+        """
+        Yields: (rule, percent change) of the rules triggered by the new price of a coin
+        """
+
+        if base in self.levels:
+            values, rules = self.levels[base]
+            previous = self.last_price.get(base)
+
+            if previous is None:
+                # The first price: the thresholds which are already crossed
+                for idx in range(bisect_left(values, price)):
+                    if isinstance(rules[idx], ThresholdRule) and rules[idx].direction == 'above':
+                        yield rules[idx], None
+                for idx in range(bisect_right(values, price), len(values)):
+                    if isinstance(rules[idx], ThresholdRule) and rules[idx].direction == 'below':
+                        yield rules[idx], None
+
+            elif price != previous:
+                # The levels in between the previous and the new price were crossed
+                rising = price > previous
+                first = bisect_right(values, min(previous, price)) if rising else bisect_left(values, min(previous, price))
+                last = bisect_right(values, max(previous, price)) if rising else bisect_left(values, max(previous, price))
+
+                for idx in range(first, last):
+                    rule = rules[idx]
+                    if isinstance(rule, BandRule) or (rule.direction == 'above') == rising:
+                        yield rule, None
+
+        for interval, change in percent_change.items():
+            if (base, interval) not in self.percents:
+                continue
+
+            percents, rules = self.percents[(base, interval)]
+
+            # The rules with a threshold up to the change
+            for rule in rules[:bisect_right(percents, abs(change * 100))]:
+                yield rule, change
+
+        for name, value in indicators.items():
+            if value is None or (base, name) not in self.indicator_rules:
+                continue
+
+            previous = self.last_indicator.get((base, name))
+            self.last_indicator[(base, name)] = value
+
+            if previous is None:
+                continue
+
+            for rule in self.indicator_rules[(base, name)]:
+                if (previous <= rule.value < value) if rule.direction == 'above' else (previous >= rule.value > value):
+                    yield rule, value
+
+
+def rules_from_settings(notifier_settings, assets, currency='CAD'):
+    """
+    Creates the rules of the coins from the notifier settings (check main.py)
+
+    Parameters:
+        - notifier_settings: a dictionary with the keys:
+            upper_value_threshold, lower_value_threshold, hourly_percent_threshold (in percent),
+            optionally 'bands': [(low, high)], 'indicators': [(indicator, value, direction)],
+            and 'assets': name -> the same keys, overriding the defaults for a coin
+        - assets: the names of the coins
+        - currency: paper currency of the prices
+
+    Returns: a list of rules
+    """
+
+    rules = []
+
+    for base in assets:
+        options = {**notifier_settings, **notifier_settings.get('assets', {}).get(base, {})}
+
+        if options.get('upper_value_threshold') is not None:
+            rules.append(ThresholdRule(base, options['upper_value_threshold'], 'above', currency))
+
+        if options.get('lower_value_threshold') is not None:
+            rules.append(ThresholdRule(base, options['lower_value_threshold'], 'below', currency))
+
+        if options.get('hourly_percent_threshold') is not None:
+            rules.append(PercentChangeRule(base, options['hourly_percent_threshold'], 'hour', currency))
+
+        for low, high in options.get('bands', []):
+            rules.append(BandRule(base, low, high, currency))
+
+        for indicator, value, direction in options.get('indicators', []):
+            rules.append(IndicatorRule(base, indicator, value, direction, currency))
+
+    return rules
@@ -0,0 +1,189 @@
+# The clock of the collector (--collect).
+# Every coin has its own period (down to seconds, check settings.collect_periods), and its ticks are fixed on
+# a grid of the monotonic clock: the n-th tick is due at first + n * period, whatever the fetches took, so the
+# ticks don't drift (and every minute bucket gets exactly one tick). The grid is aligned with the wall clock
+# (e.g. a 60 second period ticks at the start of every minute), plus a random phase of up to jitter seconds
+# per coin, which spreads the requests of many coins over the period instead of sending all of them at once.
+#
+# A tick is missed when the loop wakes up too late (e.g. the machine was suspended), or when the previous
+# fetch of the coin is still running. Then, either:
+#   - 'skip': the missed ticks are dropped, and the coin goes on with the next tick of its grid
+#   - 'catch_up': the missed ticks are run right away, one after the other (at most max_catch_up of them)
+# The prices of the missed minutes aren't lost either way: they arrive with the 'hour' points of the next
+# document (check db.insert_document).
+
+import math
+import time
+import random
+import asyncio
+
+import metrics
+
+POLICIES = ['skip', 'catch_up']
+
+
+class Entry:
+    """
+    The schedule of a single key (a coin): its period, and the next tick on the monotonic clock
+    """
+
+    def __init__(self, key, period, due):
+        self.key = key
+        self.period = period
+        self.due = due
+        self.missed = 0
+
+
+class Scheduler:
+    """
+    Runs job(keys) whenever keys are due; the keys due at the same time are handed over together
+    """
+
+    def __init__(self, missed='skip', max_catch_up=5, clock=time.monotonic, wall=time.time):
+        """
+        Parameters:
+            - missed: what to do with the missed ticks: 'skip' or 'catch_up' (check the top of the file)
+            - max_catch_up: maximum number of missed ticks of a key that are run with 'catch_up'
+            - clock: the monotonic clock
+            - wall: the wall clock (only for aligning the grids)
+        """
+
+        if missed not in POLICIES:
+            raise ValueError(f"The missed ticks have to be one of: {', '.join(POLICIES)}")
+
+        self.missed = missed
+        self.max_catch_up = max_catch_up
+        self.clock = clock
+        # Taken once, so the keys with the same period and phase are due at exactly the same time
+        self.offset = clock() - wall()
+        self.entries = {}
+
+    def add(self, key, period, phase=0.0):
+        """
+        Schedules a key
+
+        Parameters:
+            - key: e.g. the name of a coin
+            - period: seconds between the ticks
+            - phase: seconds after the start of the period (on the wall clock) at which the key ticks
+        """
+
+        if period <= 0:
+            raise ValueError(f"{key}: The period has to be positive")
+
+        wall = self.clock() - self.offset
+        # The next start of a period on the wall clock, moved to the monotonic clock
+        first = math.floor((wall - phase) / period + 1) * period + phase
+
+        self.entries[key] = Entry(key, period, first + self.offset)
+
+    def next_due(self, exclude=()):
+        """
+        Returns: the monotonic time of the next tick (None if nothing is scheduled)
+        """
+
+        return min((entry.due for entry in self.entries.values() if entry.key not in exclude), default=None)
+
+    def pop_due(self, now=None, exclude=()):
+        """
+        Moves the keys that are due to their next tick
+
+        Parameters:
+            - now: the monotonic time (default: now)
+            - exclude: the keys that are left as they are
+
+        Returns: the keys that are due
+        """
+
+        now = self.clock() if now is None else now
+        keys = []
+
+        for entry in self.entries.values():
+            if entry.due > now or entry.key in exclude:
+                continue
+
+            keys.append(entry.key)
+            metrics.observe('schedule_lag', now - entry.due)
+
+            # The ticks of the grid that passed as well
+            behind = int((now - entry.due) // entry.period)
+
+            if self.missed == 'skip' or behind > self.max_catch_up:
+                kept = 0 if self.missed == 'skip' else self.max_catch_up
+                self.skip(entry, behind - kept)
+                entry.due += (behind - kept + 1) * entry.period
+            else:
+                # The next (missed) tick is due right away
+                entry.due += entry.period
+
+        return keys
+
+    def skip(self, entry, ticks):
+        if ticks > 0:
+            entry.missed += ticks
+            metrics.inc('ticks_missed', ticks)
+
+    async def run(self, job, stop):
+        """
+        Runs the jobs until stop is set; the running jobs are cancelled then
+
+        Parameters:
+            - job: an async function taking the list of the keys that are due
+            - stop: asyncio.Event
+        """
+
+        running = {}
+        stopping = asyncio.ensure_future(stop.wait())
+
+        def done(task):
+            for key in [key for key, other in running.items() if other is task]:
+                del running[key]
+
+            if not task.cancelled() and task.exception():
+                print(f"A tick failed: {task.exception()}")
+
+        try:
+            while not stop.is_set():
+                # With 'catch_up', a key waits for its running tick; with 'skip', its tick is missed (below)
+                waiting = set(running) if self.missed == 'catch_up' else set()
+                due = self.next_due(waiting)
+
+                if due is None or (delay := due - self.clock()) > 0:
+                    # Woken up right away by stop (or when a tick finishes)
+                    await asyncio.wait({stopping, *running.values()}, timeout=None if due is None else delay,
+                                       return_when=asyncio.FIRST_COMPLETED)
+                    continue
+
+                keys = self.pop_due(exclude=waiting)
+
+                # The previous tick of a key is still running
+                for key in [key for key in keys if key in running]:
+                    self.skip(self.entries[key], 1)
+                    keys.remove(key)
+
+                if keys:
+                    task = asyncio.create_task(job(keys))
+                    running.update(dict.fromkeys(keys, task))
+                    task.add_done_callback(done)
+        finally:
+            stopping.cancel()
+            tasks = set(running.values())
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(stopping, *tasks, return_exceptions=True)
+
+
+def phases(keys, jitter, periods, seed=None):
+    """
+    Returns: a random phase (seconds) per key: key -> phase, in [0, min(jitter, period of the key))
+
+    Parameters:
+        - keys: the keys
+        - jitter: the maximum phase
+        - periods: key -> period
+        - seed: seed of the random phases
+    """
+
+    rng = random.Random(seed)
+
+    return {key: rng.uniform(0, min(jitter, periods[key])) if jitter else 0.0 for key in keys}
@@ -0,0 +1,248 @@
+# Memory-mapped price series, for the charts (--viz, --export) and for the analysis in notebooks:
+#
+#   import series
+#   timestamps, prices = series.load('ETH', start, end)
+#
+# The ticks of a coin (archive and database, check archive.py) are mirrored into two raw int64 files:
+#
+#   <settings.series_dir>/<coin>.timestamps.i64   (ascending)
+#   <settings.series_dir>/<coin>.prices.i64       (price * 10^scale; check db.py)
+#
+# and a small json file with the number of ticks, the newest timestamp and the scale. The files are synced
+# incrementally (only the ticks newer than the last sync are appended; they are rebuilt if older ticks were
+# inserted meanwhile, e.g. by --backfill), and load() returns slices of the memory-mapped files, so reading
+# a range never goes through python lists and only touches the pages of the range.
+
+import os
+import json
+from threading import Lock
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: the processes aren't locked out of each other, so sync from one process at a time
+    fcntl = None
+
+import settings
+import db
+from archive import load_month
+from candles import BUCKETS
+from files import atomic_write
+
+# The length of the intervals in seconds (check db.INTERVALS)
+INTERVAL_SECONDS = {
+    'hour': 60 * 60,
+    'day': 60 * 60 * 24,
+    'week': 60 * 60 * 24 * 7,
+    'month': 60 * 60 * 24 * 30,
+    'year': 60 * 60 * 24 * 365,
+}
+
+# Rows read from the database at once while syncing
+chunk_size = 100_000
+
+_lock = Lock()
+
+
+def paths(base, series_dir=None):
+    """
+    Returns: the paths of the timestamps, the prices and the meta data files of a coin
+    """
+
+    prefix = os.path.join(series_dir or settings.series_dir, base)
+
+    return f"{prefix}.timestamps.i64", f"{prefix}.prices.i64", f"{prefix}.json"
+
+
+def read_meta(base, series_dir=None):
+    """
+    Returns: the meta data of the files of a coin: {'count', 'last', 'scale'}, or None if they don't exist
+    """
+
+    meta_path = paths(base, series_dir)[2]
+
+    if not os.path.exists(meta_path):
+        return
+
+    with open(meta_path) as fp:
+        return json.load(fp)
+
+
+def write_meta(base, meta, series_dir=None):
+    atomic_write(paths(base, series_dir)[2], json.dumps(meta))
+
+
+def stored_ticks(cursor, asset_id, base, after=-1, until=None):
+    """
+    Reads the ticks of a coin from the archive and the database, in chunks
+
+    Parameters:
+        - cursor: cursor to the db
+        - asset_id: id of the coin
+        - base: name of the coin
+        - after: only the ticks newer than this timestamp
+        - until: only the ticks up to this timestamp (default: no upper limit)
+
+    Yields: (timestamps, prices) # int64 numpy arrays; the prices are scaled
+    """
+
+    until = until if until is not None else 2 ** 62
+
+    months = cursor.execute("SELECT start from archived_months where asset_id = ? and end > ? and start <= ? order by start;",
+                            (asset_id, after + 1, until)).fetchall()
+
+    for (month,) in months:
+        timestamps, prices = load_month(base, month)
+        first, last = np.searchsorted(timestamps, after, side='right'), np.searchsorted(timestamps, until, side='right')
+        yield np.asarray(timestamps[first:last]), np.asarray(prices[first:last])
+
+    rows = cursor.execute("SELECT timestamp, price from ticks where asset_id = ? and timestamp > ? and timestamp <= ? order by timestamp;",
+                          (asset_id, after, until))
+
+    while (chunk := rows.fetchmany(chunk_size)):
+        data = np.array(chunk, dtype=np.int64)
+        yield data[:, 0], data[:, 1]
+
+
+def count_ticks(cursor, asset_id, base, until):
+    """
+    Returns: the number of ticks of a coin up to the timestamp until (archive and database)
+    """
+
+    # The writer counts the ticks of every bar as it stores them (check candles.py), so the whole days and
+    # then the whole minutes are counted from a few hundred bars, and only the last minute from the ticks
+    day, minute = until // BUCKETS['1d'] * BUCKETS['1d'], until // BUCKETS['1m'] * BUCKETS['1m']
+
+    count = cursor.execute("""SELECT coalesce(sum(count), 0) from candles where asset_id = ? and
+                              ((size = ? and start < ?) or (size = ? and start >= ? and start < ?));""",
+                           (asset_id, BUCKETS['1d'], day, BUCKETS['1m'], day, minute)).fetchone()[0]
+
+    for (month,) in cursor.execute("SELECT start from archived_months where asset_id = ? and start <= ? and end > ?;",
+                                   (asset_id, until, until)).fetchall():
+        timestamps = load_month(base, month)[0]
+        count += int(np.searchsorted(timestamps, until, side='right') - np.searchsorted(timestamps, minute, side='left'))
+
+    count += cursor.execute("SELECT count(*) from ticks where asset_id = ? and timestamp between ? and ?;",
+                            (asset_id, minute, until)).fetchone()[0]
+
+    return count
+
+
+def sync(base, cursor=None, series_dir=None):
+    """
+    Brings the files of a coin up to date with the archive and the database
+
+    Parameters:
+        - base: name of the coin
+        - cursor: cursor to the db (default: a read-only connection of its own)
+        - series_dir: the directory of the files (default: settings.series_dir)
+
+    Returns: the number of ticks in the files
+    """
+
+    if cursor is None:
+        conn = db.connect(read_only=True)
+        try:
+            return sync(base, conn.cursor(), series_dir)
+        finally:
+            conn.close()
+
+    if not (asset := db.get_asset(cursor, base)):
+        return 0
+
+    asset_id, scale = asset
+    timestamps_path, prices_path, meta_path = paths(base, series_dir)
+    os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+
+    with _lock, open(meta_path + '.lock', 'w') as lock:
+        if fcntl:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+
+        meta = read_meta(base, series_dir)
+
+        # Rebuild if the files are new, or older ticks were inserted since the last sync
+        rebuild = not meta or meta['scale'] != scale or count_ticks(cursor, asset_id, base, meta['last']) != meta['count']
+        after = -1 if rebuild else meta['last']
+
+        chunks = list(stored_ticks(cursor, asset_id, base, after=after))
+        timestamps = np.concatenate([np.empty(0, dtype=np.int64)] + [c[0] for c in chunks])
+        prices = np.concatenate([np.empty(0, dtype=np.int64)] + [c[1] for c in chunks])
+
+        # The archive and the database are read one after the other, so they might interleave
+        if len(timestamps) > 1 and (timestamps[1:] < timestamps[:-1]).any():
+            order = np.argsort(timestamps, kind='stable')
+            timestamps, prices = timestamps[order], prices[order]
+
+        if rebuild:
+            # The old files might still be mapped by the readers, so new ones are swapped in
+            for path, array in [(timestamps_path, timestamps), (prices_path, prices)]:
+                atomic_write(path, np.ascontiguousarray(array))
+
+            meta = {'count': 0, 'last': -1, 'scale': scale}
+        elif len(timestamps):
+            # The files might be longer than meta['count'] if the last sync was interrupted
+            for path, array in [(timestamps_path, timestamps), (prices_path, prices)]:
+                with open(path, 'r+b') as fp:
+                    fp.seek(meta['count'] * 8)
+                    fp.write(array.tobytes())
+                    fp.truncate()
+
+        if len(timestamps):
+            meta = {'count': meta['count'] + len(timestamps), 'last': int(timestamps[-1]), 'scale': scale}
+
+        write_meta(base, meta, series_dir)
+
+    return meta['count']
+
+
+def load(base, start=None, end=None, scaled=False, sync_first=True, series_dir=None):
+    """
+    The prices of a coin between start and end (inclusive)
+
+    Parameters:
+        - base: name of the coin
+        - start: unix timestamp (default: the first tick)
+        - end: unix timestamp (default: the last tick)
+        - scaled: return the prices as stored (int64: price * 10^scale, check read_meta() for the scale); a view
+                  of the file as well. Otherwise the prices of the range are converted to float64.
+        - sync_first: sync the files with the database first (check sync())
+        - series_dir: the directory of the files (default: settings.series_dir)
+
+    Returns: (timestamps, prices) in ascending order # the timestamps are a read-only int64 view of the memory-mapped file
+    """
+
+    if sync_first:
+        sync(base, series_dir=series_dir)
+
+    meta = read_meta(base, series_dir)
+
+    if not meta or not meta['count']:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64 if scaled else np.float64)
+
+    timestamps_path, prices_path, _ = paths(base, series_dir)
+    timestamps = np.memmap(timestamps_path, dtype=np.int64, mode='r', shape=(meta['count'],))
+    prices = np.memmap(prices_path, dtype=np.int64, mode='r', shape=(meta['count'],))
+
+    first = np.searchsorted(timestamps, start, side='left') if start is not None else 0
+    last = np.searchsorted(timestamps, end, side='right') if end is not None else meta['count']
+
+    if scaled:
+        return timestamps[first:last], prices[first:last]
+
+    return timestamps[first:last], prices[first:last] / 10 ** meta['scale']
+
+
+def load_interval(base, interval, end=None, sync_first=True, series_dir=None):
+    """
+    Returns: (timestamps, prices) of the last interval (e.g. 'day') of a coin, up to end (default: the last tick)
+    """
+
+    if sync_first:
+        sync(base, series_dir=series_dir)
+
+    if end is None:
+        end = (read_meta(base, series_dir) or {}).get('last', 0)
+
+    return load(base, end - INTERVAL_SECONDS[interval], end, sync_first=False, series_dir=series_dir)
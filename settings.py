@@ -0,0 +1,93 @@
+# Global variables shared between the modules (the coins to track, the currency, the database, etc.)
+
+# The paper currency against which the prices are fetched
+currency = 'CAD'
+
+# The coins to track: name -> base_id
+# The base_id is an internal uuid of coinbase specifying a certain crypto currency.
+# The base_id of all the coins can be fetched from the first url of schema.py
+# (or use collector.list_assets() to get all of them)
+assets = {
+    'ETH': 'd85dce9b-5b73-5c3c-8978-522ce1d1c1b4',
+}
+
+# Endpoints (check schema.py to understand how the data is organized)
+assets_url = 'https://www.coinbase.com/api/v2/assets/prices?base={currency}'
+prices_url = 'https://www.coinbase.com/api/v2/assets/prices/{base_id}?base={currency}'
+
+# Maximum number of requests that can be in flight at the same time while collecting
+max_concurrent_requests = 20
+
+# Seconds before a request is abandoned
+request_timeout = 30
+
+# The responses are cached in cache_dir and shared by all the modes and processes (check cache.py): for cache_ttl
+# seconds (half the period of the coin for the collector, if that's shorter), and for up to cache_stale seconds when
+# coinbase fails or rate limits
+cache_dir = 'cache'
+cache_ttl = 10
+cache_stale = 5 * 60
+
+database = 'crypto.db'
+
+# Collector (--collect, check scheduler.py): seconds between the ticks of a coin, the coins with a period of their
+# own (name -> seconds, e.g. {'BTC': 15}), the maximum random phase of the ticks of a coin (seconds; spreads the
+# requests of many coins over the period), and what to do with the missed ticks ('skip' or 'catch_up')
+collect_period = 60
+collect_periods = {}
+collect_jitter = 0
+collect_missed = 'skip'
+# Number of collector processes (check shard.py); with hundreds of coins, the parsing of the responses takes
+# more than a single core. 1: everything runs in this process
+collect_shards = 1
+
+# Live graph (--live): the window shown (seconds), seconds between fetches, and milliseconds between frames
+live_window = 60 * 60
+live_fetch_period = 10
+live_frame_interval = 1000
+
+# Dashboard (dashboard, check dashboard.py; it uses the live settings above as well): the number of columns of
+# the grid (None: about as many as the rows)
+dashboard_columns = None
+
+# Headless export (--export): the output directory, and the number of rendering processes (None: number of cpus)
+export_dir = 'exports'
+export_workers = None
+
+# Notifier: how the mails are sent ('gmail', 'smtp' or 'file'; check notify.py)
+mail_backend = 'gmail'
+smtp_host = 'localhost'
+smtp_port = 8025
+smtp_user = None
+smtp_password = None
+smtp_starttls = False
+# Where the 'file' backend writes the mails (one json per line)
+mail_file = 'mails.jsonl'
+
+# Metrics of --collect and --live (check metrics.py): the port of the local http endpoint (None: off), and
+# the json file that is rewritten every metrics_dump_period seconds (None: off)
+metrics_port = 9108
+metrics_file = None
+metrics_dump_period = 60
+
+# Backfill (--backfill): the coins that were already loaded are recorded here
+backfill_checkpoint = 'backfill.json'
+
+# Archive (--archive): the whole months of ticks older than archive_after_days are moved into files (check archive.py)
+archive_dir = 'archive'
+archive_after_days = 90
+
+# Memory-mapped copies of the price series, for the charts and the analysis (check series.py)
+series_dir = 'series'
+
+# Technical indicators over the 1 minute closes (check indicators.py): name -> (kind, window in minutes, ...)
+indicators = {
+    'sma_20': ('sma', 20),
+    'ema_20': ('ema', 20),
+    'volatility_60': ('volatility', 60),
+    'rsi_14': ('rsi', 14),
+    'bollinger_20': ('bollinger', 20, 2),
+    'twap_60': ('twap', 60),
+}
+# When an older minute changes, the indicators are recomputed from indicator_warmup * the longest window before it
+indicator_warmup = 10
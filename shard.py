@@ -0,0 +1,299 @@
+# Sharded collection (collect --shards N), for hundreds of coins.
+# The coins are split between N worker processes by a hash of their name. Every worker runs the collector
+# (check collector.run_collector) on its share, and also parses the documents: the json decoding and the
+# conversion of the price strings of the intervals into integer arrays (check parse.document) are the cpu
+# bound part of the writing. The parsed documents are sent over a queue to this (the main) process, which owns
+# the only db writer and writes them in grouped transactions; the notifier and the metrics stay here as well.
+#
+# The main process supervises the workers: a worker that dies is started again (after a backoff if it keeps
+# dying), and Ctrl+C (or SIGTERM) stops all of them.
+
+import os
+import time
+import zlib
+import signal
+import asyncio
+import multiprocessing as mp
+from queue import Empty
+from threading import Thread, Event
+
+import settings
+import db
+import parse
+import metrics
+
+# Maximum number of documents written by a single writer job
+max_batch = 256
+
+
+def shard_of(base, shards):
+    """
+    Returns: the index of the worker of a coin (stable between the runs, unlike hash())
+    """
+
+    return zlib.crc32(base.encode()) % shards
+
+
+def split(assets, shards):
+    """
+    Returns: the coins of every worker: a list of name -> base_id <dict>
+    """
+
+    shares = [{} for _ in range(shards)]
+
+    for base, base_id in assets.items():
+        shares[shard_of(base, shards)][base] = base_id
+
+    return shares
+
+
+class Parser:
+    """
+    Parses the documents of the coins of a worker. Only the points newer than the stored high water marks of
+    its coins are converted. The marks are read back from the db before every tick, never moved here: the
+    writer's own filter (check db.insert_parsed) decides what is stored, so the points of a rolled back job, or
+    of a batch lost when a worker died, are simply parsed again.
+    """
+
+    def __init__(self, bases):
+        self.bases = set(bases)
+        self.scales = {}
+        self.high_water = {}
+        self.conn = db.connect(read_only=True)
+
+    def refresh(self):
+        """
+        Reads the stored scales and the high water marks of the coins of the worker (a few rows per coin)
+        """
+
+        assets = {asset_id: (base, scale) for base, (asset_id, scale) in db.read_assets(self.conn.cursor()).items()
+                  if base in self.bases}
+
+        self.scales = {base: scale for base, scale in assets.values()}
+        self.high_water = {base: {} for base in self.bases}
+
+        for asset_id, interval, timestamp in self.conn.execute("SELECT asset_id, interval, timestamp from high_water;"):
+            if asset_id in assets:
+                self.high_water[assets[asset_id][0]][interval] = timestamp
+
+    def __call__(self, documents):
+        """
+        Returns: the parsed documents (check parse.document)
+        """
+
+        with metrics.timed('parse_marks'):
+            self.refresh()
+
+        parsed = []
+
+        for data in documents:
+            base = data['base']
+            # The stored number of decimals wins
+            scale = self.scales.get(base) or parse.scale_of(data)
+
+            with metrics.timed('parse_document'):
+                parsed.append(parse.document(data, scale, self.high_water.get(base)))
+
+        return parsed
+
+    def close(self):
+        self.conn.close()
+
+
+def worker(index, assets, queue, stop, values):
+    """
+    The worker process: collects and parses the documents of its coins, and sends them to the writer
+
+    Parameters:
+        - index: the index of the worker
+        - assets: name -> base_id <dict> (the share of the worker)
+        - queue: multiprocessing.Queue to the writer: (index, parsed documents)
+        - stop: multiprocessing.Event, set when the workers have to stop
+        - values: the values of settings.py in the main process
+    """
+
+    # The main process handles Ctrl+C and SIGTERM, and stops the workers through stop (so what they sent gets written)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    for name, value in values.items():
+        setattr(settings, name, value)
+
+    parser = Parser(list(assets))
+    try:
+        asyncio.run(run_worker(assets, queue, stop, lambda documents: queue.put((index, parser(documents)))))
+    finally:
+        parser.close()
+
+
+async def run_worker(assets, queue, stop, handle):
+    from collector import run_collector
+
+    parent = os.getppid()
+    done = asyncio.Event()
+
+    async def watch():
+        # Stop when asked to, or when the main process is gone
+        while not stop.is_set() and os.getppid() == parent:
+            await asyncio.sleep(0.5)
+        done.set()
+
+    watcher = asyncio.create_task(watch())
+
+    try:
+        await run_collector(assets, done, period=settings.collect_period, periods=settings.collect_periods,
+                            jitter=settings.collect_jitter, missed=settings.collect_missed, handle=handle,
+                            handle_signals=False)
+    finally:
+        watcher.cancel()
+
+
+def settings_values():
+    """
+    Returns: the values of settings.py (they might have been changed at runtime; the workers start from a fresh import)
+    """
+
+    return {name: value for name, value in vars(settings).items()
+            if not name.startswith('_') and isinstance(value, (str, int, float, bool, dict, list, tuple, type(None)))}
+
+
+class Supervisor:
+    """
+    Starts the workers, restarts the ones that die, and writes what they send
+    """
+
+    def __init__(self, assets, shards, max_backoff=60):
+        """
+        Parameters:
+            - assets: name -> base_id <dict>
+            - shards: number of worker processes
+            - max_backoff: maximum seconds to wait before restarting a worker that keeps dying
+        """
+
+        self.shares = [share for share in split(assets, shards) if share]
+        self.max_backoff = max_backoff
+
+        # Spawned (not forked), since this process already runs threads (the db writer)
+        self.context = mp.get_context('spawn')
+        self.queue = self.context.Queue()
+        self.stop = self.context.Event()
+
+        self.workers = [None] * len(self.shares)
+        self.started_at = [0.0] * len(self.shares)
+        self.failures = [0] * len(self.shares)
+        self.restart_at = [0.0] * len(self.shares)
+
+        self.drained = Event()
+        self.drainer = Thread(target=self.drain, daemon=True, name='shard-drain')
+
+    def spawn(self, index):
+        process = self.context.Process(target=worker, name=f"collector-{index}", daemon=True,
+                                       args=(index, self.shares[index], self.queue, self.stop, settings_values()))
+        process.start()
+
+        self.workers[index] = process
+        self.started_at[index] = time.monotonic()
+
+    def drain(self):
+        """
+        Hands the parsed documents to the db writer; whatever is waiting in the queue goes into a single job
+        """
+
+        writer = db.get_writer()
+
+        while True:
+            try:
+                batch = [self.queue.get(timeout=0.5)]
+            except Empty:
+                if self.drained.is_set():
+                    return
+                continue
+
+            while sum(len(documents) for _, documents in batch) < max_batch:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except Empty:
+                    break
+
+            documents = [document for _, share in batch for document in share]
+            metrics.inc('shard_documents', len(documents))
+
+            if documents:
+                writer.submit(db.insert_parsed_documents, writer.assets, writer.high_water, writer.indicator_states, documents)
+
+    def supervise(self, stopping):
+        """
+        Restarts the workers that died, until stopping is set
+        """
+
+        for index in range(len(self.shares)):
+            self.spawn(index)
+
+        while not stopping.wait(1):
+            now = time.monotonic()
+
+            for index, process in enumerate(self.workers):
+                if process.is_alive():
+                    continue
+
+                if self.restart_at[index] == 0:
+                    # A worker that ran for a while isn't failing over and over
+                    self.failures[index] = 0 if now - self.started_at[index] > 5 * self.max_backoff else self.failures[index] + 1
+                    delay = min(2 ** self.failures[index] - 1, self.max_backoff)
+                    self.restart_at[index] = now + delay
+
+                    metrics.inc('shard_restarts')
+                    print(f"Collector {index} exited (code {process.exitcode}), restarting it in {delay} seconds")
+
+                if now >= self.restart_at[index]:
+                    self.restart_at[index] = 0
+                    self.spawn(index)
+
+    def shutdown(self, timeout=10):
+        """
+        Stops the workers, and writes what they sent
+        """
+
+        self.stop.set()
+
+        for process in self.workers:
+            if process:
+                process.join(timeout)
+                if process.is_alive():
+                    process.terminate()
+                    process.join()
+
+        self.drained.set()
+        self.drainer.join()
+        db.get_writer().flush()
+
+    def run(self, stopping):
+        """
+        Runs the workers until stopping (threading.Event) is set
+        """
+
+        self.drainer.start()
+
+        try:
+            self.supervise(stopping)
+        finally:
+            self.shutdown()
+
+
+def run_sharded(assets, shards):
+    """
+    Collects the coins with shards worker processes until Ctrl+C (or SIGTERM)
+
+    Parameters:
+        - assets: name -> base_id <dict>
+        - shards: number of worker processes
+    """
+
+    stopping = Event()
+
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: stopping.set())
+
+    supervisor = Supervisor(assets, shards)
+    print(f"Collecting {len(assets)} coins with {len(supervisor.shares)} processes")
+
+    supervisor.run(stopping)
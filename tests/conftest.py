@@ -0,0 +1,61 @@
+# Shared fixtures: every test that touches the database gets a fresh one (and fresh files) in a temporary
+# directory, with its own writer and pool of readers (check db.init_db).
+#
+#   python -m pytest -q
+
+import pytest
+
+import settings
+import db
+
+
+@pytest.fixture
+def database_path(tmp_path, monkeypatch):
+    """
+    Returns: the path of a database that doesn't exist yet (e.g. to create an old one); db.init_db() opens it
+    """
+
+    path = str(tmp_path / 'crypto.db')
+
+    for name, value in [('database', path), ('cache_dir', tmp_path / 'cache'), ('archive_dir', tmp_path / 'archive'),
+                        ('series_dir', tmp_path / 'series'), ('backfill_checkpoint', tmp_path / 'backfill.json')]:
+        monkeypatch.setattr(settings, name, str(value))
+
+    # The module keeps a single writer per process
+    monkeypatch.setattr(db, '_writer', None)
+    monkeypatch.setattr(db, '_readers', None)
+    monkeypatch.setattr(db, '_asset_cache', {})
+
+    yield path
+
+    if db._writer:
+        db._writer.close()
+
+
+@pytest.fixture
+def database(database_path):
+    """
+    Returns: the path of a new database; db.get_writer() and db.reader() use it until the test ends
+    """
+
+    db.init_db()
+
+    return database_path
+
+
+def store(*documents):
+    """
+    Stores api responses like the collector does, and waits until they are written
+    """
+
+    db.update_db_batch(list(documents))
+    db.get_writer().flush()
+
+
+def table(name, order):
+    """
+    Returns: all the rows of a table, in a fixed order
+    """
+
+    with db.reader() as conn:
+        return conn.execute(f"SELECT * from {name} order by {order};").fetchall()
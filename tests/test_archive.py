@@ -0,0 +1,46 @@
+import time
+
+import numpy as np
+
+import db
+import archive
+from benchmarks.payload import price_document, shifted
+from tests.conftest import store, table
+
+
+def everything(base='ETH'):
+    with db.reader() as conn:
+        return archive.query_range(conn.cursor(), base, 0)
+
+
+def test_archiving_moves_the_old_months_without_changing_the_prices(database):
+    data = price_document(now=int(time.time()), seed=6)
+    store(data)
+    before = everything()
+
+    months = archive.run_archive(60, vacuum=True)
+
+    archived = table('archived_months', 'start')
+    assert months == len(archived) > 0
+    assert sum(count for *_, count in archived) == len(before[0]) - len(table('ticks', 'timestamp'))
+
+    after = everything()
+    assert np.array_equal(before[0], after[0]) and np.allclose(before[1], after[1])
+
+    # Nothing is left to move
+    assert archive.run_archive(60, vacuum=True) == 0
+
+
+def test_the_ticks_of_an_archived_month_are_dropped(database):
+    data = price_document(now=int(time.time()), seed=7)
+    store(data)
+    archive.run_archive(60)
+    before = everything()
+
+    # The same points again (as from a backfill), with a new latest price
+    store(shifted(data, 1, latest=1234))
+    timestamps, _ = everything()
+
+    _, start, end, _ = table('archived_months', 'start')[0]
+    inside = (timestamps >= start) & (timestamps < end)
+    assert np.array_equal(timestamps[inside], before[0][(before[0] >= start) & (before[0] < end)])
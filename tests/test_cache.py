@@ -0,0 +1,175 @@
+import asyncio
+
+import aiohttp
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+import settings
+import cache
+import collector
+from cache import Cache, retry_after
+
+
+class Upstream:
+    """
+    A stand-in for the price endpoint: answers with an ETag (304 when it matches), or with 429 while rate_limited
+    """
+
+    def __init__(self):
+        self.requests = []
+        self.rate_limited = False
+        self.version = 1
+
+        app = web.Application()
+        app.router.add_get('/prices', self.handle)
+        self.server = TestServer(app)
+
+    async def handle(self, request):
+        self.requests.append(dict(request.headers))
+        # Slow enough for the concurrent fetches to overlap
+        await asyncio.sleep(0.05)
+
+        if self.rate_limited:
+            return web.json_response({'errors': [{'message': "Rate limit exceeded"}]}, status=429, headers={'Retry-After': '60'})
+
+        etag = f'"v{self.version}"'
+        if request.headers.get('If-None-Match') == etag:
+            return web.Response(status=304, headers={'ETag': etag})
+
+        return web.json_response({'version': self.version}, headers={'ETag': etag})
+
+
+def run(test):
+    """
+    Runs test(upstream, url, session) against a new upstream
+    """
+
+    async def main():
+        upstream = Upstream()
+        await upstream.server.start_server()
+
+        try:
+            async with aiohttp.ClientSession() as session:
+                return await test(upstream, str(upstream.server.make_url('/prices')), session)
+        finally:
+            await upstream.server.close()
+
+    return asyncio.run(main())
+
+
+def test_a_fresh_response_is_served_from_the_file(tmp_path):
+    async def test(upstream, url, session):
+        cache = Cache(str(tmp_path), ttl=60)
+
+        assert await cache.fetch(session, url) == (200, b'{"version": 1}')
+        assert await cache.fetch(session, url) == (200, b'{"version": 1}')
+
+        # Another process (a new cache on the same directory) reads the same file
+        assert await Cache(str(tmp_path), ttl=60).fetch(session, url) == (200, b'{"version": 1}')
+        assert len(upstream.requests) == 1
+
+    run(test)
+
+
+def test_an_old_response_is_revalidated(tmp_path):
+    async def test(upstream, url, session):
+        cache = Cache(str(tmp_path), ttl=0)
+
+        await cache.fetch(session, url)
+        # Unchanged: a bodiless 304, and the cached body
+        assert await cache.fetch(session, url) == (200, b'{"version": 1}')
+        assert upstream.requests[-1]['If-None-Match'] == '"v1"'
+
+        upstream.version = 2
+        assert await cache.fetch(session, url) == (200, b'{"version": 2}')
+        assert len(upstream.requests) == 3
+
+    run(test)
+
+
+def test_rate_limited_serves_the_last_response_until_the_retry_time(tmp_path):
+    async def test(upstream, url, session):
+        cache = Cache(str(tmp_path), ttl=0, stale=300)
+
+        await cache.fetch(session, url)
+
+        upstream.rate_limited = True
+        assert await cache.fetch(session, url) == (200, b'{"version": 1}')
+        assert len(upstream.requests) == 2
+
+        # No request before Retry-After has passed
+        assert await cache.fetch(session, url) == (200, b'{"version": 1}')
+        assert len(upstream.requests) == 2
+
+        # Once it has, the upstream is asked again
+        entry = cache.read(url)
+        entry.meta['retry_at'] = 0
+        cache.write(url, entry)
+        upstream.rate_limited = False
+        upstream.version = 2
+        assert await cache.fetch(session, url) == (200, b'{"version": 2}')
+
+    run(test)
+
+
+def test_a_rate_limit_without_a_cached_response_is_returned(tmp_path):
+    async def test(upstream, url, session):
+        upstream.rate_limited = True
+        cache = Cache(str(tmp_path), ttl=0)
+
+        status, _ = await cache.fetch(session, url)
+        assert status == 429
+
+        # Backing off: the error is served from the file meanwhile
+        status, _ = await cache.fetch(session, url)
+        assert status == 429 and len(upstream.requests) == 1
+
+    run(test)
+
+
+def test_concurrent_fetches_share_one_request(tmp_path):
+    async def test(upstream, url, session):
+        cache = Cache(str(tmp_path), ttl=60)
+
+        responses = await asyncio.gather(*[cache.fetch(session, url) for _ in range(10)])
+
+        assert set(responses) == {(200, b'{"version": 1}')}
+        assert len(upstream.requests) == 1
+
+    run(test)
+
+
+def test_the_blocking_get_shares_the_files(tmp_path):
+    async def test(upstream, url, session):
+        await Cache(str(tmp_path), ttl=60).fetch(session, url)
+
+        # requests, from a thread (the upstream runs on this loop)
+        response = await asyncio.to_thread(Cache(str(tmp_path), ttl=60).get, url)
+        assert response == (200, b'{"version": 1}') and len(upstream.requests) == 1
+
+        response = await asyncio.to_thread(Cache(str(tmp_path), ttl=0).get, url)
+        assert response == (200, b'{"version": 1}') and upstream.requests[-1]['If-None-Match'] == '"v1"'
+
+    run(test)
+
+
+def test_the_collector_passes_the_ttl_of_every_coin(monkeypatch):
+    ttls = {}
+
+    async def fetch(session, url, ttl=None):
+        ttls[url] = ttl
+        return 200, b'{"data": {}}'
+
+    monkeypatch.setattr(cache, 'fetch', fetch)
+    monkeypatch.setattr(settings, 'prices_url', '{base_id}')
+
+    asyncio.run(collector.collect_tick(None, asyncio.Semaphore(1), {'BTC': 'btc', 'ETH': 'eth'}, {'BTC': 2.5}))
+
+    assert ttls == {'btc': 2.5, 'eth': None}
+
+
+def test_retry_after():
+    assert retry_after({'Retry-After': '12'}, 30) == 12
+    assert retry_after({'Retry-After': 'Wed, 21 Oct 2015 07:28:00 GMT'}, 30) == 0
+    assert retry_after({'Retry-After': 'soon'}, 30) == 30
+    assert retry_after({}, 30) == 30
@@ -0,0 +1,53 @@
+import numpy as np
+
+import db
+from candles import BUCKETS, aggregate, rebuild_candles
+from benchmarks.payload import price_document, shifted
+from tests.conftest import store, table
+
+NOW = 1_790_000_000
+
+
+def test_aggregate_matches_a_loop():
+    rng = np.random.default_rng(0)
+    timestamps = np.sort(rng.choice(10 ** 5, 2000, replace=False)).astype(np.int64)
+    prices = rng.integers(1, 1000, len(timestamps))
+
+    bars = aggregate(timestamps, prices, 300)
+
+    for idx, start in enumerate(bars['start']):
+        inside = (timestamps >= start) & (timestamps < start + 300)
+        expected = prices[inside]
+
+        assert (bars['open'][idx], bars['high'][idx], bars['low'][idx], bars['close'][idx], bars['count'][idx]) == \
+               (expected[0], expected.max(), expected.min(), expected[-1], len(expected))
+
+    assert bars['count'].sum() == len(timestamps)
+
+
+def test_the_incremental_candles_equal_a_rebuild(database):
+    first = price_document(now=NOW, seed=3)
+
+    # New ticks after the first document, and then an older document (like a backfill) falling into the stored bars
+    store(first)
+    store(shifted(first, 150, latest=2100))
+    store(shifted(price_document(now=NOW - 7 * 86400, seed=4), 0))
+
+    incremental = table('candles', 'asset_id, size, start')
+
+    writer = db.get_writer()
+    writer.submit(rebuild_candles, 1)
+    writer.flush()
+
+    assert table('candles', 'asset_id, size, start') == incremental
+    assert len(incremental) > len(BUCKETS) * 100
+
+
+def test_the_candles_count_every_tick(database):
+    store(price_document(now=NOW, seed=5))
+
+    with db.reader() as conn:
+        ticks = conn.execute("SELECT count(*) from ticks;").fetchone()[0]
+        counts = dict(conn.execute("SELECT size, sum(count) from candles group by size;").fetchall())
+
+    assert counts == {size: ticks for size in BUCKETS.values()}
@@ -0,0 +1,44 @@
+import os
+import sys
+import subprocess
+
+import pytest
+
+import main
+
+
+@pytest.mark.parametrize('old, new', [
+    (['--collect'], ['collect']),
+    (['--viz', '-WD'], ['viz', 'wd']),
+    (['--export', '-hd'], ['export', 'hd']),
+    (['--candles', '1H'], ['candles', '1h']),
+    (['--backfill', 'ETH,BTC', '--restart'], ['backfill', 'ETH,BTC', '--restart']),
+    (['gaps', '--days', '2'], ['gaps', '--days', '2']),
+    ([], []),
+])
+def test_the_old_options_become_subcommands(old, new):
+    assert main.legacy_args(old) == new
+
+
+def test_the_subcommands_and_their_defaults():
+    assert main.parse_args([]).command is main.cmd_fetch
+    assert main.parse_args(['--viz', '-hd']).command is main.cmd_viz
+
+    args = main.parse_args(['candles'])
+    assert (args.command, args.size, args.fetch) == (main.cmd_candles, '1h', False)
+
+
+def test_importing_main_runs_nothing_and_loads_no_plotting():
+    code = "import sys, main; print('matplotlib' in sys.modules, 'aiohttp' in sys.modules)"
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, cwd=os.path.dirname(main.__file__))
+
+    assert result.stdout.split() == ['False', 'False']
+
+
+def test_candles_draw_without_fetching(database, monkeypatch):
+    matplotlib = pytest.importorskip('matplotlib')
+    # No window
+    matplotlib.use('Agg')
+
+    monkeypatch.setattr(main, 'start', lambda *args, **kwargs: pytest.fail("candles fetched the prices"))
+    main.cmd_candles(main.parse_args(['candles', '1m']))
@@ -0,0 +1,136 @@
+import time
+from threading import Event, Thread
+
+import pytest
+
+import db
+
+
+def create_table(cursor):
+    cursor.execute("CREATE TABLE t (x INTEGER PRIMARY KEY);")
+
+
+def insert(cursor, x):
+    cursor.execute("INSERT INTO t VALUES (?);", (x,))
+    return [x]
+
+
+def fail(cursor, x):
+    cursor.execute("INSERT INTO t VALUES (?);", (x,))
+    raise RuntimeError("failing on purpose")
+
+
+def values():
+    with db.reader() as conn:
+        return [x for x, in conn.execute("SELECT x from t order by x;")]
+
+
+def test_a_failing_job_rolls_back_only_itself(database):
+    writer = db.get_writer()
+    writer.submit(create_table)
+    writer.flush()
+
+    # Held back, so the jobs below are written in a single transaction
+    release = Event()
+    writer.submit(lambda cursor: release.wait(5) and None)
+    for job, x in [(insert, 1), (fail, 2), (insert, 3)]:
+        writer.submit(job, x)
+    release.set()
+    writer.flush()
+
+    assert values() == [1, 3]
+
+
+def test_listeners_see_the_committed_rows(database):
+    writer = db.get_writer()
+    writer.submit(create_table)
+    writer.flush()
+
+    seen = []
+    writer.add_listener(lambda events: seen.append((events, values())))
+
+    writer.submit(insert, 7)
+    writer.flush()
+
+    assert seen == [([7], [7])]
+
+
+def test_close_writes_the_jobs_queued_behind_it(database):
+    writer = db.get_writer()
+    writer.submit(create_table)
+
+    # close() puts the sentinel; a job submitted after it (e.g. by another thread) mustn't be lost
+    release = Event()
+    writer.submit(lambda cursor: release.wait(5) and None)
+    writer.queue.put(None)
+    writer.submit(insert, 1)
+    release.set()
+
+    writer.join(5)
+    assert not writer.is_alive()
+    # Every item was marked as done, so flush() returns
+    assert writer.queue.unfinished_tasks == 0
+
+    conn = db.connect(database, read_only=True)
+    assert conn.execute("SELECT x from t;").fetchall() == [(1,)]
+    conn.close()
+
+
+def test_a_job_reading_before_writing_survives_another_process(database):
+    writer = db.get_writer()
+    writer.submit(create_table)
+    writer.flush()
+
+    def other():
+        conn = db.connect(database)
+        conn.execute("INSERT INTO t VALUES (2);")
+        conn.close()
+
+    def job(cursor):
+        # Reads first (like the high water marks), then another process writes before this job does
+        cursor.execute("SELECT count(*) from t;").fetchone()
+        thread = Thread(target=other)
+        thread.start()
+        time.sleep(0.2)
+        cursor.execute("INSERT INTO t VALUES (1);")
+        return thread
+
+    events = []
+    writer.add_listener(events.extend)
+    writer.submit(lambda cursor: [job(cursor)])
+    writer.flush()
+    events[0].join(5)
+
+    assert values() == [1, 2]
+
+
+def test_a_locked_database_doesnt_stop_the_writer(database):
+    writer = db.get_writer()
+    writer.submit(create_table)
+    writer.flush()
+
+    writer.retries = 1
+    writer.conn.execute("PRAGMA busy_timeout=0;")
+
+    other = db.connect(database)
+    other.execute("BEGIN IMMEDIATE;")
+    writer.submit(insert, 1)
+    # The batch is given up, but flush() still returns
+    writer.flush()
+    other.execute("COMMIT;")
+    other.close()
+
+    writer.submit(insert, 2)
+    writer.flush()
+
+    assert writer.is_alive()
+    assert values() == [2]
+
+
+def test_connect_read_only_cannot_write(database):
+    conn = db.connect(database, read_only=True)
+
+    with pytest.raises(Exception):
+        conn.execute("CREATE TABLE u (x);")
+
+    conn.close()
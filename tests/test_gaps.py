@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+import db
+import gaps
+from gaps import STEP, find_gaps, resample, rebuild_gaps
+from benchmarks.payload import price_document, shifted
+from tests.conftest import store, table
+
+NOW = 1_790_000_000
+
+
+def test_find_gaps_returns_the_empty_minutes():
+    timestamps = np.array([0, 30, 60, 250, 600, 610])
+
+    starts, ends = find_gaps(timestamps)
+
+    assert list(zip(starts, ends)) == [(120, 240), (300, 600)]
+
+
+@pytest.mark.parametrize('fill, expected', [('ffill', [1, 1, 3, 3, 4]), ('linear', [1, 2, 3, 3.5, 4]),
+                                            ('none', [1, np.nan, 3, np.nan, 4])])
+def test_resample_fills_the_empty_minutes(fill, expected):
+    # The last price of a minute wins
+    grid, values, observed = resample([0, 10, 120, 130, 240], [9, 1, 5, 3, 4], fill=fill)
+
+    assert list(grid) == [0, 60, 120, 180, 240]
+    assert np.allclose(values, expected, equal_nan=True)
+    assert list(observed) == [True, False, True, False, True]
+
+
+def test_resample_uses_the_price_before_the_range():
+    _, values, _ = resample([130], [5], start=0, end=180, before=2)
+
+    assert list(values) == [2, 2, 5, 5]
+
+
+def test_the_incremental_index_equals_a_rebuild(database):
+    rng = np.random.default_rng(14)
+    first = price_document(now=NOW, seed=15)
+    store(first)
+
+    # New minutes, and older documents (like backfills) falling into the holes
+    for minute in range(1, 6):
+        store(shifted(first, 60 * minute, latest=2000 + minute))
+    for days in rng.integers(1, 300, 5):
+        store(price_document(now=NOW - int(days) * 86400, seed=int(days)))
+
+    incremental = table('gaps', 'asset_id, start')
+
+    writer = db.get_writer()
+    writer.submit(rebuild_gaps, 1)
+    writer.flush()
+
+    assert table('gaps', 'asset_id, start') == incremental
+    assert len(incremental) > 100
+
+
+def test_missing_and_dense_agree(database):
+    store(price_document(now=NOW, seed=16))
+    start, end = NOW - 86400, NOW
+
+    with db.reader() as conn:
+        cursor = conn.cursor()
+        grid, prices, observed = gaps.dense(cursor, 'ETH', start, end)
+        missing = gaps.missing(cursor, 'ETH', start, end)
+
+    assert not np.isnan(prices).any()
+    empty = sum((gap_end - gap_start) // STEP for gap_start, gap_end in missing)
+    # The gaps are the minutes without a tick (from the first one of the window on)
+    assert empty == (~observed[np.argmax(observed):]).sum()
+
+    with db.reader() as conn:
+        assert gaps.missing(conn.cursor(), 'NOPE', start, end) == []
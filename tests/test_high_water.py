@@ -0,0 +1,63 @@
+import db
+from benchmarks.payload import price_document, shifted
+from tests.conftest import store, table
+
+NOW = 1_790_000_000
+
+
+def ticks(base):
+    with db.reader() as conn:
+        asset_id = db.get_asset(conn.cursor(), base)[0]
+        return conn.execute("SELECT timestamp, price from ticks where asset_id = ? order by timestamp;", (asset_id,)).fetchall()
+
+
+def clear_marks(cursor):
+    cursor.execute("DELETE from high_water;")
+
+
+def test_a_repeated_document_stores_nothing(database):
+    data = price_document(now=NOW, seed=1)
+
+    store(data)
+    before = ticks('ETH')
+    store(data)
+
+    assert ticks('ETH') == before
+    assert len(before) > 1000
+
+
+def test_the_marks_drop_only_what_is_stored(database):
+    first = price_document(now=NOW, seed=1)
+    later = shifted(first, 10 * 60, latest=2100)
+
+    # ETH goes through the marks, BTC (the same prices) has them cleared before the second document
+    store(first, {**first, 'base': 'BTC'})
+
+    writer = db.get_writer()
+    writer.submit(clear_marks)
+    writer.flush()
+    writer.high_water.clear()
+
+    store(later)
+    store({**later, 'base': 'BTC'})
+
+    assert ticks('ETH') == ticks('BTC')
+
+
+def test_the_marks_are_the_newest_point_of_every_interval(database):
+    data = price_document(now=NOW, seed=2)
+    store(data)
+
+    newest = {interval: max(ts for _, ts in data['prices'][key]['prices']) for interval, key in enumerate(db.INTERVALS)}
+
+    assert {interval: timestamp for _, interval, timestamp in table('high_water', 'interval')} == newest
+
+
+def test_an_older_mark_doesnt_move_the_stored_one_back(database):
+    writer = db.get_writer()
+    writer.submit(lambda cursor: db.set_high_water(cursor, {}, 1, 0, NOW))
+    # Another process, whose mark in memory is behind
+    writer.submit(lambda cursor: db.set_high_water(cursor, {(1, 0): NOW - 60}, 1, 0, NOW - 30))
+    writer.flush()
+
+    assert table('high_water', 'asset_id') == [(1, 0, NOW)]
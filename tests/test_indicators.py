@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+import db
+import indicators
+from indicators import KINDS, rebuild_indicators
+from benchmarks.payload import price_document, shifted
+from tests.conftest import store, table
+
+NOW = 1_790_000_000
+
+
+@pytest.mark.parametrize('kind, params', [('sma', (20,)), ('ema', (20,)), ('volatility', (30,)), ('rsi', (14,)),
+                                          ('bollinger', (20, 2)), ('twap', (30,))])
+def test_pushing_bar_by_bar_equals_the_vectorized_computation(kind, params):
+    rng = np.random.default_rng(11)
+    timestamps = np.arange(300, dtype=np.int64) * 60 + 1_000_020
+    # Some minutes are missing
+    timestamps = np.sort(rng.choice(timestamps, 250, replace=False))
+    prices = 2000 * np.exp(np.cumsum(rng.normal(0, 0.002, len(timestamps))))
+
+    indicator = KINDS[kind](*params)
+    outputs, final = indicator.compute(timestamps, prices)
+
+    state = indicator.new_state()
+    pushed = np.array([[np.nan if value is None else value for value in indicator.push(state, int(t), float(p))]
+                       for t, p in zip(timestamps, prices)])
+
+    for column, expected in zip(pushed.T, outputs):
+        assert np.allclose(column, expected, equal_nan=True)
+
+    # The state carried over is the same as well
+    probe = (int(timestamps[-1]) + 60, float(prices[-1]) * 1.01)
+    assert np.allclose(indicator.peek(state, *probe), indicator.peek(final, *probe), equal_nan=True)
+
+
+def values():
+    return {(name, timestamp): value for _, name, timestamp, value in table('indicators', 'asset_id, name, timestamp')}
+
+
+def test_the_incremental_indicators_equal_a_rebuild(database):
+    first = price_document(now=NOW, seed=12)
+    store(first)
+
+    # New minutes one after the other, through the saved state
+    for minute in range(1, 30):
+        store(shifted(first, 60 * minute, latest=2000 + minute))
+
+    incremental = values()
+
+    writer = db.get_writer()
+    writer.submit(rebuild_indicators, 1, 2, {})
+    writer.flush()
+
+    rebuilt = values()
+    assert incremental.keys() == rebuilt.keys()
+    assert np.allclose([incremental[key] for key in rebuilt], list(rebuilt.values()))
+    assert {name for name, _ in rebuilt} == {name for names in indicators.output_names(indicators.configured()).values() for name in names}
@@ -0,0 +1,101 @@
+import json
+import smtplib
+
+import pytest
+
+from notify import SmtpBackend, FileBackend, make_backend
+
+INDIVIDUALS = {'from': 'me@example.com', 'to': 'you@example.com'}
+
+
+class FakeSmtp:
+    """
+    Stands in for smtplib.SMTP; errors: subject -> the exception raised when sending that mail
+    """
+
+    def __init__(self, errors=None):
+        self.errors = errors or {}
+        self.sent = []
+        self.closed = False
+
+    def send_message(self, message):
+        if (error := self.errors.get(message['Subject'])):
+            raise error
+        self.sent.append(message['Subject'])
+
+    def quit(self):
+        self.closed = True
+
+
+@pytest.fixture
+def smtp(monkeypatch):
+    """
+    Returns: (backend, connections, connect); every connection the backend opens is appended to connections,
+             and the next one fails the mails of connect.errors (check FakeSmtp)
+    """
+
+    backend = SmtpBackend()
+    backend.individuals = INDIVIDUALS
+    connections = []
+
+    def connect():
+        connections.append(FakeSmtp(connect.errors))
+        connect.errors = {}
+        return connections[-1]
+
+    connect.errors = {}
+    monkeypatch.setattr(backend, 'connect', connect)
+
+    return backend, connections, connect
+
+
+MAILS = [('a', 'body'), ('b', 'body'), ('c', 'body')]
+
+
+def test_the_connection_is_kept_between_batches(smtp):
+    backend, connections, _ = smtp
+
+    assert backend.send(MAILS[:1]) == ([], None)
+    assert backend.send(MAILS[1:]) == ([], None)
+    assert len(connections) == 1 and connections[0].sent == ['a', 'b', 'c']
+
+
+def test_a_refused_mail_doesnt_stop_the_batch(smtp):
+    backend, connections, connect = smtp
+    connect.errors = {'b': smtplib.SMTPRecipientsRefused({})}
+
+    failed, error = backend.send(MAILS)
+
+    assert failed == [('b', 'body')] and isinstance(error, smtplib.SMTPException)
+    assert connections[0].sent == ['a', 'c']
+    assert backend.smtp is connections[0]
+
+
+@pytest.mark.parametrize('error', [smtplib.SMTPServerDisconnected(), TimeoutError(), ConnectionResetError()])
+def test_a_broken_connection_returns_the_rest_and_reconnects(smtp, error):
+    backend, connections, connect = smtp
+    connect.errors = {'b': error}
+
+    failed, raised = backend.send(MAILS)
+
+    assert failed == MAILS[1:] and raised is error
+    assert backend.smtp is None
+
+    # The next try goes over a new connection
+    assert backend.send(failed) == ([], None)
+    assert len(connections) == 2 and connections[1].sent == ['b', 'c']
+
+
+def test_the_file_backend_appends_json_lines(tmp_path):
+    path = tmp_path / 'mails.jsonl'
+    backend = FileBackend(str(path))
+
+    backend.send(MAILS[:2])
+    backend.send(MAILS[2:])
+
+    assert [json.loads(line)['subject'] for line in path.read_text().splitlines()] == ['a', 'b', 'c']
+
+
+def test_an_unknown_backend_is_refused():
+    with pytest.raises(ValueError):
+        make_backend('pigeon')
@@ -0,0 +1,117 @@
+from datetime import datetime, timedelta, timezone
+from threading import Event
+from types import SimpleNamespace
+
+import db
+import notify
+from notify import Backend, Outbox, GmailBackend
+
+
+class FlakyBackend(Backend):
+    """
+    Records the batches it sent; the first `failures` calls fail, and return their mails unsent
+    """
+
+    def __init__(self, failures=0):
+        super().__init__()
+
+        self.failures = failures
+        self.batches_sent = []
+
+    def _send(self, mails):
+        if self.failures:
+            self.failures -= 1
+            return mails, RuntimeError("try again")
+
+        self.batches_sent.append(list(mails))
+        return [], None
+
+
+def outbox(backend):
+    box = Outbox(backend)
+    box.backoff = 0.01
+    return box
+
+
+def test_the_mails_queued_together_go_in_one_batch():
+    backend = FlakyBackend()
+    box = outbox(backend)
+
+    for idx in range(3):
+        box.put(f"subject {idx}", "body")
+    box.start()
+    box.flush()
+    box.close()
+
+    assert backend.batches_sent == [[(f"subject {idx}", "body") for idx in range(3)]]
+    assert backend.metrics()['sent'] == 3
+
+
+def test_the_failed_mails_are_retried():
+    backend = FlakyBackend(failures=2)
+    box = outbox(backend)
+    box.start()
+
+    box.put("subject", "body")
+    box.flush()
+    box.close()
+
+    assert backend.batches_sent == [[("subject", "body")]]
+    assert backend.metrics()['failed'] == 2
+
+
+def test_the_mails_are_dropped_after_the_retries():
+    backend = FlakyBackend(failures=100)
+    box = outbox(backend)
+    box.max_retries = 2
+    box.start()
+
+    box.put("subject", "body")
+    box.flush()
+    box.close()
+
+    assert backend.batches_sent == []
+    assert backend.batches == 3
+
+
+def test_close_sends_what_is_queued():
+    backend = FlakyBackend()
+    box = outbox(backend)
+
+    # The outbox is busy with a slow batch while the rest is queued
+    release = Event()
+    send = backend._send
+    backend._send = lambda mails: (release.wait(5), send(mails))[1]
+
+    box.start()
+    box.put("first", "body")
+    box.put("second", "body")
+    release.set()
+    box.close()
+
+    assert [mail for batch in backend.batches_sent for mail in batch] == [("first", "body"), ("second", "body")]
+
+
+def test_the_token_expiry_is_compared_in_utc():
+    # google-auth keeps the expiry as a naive utc datetime
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+
+    assert GmailBackend._expiring(SimpleNamespace(expiry=now + timedelta(minutes=1)))
+    assert not GmailBackend._expiring(SimpleNamespace(expiry=now + timedelta(hours=1)))
+    assert not GmailBackend._expiring(SimpleNamespace(expiry=datetime.now(timezone.utc) + timedelta(hours=1)))
+    assert not GmailBackend._expiring(SimpleNamespace(expiry=None))
+
+
+def test_closing_sends_the_alerts_of_the_last_writes(database, monkeypatch):
+    backend = FlakyBackend()
+    monkeypatch.setattr(notify, '_outbox', outbox(backend))
+    notify._outbox.start()
+
+    writer = db.get_writer()
+    writer.add_listener(lambda events: [notify.send_mail(f"alert {event}", "body") for event in events])
+
+    # Still queued when the program exits
+    writer.submit(lambda cursor: [1])
+    notify.close()
+
+    assert backend.batches_sent == [[("alert 1", "body")]]
@@ -0,0 +1,96 @@
+import pytest
+
+import rules
+from rules import RuleEngine, ThresholdRule, BandRule, PercentChangeRule, IndicatorRule, rules_from_settings
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    Returns: a list holding the time seen by the rules; change clock[0] to move it
+    """
+
+    now = [1_000_000.0]
+    monkeypatch.setattr(rules.time, 'time', lambda: now[0])
+
+    return now
+
+
+def tick(engine, price, base='ETH', **extra):
+    return [alert.subject for alert in engine.evaluate([{'base': base, 'timestamp': 0, 'price': price, **extra}])]
+
+
+def test_threshold_fires_once_per_crossing_in_its_direction(clock):
+    engine = RuleEngine([ThresholdRule('ETH', 2500, 'above'), ThresholdRule('ETH', 1500, 'below')], cooldown=0)
+
+    assert tick(engine, 2000) == []
+    assert tick(engine, 2600) == ['ETH is above 2500.00 CAD']
+    # Staying above, and going back down through it, don't fire the upward rule
+    assert tick(engine, 2700) == []
+    assert tick(engine, 2400) == []
+    assert tick(engine, 1400) == ['ETH is below 1500.00 CAD']
+    # A jump across both levels fires the one of its direction only
+    assert tick(engine, 2600) == ['ETH is above 2500.00 CAD']
+
+
+def test_first_price_fires_the_levels_already_crossed(clock):
+    engine = RuleEngine([ThresholdRule('ETH', 2500, 'above'), ThresholdRule('ETH', 1500, 'below')], cooldown=0)
+
+    assert tick(engine, 3000) == ['ETH is above 2500.00 CAD']
+
+
+def test_cooldown_silences_a_rule_until_it_passes(clock):
+    engine = RuleEngine([ThresholdRule('ETH', 2500, 'above')], cooldown=60)
+
+    assert tick(engine, 2000) == []
+    assert tick(engine, 2600) == ['ETH is above 2500.00 CAD']
+    assert tick(engine, 2400) == []
+
+    clock[0] += 30
+    assert tick(engine, 2600) == []
+    assert tick(engine, 2400) == []
+
+    clock[0] += 31
+    assert tick(engine, 2600) == ['ETH is above 2500.00 CAD']
+
+
+def test_band_fires_when_left_and_when_reentered(clock):
+    engine = RuleEngine([BandRule('ETH', 1900, 2100)], cooldown=0)
+
+    assert tick(engine, 2000) == []
+    assert tick(engine, 2200) == ['ETH left the band 1900.00 - 2100.00 CAD']
+    assert tick(engine, 2050) == ['ETH is back in the band 1900.00 - 2100.00 CAD']
+    # Jumping over the whole band fires it once
+    assert tick(engine, 1800) == ['ETH left the band 1900.00 - 2100.00 CAD']
+    assert tick(engine, 2300) == ['ETH left the band 1900.00 - 2100.00 CAD']
+
+
+def test_percent_change_rules_up_to_the_change(clock):
+    engine = RuleEngine([PercentChangeRule('ETH', 1), PercentChangeRule('ETH', 5), PercentChangeRule('ETH', 1, 'day')], cooldown=0)
+
+    assert tick(engine, 2000, percent_change={'hour': 0.005}) == []
+    assert len(tick(engine, 2001, percent_change={'hour': -0.02})) == 1
+    assert len(tick(engine, 2002, percent_change={'hour': 0.06, 'day': 0.001})) == 2
+
+
+def test_indicator_crossings_in_both_directions(clock):
+    engine = RuleEngine([IndicatorRule('ETH', 'rsi_14', 70, 'above'), IndicatorRule('ETH', 'rsi_14', 30, 'below')], cooldown=0)
+
+    # The first value only sets the previous one
+    assert tick(engine, 2000, indicators={'rsi_14': 80}) == []
+    assert tick(engine, 2000, indicators={'rsi_14': 60}) == []
+    assert tick(engine, 2000, indicators={'rsi_14': 75}) == ['ETH: rsi_14 is above 70']
+    assert tick(engine, 2000, indicators={'rsi_14': 20}) == ['ETH: rsi_14 is below 30']
+    assert tick(engine, 2000, indicators={'rsi_14': None}) == []
+
+
+def test_rules_from_settings_overrides_per_coin():
+    settings = {'upper_value_threshold': 2500, 'lower_value_threshold': None, 'hourly_percent_threshold': 1,
+                'assets': {'BTC': {'upper_value_threshold': 90000, 'bands': [(1, 2)]}}}
+
+    made = rules_from_settings(settings, ['ETH', 'BTC'])
+
+    assert [(type(rule).__name__, rule.base) for rule in made] == [
+        ('ThresholdRule', 'ETH'), ('PercentChangeRule', 'ETH'),
+        ('ThresholdRule', 'BTC'), ('PercentChangeRule', 'BTC'), ('BandRule', 'BTC')]
+    assert made[2].value == 90000
@@ -0,0 +1,126 @@
+import asyncio
+
+import pytest
+
+from scheduler import Scheduler, phases
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def scheduler(missed, max_catch_up=5):
+    clock = Clock()
+    # The wall clock is 40 seconds into a minute
+    schedule = Scheduler(missed, max_catch_up, clock=clock, wall=lambda: clock.now + 100_020)
+    schedule.add('ETH', 60)
+
+    return schedule, clock
+
+
+def test_the_ticks_are_aligned_to_the_wall_clock():
+    schedule, clock = scheduler('skip')
+
+    # The next whole minute of the wall clock is 20 seconds away
+    assert schedule.next_due() == pytest.approx(clock.now + 20)
+
+
+def test_skip_drops_the_missed_ticks_and_keeps_the_grid():
+    schedule, clock = scheduler('skip')
+    due = schedule.next_due()
+
+    clock.now = due + 3.5 * 60
+    assert schedule.pop_due() == ['ETH']
+    assert schedule.pop_due() == []
+
+    assert schedule.entries['ETH'].missed == 3
+    assert schedule.next_due() == pytest.approx(due + 4 * 60)
+
+
+def test_catch_up_runs_the_missed_ticks_right_away():
+    schedule, clock = scheduler('catch_up')
+    due = schedule.next_due()
+
+    clock.now = due + 3.5 * 60
+    ticks = 0
+    while schedule.pop_due():
+        ticks += 1
+
+    assert ticks == 4
+    assert schedule.entries['ETH'].missed == 0
+    assert schedule.next_due() == pytest.approx(due + 4 * 60)
+
+
+def test_catch_up_is_limited():
+    schedule, clock = scheduler('catch_up', max_catch_up=2)
+    due = schedule.next_due()
+
+    clock.now = due + 10.5 * 60
+    ticks = 0
+    while schedule.pop_due():
+        ticks += 1
+
+    assert ticks == 3
+    assert schedule.entries['ETH'].missed == 8
+    assert schedule.next_due() == pytest.approx(due + 11 * 60)
+
+
+def test_the_keys_due_together_are_handed_over_together():
+    schedule, clock = scheduler('skip')
+    schedule.add('BTC', 60)
+    schedule.add('DOGE', 120)
+
+    clock.now = schedule.next_due()
+    # The next minute is a whole two minutes as well
+    assert sorted(schedule.pop_due()) == ['BTC', 'DOGE', 'ETH']
+
+    clock.now += 60
+    assert sorted(schedule.pop_due()) == ['BTC', 'ETH']
+
+
+def test_an_unknown_policy_or_period_is_refused():
+    with pytest.raises(ValueError):
+        Scheduler('retry')
+    with pytest.raises(ValueError):
+        Scheduler().add('ETH', 0)
+
+
+def test_phases_stay_within_the_period():
+    spread = phases(['a', 'b', 'c'], 30, {'a': 60, 'b': 10, 'c': 60}, seed=1)
+
+    assert 0 <= spread['a'] < 30 and 0 <= spread['b'] < 10 and 0 <= spread['c'] < 30
+    assert phases(['a'], 0, {'a': 60}) == {'a': 0.0}
+
+
+def test_run_stops_and_cancels_the_running_jobs():
+    started, cancelled = [], []
+
+    async def job(keys):
+        started.append(keys)
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(keys)
+            raise
+
+    async def main():
+        schedule = Scheduler('skip')
+        schedule.add('ETH', 0.05)
+        stop = asyncio.Event()
+
+        runner = asyncio.create_task(schedule.run(job, stop))
+        await asyncio.sleep(0.3)
+        stop.set()
+        await asyncio.wait_for(runner, 1)
+
+        return schedule
+
+    schedule = asyncio.run(main())
+
+    # The tick was still running, so the later ones were missed (skip)
+    assert started == [['ETH']] and cancelled == [['ETH']]
+    assert schedule.entries['ETH'].missed >= 3
@@ -0,0 +1,73 @@
+import sqlite3
+
+import db
+import settings
+from tests.conftest import table
+
+NOW = 1_790_000_000
+
+
+def legacy_database(path):
+    """
+    Creates the database of the first version of the program: a single eth_data table, with the latest prices
+    (all the interval columns set) and the points of the intervals (only the column of their interval set)
+    """
+
+    conn = sqlite3.connect(path)
+    conn.execute("""CREATE TABLE eth_data (
+        timestamp INTEGER NOT NULL UNIQUE PRIMARY KEY,
+        price REAL NOT NULL,
+        hour REAL,
+        day REAL,
+        week REAL,
+        month REAL,
+        year REAL
+    );""")
+
+    rows = [(NOW - 60 * i, 2000 + i * 0.01, 0.01, 0.02, 0.03, 0.04, 0.05) for i in range(10)]
+    for column, newest, step in [('hour', NOW - 3600, 10), ('day', NOW - 3601, 300), ('year', NOW - 3602, 86400)]:
+        rows += [(newest - step * i, 1900.5 + i, *[0.1 if x == column else None for x in db.INTERVALS]) for i in range(20)]
+
+    conn.executemany("INSERT INTO eth_data VALUES (?, ?, ?, ?, ?, ?, ?);", rows)
+    conn.commit()
+    conn.close()
+
+    return rows
+
+
+def test_the_legacy_table_is_migrated_to_the_current_version(database_path):
+    rows = legacy_database(database_path)
+
+    db.init_db()
+
+    with db.reader() as conn:
+        assert conn.execute("PRAGMA user_version;").fetchone()[0] == len(db.migrations)
+        tables = {name for name, in conn.execute("SELECT name from sqlite_master where type = 'table';")}
+
+    assert 'eth_data' not in tables
+    assert {'assets', 'ticks', 'percent_changes', 'high_water', 'candles', 'archived_months', 'indicators', 'gaps'} <= tables
+
+    assert table('assets', 'asset_id') == [(1, 'ETH', settings.assets.get('ETH'), settings.currency, 2)]
+    # The prices are scaled integers now
+    assert table('ticks', 'timestamp') == sorted((1, timestamp, round(price * 100)) for timestamp, price, *_ in rows)
+
+    # The marks of the intervals come from the rows that only have their column set
+    marks = {interval: timestamp for _, interval, timestamp in table('high_water', 'interval')}
+    assert marks == {db.INTERVALS.index('hour'): NOW - 3600, db.INTERVALS.index('day'): NOW - 3601,
+                     db.INTERVALS.index('year'): NOW - 3602}
+
+    # The derived tables are built from the migrated ticks
+    with db.reader() as conn:
+        assert conn.execute("SELECT count(*) from percent_changes where interval = ?;", (db.INTERVALS.index('hour'),)).fetchone()[0] == 30
+        assert conn.execute("SELECT sum(count) from candles where size = 60;").fetchone()[0] == len(rows)
+        assert conn.execute("SELECT count(*) from gaps;").fetchone()[0] > 0
+
+
+def test_a_current_database_is_left_as_it_is(database):
+    db.get_writer().close()
+
+    conn = db.connect(database)
+    before = conn.execute("SELECT sql from sqlite_master order by name;").fetchall()
+    db.upgrade(conn.cursor())
+    assert conn.execute("SELECT sql from sqlite_master order by name;").fetchall() == before
+    conn.close()
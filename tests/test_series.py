@@ -0,0 +1,56 @@
+import time
+
+import numpy as np
+
+import db
+import series
+import archive
+from benchmarks.payload import price_document, shifted
+from tests.conftest import store
+
+NOW = int(time.time())
+
+
+def stored(base='ETH'):
+    with db.reader() as conn:
+        timestamps, prices = archive.query_range(conn.cursor(), base, 0)
+
+    return timestamps, prices
+
+
+def assert_mirrors_the_db():
+    timestamps, prices = series.load('ETH')
+    expected = stored()
+
+    assert np.array_equal(timestamps, expected[0]) and np.allclose(prices, expected[1])
+
+
+def test_the_files_follow_new_older_and_archived_ticks(database):
+    first = price_document(now=NOW, seed=8)
+    store(first)
+    assert_mirrors_the_db()
+
+    # Newer ticks are appended
+    store(shifted(first, 120, latest=2100))
+    assert_mirrors_the_db()
+
+    # Older ticks (e.g. a backfill) make the next sync rebuild the files
+    store(price_document(now=NOW - 3 * 86400, seed=9))
+    assert_mirrors_the_db()
+
+    # Moving ticks into the archive doesn't change them
+    archive.run_archive(60)
+    assert_mirrors_the_db()
+
+
+def test_count_ticks_matches_the_stored_ticks(database):
+    store(price_document(now=NOW, seed=10))
+    archive.run_archive(60)
+    timestamps, _ = stored()
+
+    with db.reader() as conn:
+        cursor = conn.cursor()
+        asset_id, _ = db.get_asset(cursor, 'ETH')
+
+        for until in np.r_[timestamps[::97], timestamps[-1], timestamps[0] - 1]:
+            assert series.count_ticks(cursor, asset_id, 'ETH', int(until)) == np.searchsorted(timestamps, until, side='right')
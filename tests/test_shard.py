@@ -0,0 +1,118 @@
+import json
+import time
+from threading import Thread, Event
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import db
+import settings
+from shard import Parser, Supervisor, shard_of, split
+from benchmarks.payload import price_document
+from tests.conftest import store, table
+
+NOW = 1_790_000_000
+
+
+def test_the_coins_are_split_by_a_stable_hash():
+    assets = {f"C{idx}": f"c{idx}" for idx in range(50)}
+    shares = split(assets, 4)
+
+    assert sorted(base for share in shares for base in share) == sorted(assets)
+    assert all(shard_of(base, 4) == idx for idx, share in enumerate(shares) for base in share)
+    # crc32, not hash(): the same between the runs
+    assert shard_of('ETH', 4) == 3
+
+
+def test_the_parser_leaves_the_filtering_to_the_writer(database):
+    data = price_document(now=NOW, seed=13)
+    parser = Parser(['ETH'])
+
+    # Nothing stored yet: every point is parsed
+    first, = parser([data])
+    points = sum(len(timestamps) for timestamps, _, _ in first['intervals'].values())
+    assert points == sum(len(data['prices'][key]['prices']) for key in db.INTERVALS)
+
+    # A write that never made it (rolled back, or lost with a worker): the points are parsed again
+    again, = parser([data])
+    assert sum(len(timestamps) for timestamps, _, _ in again['intervals'].values()) == points
+
+    # Once written, the marks are read back and the stored points are skipped
+    store(data)
+    stored, = parser([data])
+    assert stored['intervals'] == {}
+
+    parser.close()
+
+
+class Upstream(ThreadingHTTPServer):
+    """
+    The price endpoint in a thread: a new document (a new latest price) on every request
+    """
+
+    def __init__(self):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(handler):
+                base_id = handler.path.split('/')[-1].split('?')[0]
+                body = json.dumps({'data': price_document(base_id.upper(), base_id, start_price=100 + time.time() % 100)}).encode()
+
+                handler.send_response(200)
+                handler.send_header('Content-Type', 'application/json')
+                handler.send_header('Content-Length', str(len(body)))
+                handler.end_headers()
+                handler.wfile.write(body)
+
+            def log_message(handler, *args):
+                pass
+
+        super().__init__(('127.0.0.1', 0), Handler)
+        Thread(target=self.serve_forever, daemon=True).start()
+
+
+def wait_for(condition, timeout=30):
+    end = time.monotonic() + timeout
+    while time.monotonic() < end:
+        if condition():
+            return True
+        time.sleep(0.2)
+    return False
+
+
+def stored_coins():
+    with db.reader() as conn:
+        return {base for base, in conn.execute("SELECT base from assets join ticks using (asset_id) group by base;")}
+
+
+def ticks():
+    with db.reader() as conn:
+        return conn.execute("SELECT count(*) from ticks;").fetchone()[0]
+
+
+def test_the_workers_collect_into_the_single_writer(database, monkeypatch):
+    upstream = Upstream()
+    monkeypatch.setattr(settings, 'prices_url', f"http://127.0.0.1:{upstream.server_address[1]}/prices/{{base_id}}?base={{currency}}")
+    monkeypatch.setattr(settings, 'collect_period', 1)
+    monkeypatch.setattr(settings, 'cache_ttl', 0)
+
+    assets = {f"C{idx}": f"c{idx}" for idx in range(6)}
+    supervisor = Supervisor(assets, 2, max_backoff=1)
+    stopping = Event()
+    runner = Thread(target=supervisor.run, args=(stopping,))
+    runner.start()
+
+    try:
+        assert wait_for(lambda: stored_coins() == set(assets))
+
+        # A worker that dies is started again, and its coins keep coming
+        killed = supervisor.workers[0]
+        killed.kill()
+        assert wait_for(lambda: supervisor.workers[0] is not killed and supervisor.workers[0].is_alive())
+
+        before = ticks()
+        assert wait_for(lambda: ticks() > before)
+    finally:
+        stopping.set()
+        runner.join(30)
+        upstream.shutdown()
+
+    assert not runner.is_alive()
+    assert not any(process.is_alive() for process in supervisor.workers)
+    assert len(table('assets', 'asset_id')) == len(assets)